@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+RPG Game balance simulator - Monte Carlo win rates untuk class, level, gear
+Jalankan: python balance_sim.py [--trials 20000] [--levels 1 5 10 20] [--out balance.csv]
+
+Every class is put at every level and gear tier against every monster
+(hunt) and every class at the same level and tier (pvp), using the combat
+formulas the server uses. Each row of the CSV is one matchup: win rate and
+the average HP the player lost, over --trials fights. Rows are spread over
+a process pool, one task per class/level/gear combination.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import os
+import random
+import time
+
+import combat
+from server import CLASSES, MONSTERS, SHOP_ITEMS
+
+# Weapon and armor worn at each gear tier
+GEAR = {
+    'none': (None, None),
+    'iron': ('Iron Sword', 'Iron Armor'),
+    'steel': ('Steel Sword', 'Steel Armor'),
+    'dragon': ('Dragon Sword', 'Dragon Armor'),
+}
+
+COLUMNS = ['mode', 'class', 'level', 'gear', 'opponent', 'trials', 'win_rate', 'avg_hp_lost', 'hp_lost_pct']
+
+def build(char_class, level, gear):
+    """Stats of a character after level-1 level ups, wearing a gear tier."""
+    base = CLASSES[char_class]
+    weapon, armor = GEAR[gear]
+    hp = base['hp'] + 10 * (level - 1)
+    atk = base['atk'] + 2 * (level - 1) + (SHOP_ITEMS[weapon]['atk'] if weapon else 0)
+    defense = base['def'] + (level - 1) + (SHOP_ITEMS[armor]['def'] if armor else 0)
+    return atk, defense, hp
+
+def simulate(task):
+    char_class, level, gear, trials, seed = task
+    rng = random.Random(seed)
+    atk, defense, hp = build(char_class, level, gear)
+    rows = []
+
+    for name, monster in MONSTERS.items():
+        wins, lost = combat.hunt_trials(atk, defense, hp, monster['atk'], monster['def'], monster['hp'],
+                                        trials, rng)
+        rows.append(row('hunt', char_class, level, gear, name, trials, wins, lost, hp))
+
+    for other in CLASSES:
+        o_atk, o_def, o_hp = build(other, level, gear)
+        wins, lost = combat.pvp_trials(atk, defense, hp, o_atk, o_def, o_hp, trials, rng)
+        rows.append(row('pvp', char_class, level, gear, other, trials, wins, lost, hp))
+    return rows
+
+def row(mode, char_class, level, gear, opponent, trials, wins, lost, hp):
+    return [mode, char_class, level, gear, opponent, trials,
+            round(wins / trials, 4), round(lost / trials, 2), round(100.0 * lost / trials / hp, 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo balance tables for classes and monsters')
+    parser.add_argument('--trials', type=int, default=20000, help='fights per matchup')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 5, 10, 20, 30])
+    parser.add_argument('--gear', nargs='+', choices=list(GEAR), default=list(GEAR))
+    parser.add_argument('--classes', nargs='+', choices=list(CLASSES), default=list(CLASSES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='balance.csv')
+    args = parser.parse_args()
+
+    tasks = [
+        (char_class, level, gear, args.trials, args.seed * 1000003 + i)
+        for i, (char_class, level, gear) in enumerate(
+            (c, l, g) for c in args.classes for l in args.levels for g in args.gear
+        )
+    ]
+
+    started = time.time()
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        results = list(pool.map(simulate, tasks))
+    elapsed = time.time() - started
+
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for rows in results:
+            writer.writerows(rows)
+
+    fights = sum(len(rows) for rows in results) * args.trials
+    backend = 'numpy' if combat.numpy is not None else 'pure Python'
+    print(f"[✓] {fights:,} fights in {elapsed:.1f}s ({backend}), {len(tasks)} tasks -> {args.out}")
+
+    # Quick look: hunt win rate per class at the lowest level, no gear
+    level, gear = args.levels[0], args.gear[0]
+    print(f"\nHunt win rate, level {level}, gear {gear}:")
+    print(f"{'':12}" + ''.join(f'{name:>10}' for name in MONSTERS))
+    for rows in results:
+        hunts = [r for r in rows if r[0] == 'hunt' and r[2] == level and r[3] == gear]
+        if hunts:
+            print(f'{hunts[0][1]:12}' + ''.join(f'{r[6]:>10.1%}' for r in hunts))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: handlers and storage at 1k to 1M players
+Jalankan: python benchmarks/bench.py [--sizes 1000 10000 100000 1000000] [--out run.json]
+          python benchmarks/bench.py --compare base.json run.json [--threshold 20]
+
+Every size gets a synthetic snapshot (same seed, same players), cached in
+--data-dir and copied before each run so every run starts from the same
+file. Handlers are called through GameServer.process(), without sockets,
+so dispatch and middleware are part of what is measured:
+
+  load_data     GameDatabase.load_data() on the snapshot
+  server_init   GameServer() on the loaded database (leaderboards etc.)
+  hunt, pvp     random players, healed before each call (not timed)
+  leaderboard   top 20 of each board in turn
+  rank_around   random player, radius 5
+  buy_item      players carrying --inventory items, Health Potion
+  sell_item     the potions just bought, behind the filler items
+  save_player   GameDatabase.save_player() of a random player
+
+Each operation is timed on its own, with the garbage collector off, and
+each benchmark runs --rounds times; the round with the best p50 is kept.
+The JSON has ops/s and p50/p95/p99 in microseconds. --compare flags every p50 that got slower by more than
+--threshold percent and exits 1 if there are any. Checkpoints are off
+unless --compact-every is given, so they don't land in random samples.
+"""
+
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import GameServer, GameDatabase, Leaderboards
+from fixtures import make_player
+import combat
+import gamelog
+
+FILLER = ['Mana Potion', 'Goblin Dagger', 'Bone Sword', 'Troll Ring', 'Dark Amulet', 'Iron Sword']
+ITEM = 'Health Potion'
+# Players 0..SHOPPERS-1 carry the large inventories
+SHOPPERS = 100
+BENCHES = ['load_data', 'server_init', 'hunt', 'pvp', 'leaderboard', 'rank_around',
+           'buy_item', 'sell_item', 'save_player']
+
+def bench_player(i, rng, inventory):
+    # Shoppers get a big inventory of filler and endless gold
+    if i < SHOPPERS:
+        return make_player(i, rng, [rng.choice(FILLER) for _ in range(inventory)], 10 ** 9)
+    return make_player(i, rng, [rng.choice(FILLER + [ITEM]) for _ in range(rng.randint(2, 40))])
+
+def build_snapshot(path, size, seed, inventory):
+    """Write size players straight into a snapshot file."""
+    rng = random.Random(seed)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(GameDatabase.SNAPSHOT_MAGIC)
+        for i in range(size):
+            player = bench_player(i, rng, inventory)
+            name = player['name'].encode()
+            blob = pickle.dumps(player, pickle.HIGHEST_PROTOCOL)
+            f.write(struct.pack('>IH', len(name) + len(blob), len(name)))
+            f.write(name)
+            f.write(blob)
+    os.replace(tmp, path)
+
+def summarize(samples):
+    ordered = sorted(samples)
+    total = sum(ordered)
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6
+    return {
+        'ops': len(ordered),
+        'ops_per_s': len(ordered) / total if total else 0.0,
+        'mean_us': total / len(ordered) * 1e6,
+        'p50_us': pct(0.50),
+        'p95_us': pct(0.95),
+        'p99_us': pct(0.99),
+    }
+
+def timed(ops, before, call):
+    samples = []
+    clock = time.perf_counter
+    # Like timeit: a collection landing in one sample is noise, not signal
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(ops):
+            arg = before(i)
+            started = clock()
+            call(arg)
+            samples.append(clock() - started)
+    finally:
+        gc.enable()
+    return samples
+
+def check(response):
+    if response.get('status') != 'ok':
+        raise RuntimeError(response.get('msg'))
+
+def bench_size(args, size):
+    snapshot = os.path.join(args.data_dir, f'players_{size}_s{args.seed}_i{args.inventory}.pkl')
+    if not os.path.exists(snapshot):
+        print(f"[*] Building {size:,} players -> {snapshot}")
+        build_snapshot(snapshot, size, args.seed, args.inventory)
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as work:
+        path = os.path.join(work, 'players.pkl')
+        shutil.copy(snapshot, path)
+        db = GameDatabase(path, compact_every=args.compact_every)
+        loads = args.load_repeat or max(1, min(5, 200000 // size))
+        results['load_data'] = summarize(timed(loads, lambda i: None, lambda _: db.load_data()))
+
+        started = time.perf_counter()
+        server = GameServer(db=db, log=gamelog.AsyncLogger(os.devnull))
+        results['server_init'] = summarize([time.perf_counter() - started])
+
+        rng = random.Random(args.seed)
+        random.seed(args.seed)
+        names = list(db.players)
+
+        def heal(name):
+            # Straight to the slot: no version bump, nothing saved
+            player = db.players[name]
+            player.hp = player.max_hp
+            return name
+
+        def hunt(i):
+            return {'cmd': 'hunt', 'player': heal(rng.choice(names)), 'difficulty': 'goblin'}
+
+        def pvp(i):
+            a, b = rng.sample(names, 2)
+            return {'cmd': 'pvp', 'player': heal(a), 'opponent': heal(b)}
+
+        boards = list(Leaderboards.BOARDS)
+        # Every shopper buys ops/SHOPPERS potions, then sells them again.
+        # They sit behind the filler, so each sell scans the inventory.
+        shoppers = names[:min(SHOPPERS, size)]
+
+        def process(data):
+            check(server.process(data))
+
+        cases = [
+            ('hunt', hunt, process),
+            ('pvp', pvp, process),
+            ('leaderboard', lambda i: {'cmd': 'leaderboard', 'board': boards[i % len(boards)]}, process),
+            ('rank_around', lambda i: {'cmd': 'rank_around', 'player': rng.choice(names), 'radius': 5}, process),
+            ('buy_item', lambda i: {'cmd': 'buy_item', 'player': shoppers[i % len(shoppers)], 'item': ITEM}, process),
+            ('sell_item', lambda i: {'cmd': 'sell_item', 'player': shoppers[i % len(shoppers)], 'item': ITEM}, process),
+            ('save_player', lambda i: db.players[rng.choice(names)], db.save_player),
+        ]
+        # Best p50 out of --rounds, the way timeit suggests taking the min
+        for _ in range(args.rounds):
+            for name, before, run in cases:
+                summary = summarize(timed(args.ops, before, run))
+                if name not in results or summary['p50_us'] < results[name]['p50_us']:
+                    results[name] = summary
+
+        db.close()
+        server.log.close()
+        del server, db, names
+        gc.collect()
+    return results
+
+def meta(args):
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': numpy_version if combat.numpy is not None else None,
+        'seed': args.seed,
+        'ops': args.ops,
+        'rounds': args.rounds,
+        'inventory': args.inventory,
+        'compact_every': args.compact_every,
+    }
+
+def print_results(size, results):
+    print(f"\n{size:,} players")
+    print(f"{'benchmark':14}{'ops':>7}{'ops/s':>11}{'p50 us':>11}{'p95 us':>11}{'p99 us':>11}")
+    for name in BENCHES:
+        r = results[name]
+        print(f"{name:14}{r['ops']:>7}{r['ops_per_s']:>11.0f}{r['p50_us']:>11.1f}{r['p95_us']:>11.1f}{r['p99_us']:>11.1f}")
+
+def compare(base_file, new_file, threshold):
+    with open(base_file) as f:
+        base = json.load(f)['results']
+    with open(new_file) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'size':>9}  {'benchmark':14}{'base p50':>11}{'new p50':>11}{'change':>9}")
+    for size in sorted(set(base) & set(new), key=int):
+        for name in BENCHES:
+            if name not in base[size] or name not in new[size]:
+                continue
+            old_us, new_us = base[size][name]['p50_us'], new[size][name]['p50_us']
+            change = (new_us - old_us) / old_us * 100 if old_us else 0.0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            elif change < -threshold:
+                flag = '  faster'
+            print(f"{int(size):>9}  {name:14}{old_us:>11.1f}{new_us:>11.1f}{change:>+8.1f}%{flag}")
+
+    print(f"\n{regressions} regression(s) over {threshold:g}%")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Handler and storage benchmarks across player counts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--ops', type=int, default=2000, help='timed calls per handler benchmark')
+    parser.add_argument('--rounds', type=int, default=3, help='runs of each benchmark, the best p50 is kept')
+    parser.add_argument('--inventory', type=int, default=1000, help='items carried by the buy/sell players')
+    parser.add_argument('--load-repeat', type=int, help='load_data() runs (default: fewer for big sizes)')
+    parser.add_argument('--compact-every', type=int, default=10 ** 9, help='journal records per checkpoint')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'rpg-bench'),
+                        help='where synthetic snapshots are cached')
+    parser.add_argument('--out', help='write the results as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two JSON runs')
+    parser.add_argument('--threshold', type=float, default=20, help='p50 slowdown in %% that counts as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {'meta': meta(args), 'results': {}}
+    for size in args.sizes:
+        results = bench_size(args, size)
+        report['results'][str(size)] = results
+        print_results(size, results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[✓] Results written to {args.out}")
+
+if __name__ == '__main__':
+    main()
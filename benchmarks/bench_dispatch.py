@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Dispatch benchmark: registry + middleware vs the old if/elif chain
+Jalankan: python benchmarks/bench_dispatch.py [--number 200000]
+
+The old chain is rebuilt here with the original command order. It runs the
+same per-handler player lookup, so the difference is the dispatch overhead
+(plus what the middleware adds: timing, validation, error handling).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import GameServer, GameDatabase
+
+LEGACY_ORDER = [
+    'register', 'login', 'hunt', 'pvp', 'shop_list', 'buy_item', 'sell_item',
+    'quest_list', 'accept_quest', 'complete_quest', 'skill_list', 'use_skill',
+    'dungeon', 'daily_reward', 'stats', 'inventory', 'equip', 'rest',
+    'leaderboard', 'players_online',
+]
+
+def legacy_process(server, data):
+    cmd = data.get('cmd')
+    # Same shape as the old chain: compare one name after another
+    for name in LEGACY_ORDER:
+        if cmd == name:
+            break
+    else:
+        return {'status': 'error', 'msg': 'Unknown command'}
+    
+    if cmd == 'login':
+        player = server.db.get_player(data.get('name'))
+        if not player:
+            return {'status': 'error', 'msg': 'Player not found'}
+        return {'status': 'ok', 'msg': 'Login success', 'player': player}
+    if cmd == 'shop_list':
+        return {'status': 'ok', 'shop': server.shop_items}
+    player = server.db.get_player(data.get('player'))
+    if not player:
+        return {'status': 'error', 'msg': 'Player not found'}
+    return {'status': 'ok', 'player': player}
+
+def main():
+    parser = argparse.ArgumentParser(description='Command dispatch benchmark')
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server = GameServer(db=GameDatabase(os.path.join(tmpdir, 'bench.pkl')))
+        server.process({'cmd': 'register', 'name': 'bench', 'class': 'Warrior'})
+        
+        cases = [
+            ('login (2nd branch)', {'cmd': 'login', 'name': 'bench'}),
+            ('shop_list (5th)', {'cmd': 'shop_list'}),
+            ('stats (15th)', {'cmd': 'stats', 'player': 'bench'}),
+            ('unknown command', {'cmd': 'nope'}),
+        ]
+        
+        print(f"{'Command':<22} {'if/elif ns':>11} {'registry ns':>12} {'delta ns':>9}")
+        print("-" * 58)
+        for label, data in cases:
+            legacy = timeit.timeit(lambda: legacy_process(server, data), number=args.number) / args.number
+            registry = timeit.timeit(lambda: server.process(data), number=args.number) / args.number
+            print(f"{label:<22} {legacy * 1e9:>11.0f} {registry * 1e9:>12.0f} {(registry - legacy) * 1e9:>+9.0f}")
+        server.db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: plain player dicts vs PlayerRecord
+Jalankan: python benchmarks/bench_memory.py [--sizes 10000 100000 1000000]
+
+Every player is loaded from its own pickled record, the way the journal
+and the SQLite backend do it. That means dict players get their own copies
+of every item and class name, just like in production.
+"""
+
+import argparse
+import gc
+import os
+import pickle
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import PlayerRecord
+from fixtures import make_player
+
+def measure(blobs, build):
+    gc.collect()
+    tracemalloc.start()
+    players = {}
+    for blob in blobs:
+        player = build(pickle.loads(blob))
+        players[player['name']] = player
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del players
+    gc.collect()
+    return current
+
+def main():
+    parser = argparse.ArgumentParser(description='Player representation memory benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    print(f"{'Players':>10} {'dict MB':>10} {'record MB':>10} {'saved':>7} {'B/dict':>8} {'B/record':>9}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        blobs = [pickle.dumps(make_player(i, rng), pickle.HIGHEST_PROTOCOL) for i in range(size)]
+        
+        dict_bytes = measure(blobs, lambda data: data)
+        record_bytes = measure(blobs, PlayerRecord.from_dict)
+        del blobs
+        
+        saved = 1 - record_bytes / dict_bytes
+        print(f"{size:>10} {dict_bytes / 2**20:>10.1f} {record_bytes / 2**20:>10.1f} {saved:>6.0%} "
+              f"{dict_bytes // size:>8} {record_bytes // size:>9}")
+
+if __name__ == '__main__':
+    main()
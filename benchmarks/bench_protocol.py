@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Protocol benchmark: bytes on the wire and encode/decode CPU, JSON vs binary
+Jalankan: python benchmarks/bench_protocol.py [--number 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from server import GameServer, GameDatabase, json_default
+
+def sample_messages(tmpdir):
+    server = GameServer(db=GameDatabase(os.path.join(tmpdir, 'bench.pkl')))
+    server.process({'cmd': 'register', 'name': 'bench', 'class': 'Warrior'})
+    for i in range(20):
+        server.process({'cmd': 'register', 'name': f'rival{i}', 'class': 'Mage'})
+    
+    player = server.db.get_player('bench')
+    player['gold'] = 10 ** 6
+    for _ in range(300):
+        server.process({'cmd': 'buy_item', 'player': 'bench', 'item': 'Health Potion'})
+    
+    monsters = server.monsters
+    server.monsters = dict(monsters, dragon=dict(monsters['dragon'], hp=2000))
+    hunt = server.process({'cmd': 'hunt', 'player': 'bench', 'difficulty': 'dragon'})
+    server.monsters = monsters
+    
+    return [
+        ('request: hunt', {'cmd': 'hunt', 'player': 'bench', 'difficulty': 'goblin'}),
+        ('response: rest', server.process({'cmd': 'rest', 'player': 'bench'})),
+        ('response: long hunt log', hunt),
+        ('response: inventory 300', server.process({'cmd': 'inventory', 'player': 'bench'})),
+        ('response: leaderboard', server.process({'cmd': 'leaderboard'})),
+        ('response: shop_list', server.process({'cmd': 'shop_list'})),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='Wire encoding benchmark')
+    parser.add_argument('--number', type=int, default=2000, help='iterations per measurement')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        messages = sample_messages(tmpdir)
+    
+    codecs = [
+        ('json', protocol.Protocol(2, protocol.ENCODING_JSON, json_default)),
+        ('binary', protocol.Protocol(2, protocol.ENCODING_BINARY, json_default)),
+    ]
+    
+    print(f"{'Message':<26} {'Codec':<7} {'Bytes':>8} {'Legacy?':>8} {'enc us':>8} {'dec us':>8}")
+    print("-" * 70)
+    for label, message in messages:
+        for name, proto in codecs:
+            payload = proto.encode(message)
+            fits = 'yes' if len(payload) <= protocol.LEGACY_MAX else 'NO'
+            enc = timeit.timeit(lambda: proto.encode(message), number=args.number) / args.number
+            dec = timeit.timeit(lambda: proto.decode(payload), number=args.number) / args.number
+            print(f"{label:<26} {name:<7} {len(payload) + 4:>8} {fits:>8} {enc * 1e6:>8.1f} {dec * 1e6:>8.1f}")
+
+if __name__ == '__main__':
+    main()
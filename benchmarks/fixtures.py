@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark fixtures - pemain sintetis untuk semua benchmark
+Dipakai benchmarks/bench.py dan benchmarks/bench_memory.py
+
+make_player() builds plain player dicts the way they come out of a
+snapshot, so every benchmark measures the same kind of player.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import CLASSES
+
+ITEMS = [
+    'Health Potion', 'Mana Potion', 'Iron Sword', 'Steel Sword', 'Dragon Sword',
+    'Iron Armor', 'Goblin Dagger', 'Troll Ring', 'Bone Sword', 'Dark Amulet',
+]
+
+def make_player(i, rng, inventory=None, gold=None):
+    """Player number i. inventory and gold default to something random."""
+    level = rng.randint(1, 60)
+    char_class = rng.choice(list(CLASSES))
+    base = CLASSES[char_class]
+    if inventory is None:
+        inventory = [rng.choice(ITEMS) for _ in range(rng.randint(2, 40))]
+    if gold is None:
+        gold = rng.randint(0, 5000)
+    return {
+        'name': f'player{i}',
+        'class': char_class,
+        'level': level,
+        'exp': rng.randint(0, level * 100 - 1),
+        'exp_max': level * 100,
+        'hp': base['hp'] + level * 10, 'max_hp': base['hp'] + level * 10,
+        'mana': 100, 'max_mana': 100,
+        'atk': base['atk'] + level * 2, 'def': base['def'] + level,
+        'speed': 10,
+        'gold': gold,
+        'inventory': inventory,
+        'weapon': rng.choice([None, 'Iron Sword', 'Steel Sword']),
+        'armor': rng.choice([None, 'Iron Armor']),
+        'ring': None,
+        'kills': rng.randint(0, 1000), 'deaths': rng.randint(0, 100), 'battles': rng.randint(0, 1100),
+        'pvp_wins': rng.randint(0, 500), 'pvp_loses': rng.randint(0, 500),
+        'active_quests': [1], 'completed_quests': [2, 3],
+        'daily_reward_time': 0, 'dungeon_level': rng.randint(0, 10),
+        'skills': ['Quick Strike'],
+        'created': '2024-01-01T00:00:00',
+        'version': 0,
+    }
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Stress check: gold and items are conserved under concurrent requests
+Jalankan: python benchmarks/stress_locks.py [--threads 16] [--ops 2000] [--players 6]
+
+Many threads hammer a handful of players with buy/sell, pvp, rest and
+atomic batches through GameServer.process(). Every successful response is
+booked in a ledger (gold and Health Potions per player). At the end each
+player's stored state must match its starting state plus the ledger.
+Lost updates or duplicated items show up as mismatches.
+
+--no-locks runs the same load without the player lock middleware, to show
+that the check does catch races.
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import GameServer, GameDatabase
+import gamelog
+
+ITEM = 'Health Potion'
+START_GOLD = 10 ** 7
+
+class Ledger:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.gold = collections.Counter()
+        self.items = collections.Counter()
+
+    def book(self, server, data, response):
+        if response.get('status') != 'ok':
+            return
+        cmd = data['cmd']
+        with self.lock:
+            if cmd == 'buy_item':
+                self.gold[data['player']] -= server.shop_items[ITEM]['cost']
+                self.items[data['player']] += 1
+            elif cmd == 'sell_item':
+                self.gold[data['player']] += int(server.shop_items[ITEM]['cost'] * 0.5)
+                self.items[data['player']] -= 1
+            elif cmd == 'pvp':
+                winner = data['player'] if response['winner'] else data['opponent']
+                self.gold[winner] += response['reward']
+        if cmd == 'batch':
+            for sub, result in zip(data['commands'], response['results']):
+                self.book(server, sub, result)
+
+def worker(server, ledger, names, ops, seed):
+    rng = random.Random(seed)
+    for _ in range(ops):
+        name = rng.choice(names)
+        roll = rng.random()
+        if roll < 0.3:
+            data = {'cmd': 'buy_item', 'player': name, 'item': ITEM}
+        elif roll < 0.6:
+            data = {'cmd': 'sell_item', 'player': name, 'item': ITEM}
+        elif roll < 0.75:
+            data = {'cmd': 'pvp', 'player': name, 'opponent': rng.choice(names)}
+        elif roll < 0.85:
+            data = {'cmd': 'rest', 'player': name}
+        else:
+            other = rng.choice(names)
+            data = {'cmd': 'batch', 'player': name, 'atomic': True, 'commands': [
+                {'cmd': 'buy_item', 'player': name, 'item': ITEM},
+                {'cmd': 'sell_item', 'player': other, 'item': ITEM},
+                {'cmd': 'pvp', 'player': name, 'opponent': other},
+            ]}
+        ledger.book(server, data, server.process(data))
+
+def main():
+    parser = argparse.ArgumentParser(description='Gold/item conservation under contention')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=2000, help='requests per thread')
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--no-locks', action='store_true', help='drop the player lock middleware')
+    args = parser.parse_args()
+
+    # Switch threads as often as possible so races actually happen
+    sys.setswitchinterval(1e-6)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GameDatabase(os.path.join(tmp, 'players.pkl'))
+        server = GameServer(db=db, log=gamelog.AsyncLogger(os.devnull))
+        if args.no_locks:
+            server.middleware = [m for m in server.middleware if m[0] != server.lock_players]
+            for command in list(server.commands.values()) + [server.unknown]:
+                server.build_pipeline(command)
+
+        names = [f'p{i}' for i in range(args.players)]
+        start = {}
+        for name in names:
+            server.process({'cmd': 'register', 'name': name, 'class': 'Warrior'})
+            player = db.get_player(name)
+            player['gold'] = START_GOLD
+            db.save_player(player)
+            start[name] = (player['gold'], player['inventory'].count(ITEM))
+
+        ledger = Ledger()
+        threads = [
+            threading.Thread(target=worker, args=(server, ledger, names, args.ops, i))
+            for i in range(args.threads)
+        ]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        mismatches = 0
+        for name in names:
+            player = db.get_player(name)
+            gold, items = start[name]
+            expected = (gold + ledger.gold[name], items + ledger.items[name])
+            actual = (player['gold'], player['inventory'].count(ITEM))
+            ok = expected == actual
+            mismatches += not ok
+            print(f"{name}: gold {actual[0]:>10} (expected {expected[0]:>10})  "
+                  f"potions {actual[1]:>5} (expected {expected[1]:>5})  {'ok' if ok else 'MISMATCH'}")
+        db.close()
+
+    total = args.threads * args.ops
+    print(f"\n{total} requests in {elapsed:.2f}s, {'no locks' if args.no_locks else 'locks'}: "
+          f"{'conserved' if not mismatches else f'{mismatches} players out of balance'}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -6,17 +6,31 @@ Simpan sebagai: client.py
 Jalankan: python client.py
 """
 
-import socket
 import json
 import os
 import time
 import sys
+import connection
+
+# Shop, quest and skill lists from earlier sessions, per server
+CATALOG_CACHE = os.path.join(os.path.expanduser('~'), '.rpg_catalogs.json')
+# What was played offline and has yet to reach the server
+OFFLINE_JOURNAL = os.path.join(os.path.expanduser('~'), '.rpg_offline.json')
+# The server takes at most this many per sync
+MAX_OFFLINE_ACTIONS = 500
 
 class RPGClient:
-    def __init__(self):
-        self.socket = None
+    def __init__(self, encoding='json', cache_file=CATALOG_CACHE, journal_file=OFFLINE_JOURNAL):
+        self.conn = None
+        self.encoding = encoding
         self.online = False
         self.player = None
+        self.cache_file = cache_file
+        self.server = None
+        self.catalogs = {}
+        self.catalog_versions = {}
+        self.journal_file = journal_file
+        self.journal = self.load_journal()
         
         self.classes = {
             '1': 'Warrior',
@@ -55,9 +69,13 @@ class RPGClient:
     
     def connect(self, host, port):
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((host, int(port)))
+            self.conn = connection.Connection(host, port, self.encoding)
+            self.conn.connect()
+            # After a reconnect the player is whatever the server has now
+            self.conn.on_login = self.logged_in
             self.online = True
+            self.server = f'{host}:{port}'
+            self.load_catalogs()
             print(f"[✓] Connected to {host}:{port}")
             time.sleep(1)
             return True
@@ -71,27 +89,207 @@ class RPGClient:
             return {'status': 'error', 'msg': 'Not connected'}
         
         try:
-            msg = json.dumps(data).encode()
-            size = str(len(msg)).zfill(4).encode()
-            self.socket.send(size + msg)
-            
-            size_data = self.socket.recv(4)
-            if not size_data:
-                return {'status': 'error', 'msg': 'Connection lost'}
-            
-            size = int(size_data.decode())
-            resp = b''
-            while len(resp) < size:
-                chunk = self.socket.recv(size - len(resp))
-                if not chunk:
-                    return {'status': 'error', 'msg': 'Connection lost'}
-                resp += chunk
-            
-            return json.loads(resp.decode())
-        except Exception as e:
+            resp = self.conn.request(self.with_version(data))
+        except connection.ConnectionLost as e:
             print(f"[ERROR] {e}")
-            self.online = False
+            self.online = self.conn.connected
             return {'status': 'error', 'msg': str(e)}
+        if 'delta' in resp:
+            self.apply_delta(resp.pop('delta'))
+            resp['player'] = self.player
+        return resp
+    
+    def pipeline(self, requests):
+        """Send several requests at once and wait for all the responses."""
+        if not self.online:
+            return [{'status': 'error', 'msg': 'Not connected'} for _ in requests]
+        
+        try:
+            responses = self.conn.pipeline([self.with_version(req) for req in requests])
+        except connection.ConnectionLost as e:
+            print(f"[ERROR] {e}")
+            self.online = self.conn.connected
+            return [{'status': 'error', 'msg': str(e)} for _ in requests]
+        
+        # Every delta is relative to the version we held before sending, so
+        # the newest one already contains the earlier ones
+        delta = None
+        for resp in responses:
+            if 'delta' in resp:
+                delta = resp.pop('delta')
+                resp['player'] = self.player
+        if delta:
+            self.apply_delta(delta)
+        return responses
+    
+    def poll_events(self):
+        """Pushes that have arrived so far, without blocking."""
+        if not self.online:
+            return []
+        return self.conn.poll_events()
+    
+    def subscribe(self, topics):
+        if not self.online or not self.conn.push_supported:
+            return {'status': 'error', 'msg': 'Server has no push support'}
+        return self.send({'cmd': 'subscribe', 'topics': topics})
+    
+    def show_events(self):
+        for event in self.poll_events():
+            data = event.get('data') or {}
+            if event['event'] == 'attacked':
+                outcome = 'you won' if data.get('won') else 'you lost'
+                print(f"[!] {data.get('by')} attacked you, {outcome} (rating {data.get('rating_change'):+d}, HP {data.get('hp')})")
+            elif event['event'] == 'daily_reward':
+                print("[*] Daily reward is ready")
+            elif event['event'] == 'message':
+                print(f"[{event['topic'][8:]}] {data.get('from')}: {data.get('text')}")
+            elif event['event'] == 'leaderboard':
+                print(f"[*] The {data.get('board')} leaderboard changed")
+    
+    def load_catalogs(self):
+        try:
+            with open(self.cache_file) as f:
+                self.catalogs = json.load(f).get(self.server, {})
+        except (OSError, ValueError, AttributeError):
+            self.catalogs = {}
+    
+    def save_catalogs(self):
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[self.server] = self.catalogs
+        try:
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            pass
+    
+    def catalog(self, name):
+        """The shop, quests or skills catalog, from the cache when it is current."""
+        cached = self.catalogs.get(name)
+        # Login told us the server's version: a matching copy needs no request
+        if cached and (cached['etag'] == self.catalog_versions.get(name) or not self.online):
+            return cached['data']
+        if not self.online:
+            print("[✗] Not available offline")
+            return None
+        
+        cmd = {'shop': 'shop_list', 'quests': 'quest_list', 'skills': 'skill_list'}[name]
+        request = {'cmd': cmd}
+        if cached:
+            request['etag'] = cached['etag']
+        resp = self.send(request)
+        if resp.get('status') != 'ok':
+            print(f"[✗] {resp.get('msg')}")
+            return None
+        if not resp.get('not_modified'):
+            cached = self.catalogs[name] = {'etag': resp['etag'], 'data': resp[name]}
+            self.save_catalogs()
+        self.catalog_versions[name] = cached['etag']
+        return cached['data']
+    
+    def logged_in(self, resp):
+        self.player = resp['player']
+        self.catalog_versions = resp.get('catalogs', {})
+        self.online = True
+    
+    # --- offline journal ---
+    # Online, the server hands out a journal id. Offline, actions go into
+    # the journal as [cmd, arg] and are shown with a local guess. Back
+    # online, the whole journal goes up in one sync_offline; the server
+    # replays it on its own seed and its answer replaces the guess.
+    
+    def load_journal(self):
+        try:
+            with open(self.journal_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save_journal(self):
+        try:
+            tmp = self.journal_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.journal, f)
+            os.replace(tmp, self.journal_file)
+        except OSError as e:
+            print(f"[!] Journal not saved: {e}")
+    
+    def start_journal(self):
+        """Sync what was played offline, then get a journal id for next time."""
+        name = self.player['name']
+        journal = self.journal
+        if journal and journal['actions']:
+            if journal['server'] != self.server or journal['name'] != name:
+                # Only one journal is kept; don't lose another character's
+                print(f"[!] {journal['name']} has offline progress to sync first, offline play not saved")
+                time.sleep(2)
+                return
+            self.sync_offline()
+            if journal['actions']:
+                return
+        resp = self.send({'cmd': 'offline_seed', 'player': name})
+        if resp.get('status') == 'ok':
+            self.journal = {'server': self.server, 'name': name, 'journal': resp['journal'],
+                            'player': self.player, 'actions': []}
+            self.save_journal()
+    
+    def sync_offline(self):
+        journal = self.journal
+        print(f"[*] Syncing {len(journal['actions'])} offline actions...")
+        resp = self.send({'cmd': 'sync_offline', 'player': journal['name'],
+                          'journal': journal.get('journal'), 'actions': journal['actions']})
+        if resp.get('status') == 'ok':
+            self.player = resp['player']
+            print(f"[✓] {resp['applied']} applied, {len(resp['rejected'])} rejected")
+            for index, msg in resp['rejected'][:5]:
+                print(f"  {journal['actions'][index][0]}: {msg}")
+            journal['journal'], journal['actions'] = resp['journal'], []
+        else:
+            print(f"[✗] {resp.get('msg')}")
+            # Already synced (the answer got lost) or replaced: nothing to retry
+            if resp.get('msg', '').startswith('Offline journal expired'):
+                journal['actions'] = []
+        self.save_journal()
+        time.sleep(2)
+    
+    def record(self, cmd, arg=None):
+        """Journal an offline action. False if offline progress isn't saved."""
+        journal = self.journal
+        if not journal or journal['name'] != self.player['name'] or len(journal['actions']) >= MAX_OFFLINE_ACTIONS:
+            return False
+        journal['actions'].append([cmd, arg] if arg is not None else [cmd])
+        journal['player'] = self.player
+        self.save_journal()
+        return True
+    
+    def batch(self, commands, atomic=False):
+        return self.send({
+            'cmd': 'batch',
+            'player': self.player['name'],
+            'commands': commands,
+            'atomic': atomic
+        })
+    
+    def with_version(self, data):
+        # Tell the server which version of our player we hold so it only
+        # sends back what changed
+        if self.player and 'version' in self.player and data.get('player') == self.player['name']:
+            data = dict(data, version=self.player['version'])
+        return data
+    
+    def apply_delta(self, delta):
+        self.player.update(delta['fields'])
+        for op, item in delta['inventory']:
+            if op == '+':
+                self.player['inventory'].append(item)
+            elif item in self.player['inventory']:
+                self.player['inventory'].remove(item)
+        self.player['version'] = delta['version']
     
     def main(self):
         while True:
@@ -124,9 +322,20 @@ class RPGClient:
     def offline_mode(self):
         self.clear()
         self.header("OFFLINE MODE")
-        print("Note: Progress will NOT be saved\n")
         self.online = False
-        input("Press Enter...")
+        journal = self.journal
+        if journal:
+            print(f"1. Continue as {journal['name']} (synced to {journal['server']} when you play online)")
+            print("2. New character (progress will NOT be saved)")
+            if input("\nChoice: ").strip() == '1':
+                self.server = journal['server']
+                self.player = journal['player']
+                self.load_catalogs()
+                self.game_loop()
+                return
+        else:
+            print("Note: Progress will NOT be saved\n")
+            input("Press Enter...")
         self.character_select()
     
     def character_select(self):
@@ -181,7 +390,7 @@ class RPGClient:
             })
             
             if resp.get('status') == 'ok':
-                self.player = resp['player']
+                self.logged_in(resp)
                 print(f"[✓] Created!")
                 time.sleep(2)
                 self.game_loop()
@@ -221,7 +430,7 @@ class RPGClient:
         resp = self.send({'cmd': 'login', 'name': name})
         
         if resp.get('status') == 'ok':
-            self.player = resp['player']
+            self.logged_in(resp)
             print("[✓] Logged in!")
             time.sleep(2)
             self.game_loop()
@@ -230,15 +439,23 @@ class RPGClient:
             time.sleep(2)
     
     def game_loop(self):
+        if self.online:
+            # Attacks and the daily reward reminder arrive as pushes
+            self.subscribe('player')
+            self.start_journal()
         while True:
             self.clear()
             self.header("GAME MENU")
             
             p = self.player
             mode = "ONLINE" if self.online else "OFFLINE"
+            journal = self.journal
+            if journal and journal['name'] == p['name'] and journal['actions']:
+                mode += f" | {len(journal['actions'])} actions to sync"
             print(f"{p['name']:20} | {p['class']:12} | Lvl {p['level']}")
             print(f"HP: {p['hp']}/{p['max_hp']} | ATK: {p['atk']} | DEF: {p['def']} | Gold: {p['gold']}")
             print(f"EXP: {p['exp']}/{p['exp_max']} | {mode}\n")
+            self.show_events()
             
             print("--- ADVENTURE ---")
             print("1. Hunt Monster       2. PVP Battle         3. Dungeon")
@@ -247,6 +464,9 @@ class RPGClient:
             print("\n--- SYSTEM ---")
             print("7. Quest              8. Skills             9. Daily Reward")
             print("10. Rest              11. Stats             12. Leaderboard")
+            print("13. Auto Hunt         14. Ranked PVP")
+            if not self.online and self.conn:
+                print("\nR. Reconnect")
             print("\n0. Logout")
             
             choice = input("\nChoice: ").strip()
@@ -257,7 +477,7 @@ class RPGClient:
                 self.pvp()
             elif choice == '3' and self.online:
                 self.dungeon()
-            elif choice == '4' and self.online:
+            elif choice == '4':
                 self.shop()
             elif choice == '5':
                 self.inventory()
@@ -275,7 +495,17 @@ class RPGClient:
                 self.stats()
             elif choice == '12' and self.online:
                 self.leaderboard()
+            elif choice == '13' and self.online:
+                self.auto_hunt()
+            elif choice == '14' and self.online:
+                self.ranked_pvp()
+            elif choice.upper() == 'R' and not self.online and self.conn:
+                self.reconnect()
             elif choice == '0':
+                # Offline play later starts from where we are now
+                if self.journal and self.journal['name'] == p['name']:
+                    self.journal['player'] = self.player
+                    self.save_journal()
                 break
     
     def hunt(self):
@@ -324,11 +554,64 @@ class RPGClient:
                 print(f"\n[✗ DEFEAT!]")
             
             self.player = resp['player']
+        elif self.record('hunt', difficulty):
+            print(f"\n[*] Hunt ({difficulty}) recorded. It is fought on the server when you reconnect.")
         else:
             print("Online only!")
         
         input("\nPress Enter...")
     
+    def auto_hunt(self):
+        self.clear()
+        self.header("AUTO HUNT")
+        
+        print("1. Goblin (Easy)      4. Dragon (Very Hard)")
+        print("2. Orc (Normal)       5. Skeleton (Easy)")
+        print("3. Troll (Hard)       6. Demon (Hard)")
+        print("0. Back")
+        
+        choice = input("\nChoice: ").strip()
+        
+        if choice not in self.monsters:
+            return
+        
+        try:
+            count = int(input("Battles (max 1000): ").strip() or 10)
+            stop_hp = int(input("Stop at HP % (default 30): ").strip() or 30)
+        except ValueError:
+            print("[✗] Invalid number")
+            time.sleep(1)
+            return
+        
+        print("\n[*] Hunting...")
+        resp = self.send({
+            'cmd': 'auto_hunt',
+            'player': self.player['name'],
+            'difficulty': self.monsters[choice],
+            'count': count,
+            'stop_hp': stop_hp
+        })
+        
+        if resp.get('status') != 'ok':
+            print(f"[✗] {resp.get('msg')}")
+            time.sleep(2)
+            return
+        
+        print(f"\nBattles: {resp['battles']}  Wins: {resp['wins']}")
+        print(f"  EXP: +{resp['exp']}")
+        print(f"  Gold: +{resp['gold']}")
+        for item, amount in resp['loot'].items():
+            print(f"  Loot: {item} x{amount}")
+        if resp['levelups']:
+            print(f"  [⭐ +{resp['levelups']} LEVELS, now {resp['player']['level']}!]")
+        if resp['result'] == 'low_hp':
+            print("\n[!] Stopped, HP is low")
+        elif resp['result'] == 'defeat':
+            print("\n[✗ DEFEAT!]")
+        
+        self.player = resp['player']
+        input("\nPress Enter...")
+    
     def pvp(self):
         self.clear()
         self.header("PVP BATTLE")
@@ -381,6 +664,43 @@ class RPGClient:
         
         input("\nPress Enter...")
     
+    def ranked_pvp(self):
+        self.clear()
+        self.header("RANKED PVP")
+        
+        print("[*] Looking for an opponent near your rating (Ctrl+C to stop)...\n")
+        try:
+            while True:
+                resp = self.send({'cmd': 'pvp_queue', 'player': self.player['name']})
+                if resp.get('status') != 'ok':
+                    print(f"[✗] {resp.get('msg')}")
+                    break
+                if resp.get('matched'):
+                    print(f"⚔️ Matched against {resp['opponent']}!\n")
+                    for line in resp.get('log', []):
+                        print(f"  {line}")
+                        time.sleep(0.15)
+                    if resp.get('result'):
+                        print(f"\n{resp['result']}")
+                    change = resp.get('rating_change', 0)
+                    print(f"Rating: {change:+d}")
+                    if resp.get('player'):
+                        self.player = resp['player']
+                    break
+                print(f"  Waiting {resp['waited']:.0f}s, rating {resp['rating']} ±{resp['window']:.0f}, "
+                      f"{resp['queued']} in queue")
+                time.sleep(2)
+        except KeyboardInterrupt:
+            resp = self.send({'cmd': 'pvp_leave', 'player': self.player['name']})
+            if resp.get('matched'):
+                print(f"\n⚔️ Matched against {resp['opponent']} before leaving: {resp['result']}")
+                print(f"Rating: {resp.get('rating_change', 0):+d}")
+                self.player = resp['player']
+            else:
+                print("\n[!] Left the queue")
+        
+        input("\nPress Enter...")
+    
     def dungeon(self):
         self.clear()
         self.header("DUNGEON EXPEDITION")
@@ -415,10 +735,9 @@ class RPGClient:
         self.clear()
         self.header("SHOP")
         
-        resp = self.send({'cmd': 'shop_list'})
+        shop = self.catalog('shop')
         
-        if resp.get('status') == 'ok':
-            shop = resp['shop']
+        if shop is not None:
             print(f"Your Gold: {self.player['gold']}\n")
             
             for i, (name, info) in enumerate(shop.items(), 1):
@@ -426,11 +745,15 @@ class RPGClient:
             
             print("\n1. Buy Item")
             print("2. Sell Item")
+            print("3. Sell Multiple Items")
             print("0. Back")
             
             choice = input("\nChoice: ").strip()
             
-            if choice == '1':
+            if choice in ('1', '2') and not self.online:
+                self.offline_trade('buy_item' if choice == '1' else 'sell_item',
+                                   input("Item name: ").strip(), shop)
+            elif choice == '1':
                 item = input("Item name: ").strip()
                 resp = self.send({
                     'cmd': 'buy_item',
@@ -452,6 +775,53 @@ class RPGClient:
                 if resp.get('status') == 'ok':
                     self.player = resp['player']
                 time.sleep(2)
+            elif choice == '3':
+                items = [i.strip() for i in input("Item names (comma separated): ").split(',') if i.strip()]
+                if not items:
+                    return
+                resp = self.batch([
+                    {'cmd': 'sell_item', 'player': self.player['name'], 'item': item}
+                    for item in items
+                ], atomic=True)
+                print()
+                for result in resp.get('results', []):
+                    print(result.get('msg'))
+                if resp.get('status') != 'ok':
+                    print(f"[✗] {resp.get('msg')}")
+                if resp.get('player'):
+                    self.player = resp['player']
+                time.sleep(2)
+    
+    def offline_trade(self, cmd, item, shop):
+        # The server does the real trade at sync; this is what it will see
+        p = self.player
+        if item not in shop:
+            print("\nItem not found")
+        elif cmd == 'buy_item' and p['gold'] < shop[item]['cost']:
+            print("\nNot enough gold")
+        elif cmd == 'sell_item' and item not in p['inventory']:
+            print("\nYou don't have this item")
+        else:
+            if cmd == 'buy_item':
+                p['gold'] -= shop[item]['cost']
+                p['inventory'].append(item)
+            else:
+                p['inventory'].remove(item)
+                p['gold'] += int(shop[item]['cost'] * 0.5)
+            saved = self.record(cmd, item)
+            print(f"\n[✓] {'Bought' if cmd == 'buy_item' else 'Sold'} {item}" + ('' if saved else ' (not saved)'))
+        time.sleep(2)
+    
+    def reconnect(self):
+        print("\n[*] Reconnecting...")
+        try:
+            # Logs back in; logged_in() marks us online again
+            self.conn.reconnect()
+        except connection.ConnectionLost as e:
+            print(f"[✗] {e}")
+            time.sleep(2)
+            return
+        self.start_journal()
     
     def inventory(self):
         self.clear()
@@ -506,10 +876,9 @@ class RPGClient:
         self.clear()
         self.header("QUESTS")
         
-        resp = self.send({'cmd': 'quest_list'})
+        quests = self.catalog('quests')
         
-        if resp.get('status') == 'ok':
-            quests = resp['quests']
+        if quests is not None:
             for qid, q in quests.items():
                 print(f"ID: {qid} | {q['name']:20} | Reward: {q['reward']:4} gold")
             
@@ -544,10 +913,9 @@ class RPGClient:
         self.clear()
         self.header("SKILLS")
         
-        resp = self.send({'cmd': 'skill_list'})
+        skills = self.catalog('skills')
         
-        if resp.get('status') == 'ok':
-            skills = resp['skills']
+        if skills is not None:
             for i, (name, info) in enumerate(skills.items(), 1):
                 print(f"{i}. {name:20} | Cost: {info['cost']:2} Mana")
                 print(f"   {info['description']}")
@@ -588,6 +956,7 @@ class RPGClient:
                 self.player = resp['player']
                 print("\n[✓] Fully restored!")
         else:
+            self.record('rest')
             self.player['hp'] = self.player['max_hp']
             print("\n[✓] HP restored!")
         
@@ -610,6 +979,7 @@ class RPGClient:
             print(f"  Battles: {p['battles']}")
             print(f"  PVP Wins: {p['pvp_wins']}")
             print(f"  PVP Loses: {p['pvp_loses']}")
+            print(f"  PVP Rating: {p.get('rating', 1000)}")
             print(f"\nProgress:")
             print(f"  Dungeon Level: {p.get('dungeon_level', 0)}")
             print(f"  Quests Completed: {len(p.get('completed_quests', []))}")
@@ -618,15 +988,31 @@ class RPGClient:
     
     def leaderboard(self):
         self.clear()
-        self.header("TOP 20 LEADERBOARD")
+        self.header("LEADERBOARD")
+        
+        print("1. Level    2. PVP Wins    3. Dungeon")
+        boards = {'1': 'level', '2': 'pvp', '3': 'dungeon'}
+        board = boards.get(input("\nBoard: ").strip(), 'level')
         
-        resp = self.send({'cmd': 'leaderboard'})
+        self.clear()
+        self.header(f"TOP 20 - {board.upper()}")
+        
+        resp, around = self.pipeline([
+            {'cmd': 'leaderboard', 'board': board},
+            {'cmd': 'rank_around', 'player': self.player['name'], 'board': board, 'radius': 2}
+        ])
         if resp.get('status') == 'ok':
             print(f"{'Rank':<5} {'Name':<20} {'Level':<8} {'Class':<12} {'PVP':<8}")
             print("-" * 60)
             for rank, player in enumerate(resp['leaderboard'], 1):
                 print(f"{rank:<5} {player['name']:<20} {player['level']:<8} {player['class']:<12} {player['pvp_wins']:<8}")
         
+        if around.get('status') == 'ok':
+            print(f"\nYour rank: #{around['rank']}\n")
+            for player in around['players']:
+                marker = '>' if player['name'] == self.player['name'] else ' '
+                print(f"{marker}{player['rank']:<4} {player['name']:<20} {player['level']:<8} {player['class']:<12} {player['pvp_wins']:<8}")
+        
         input("\nPress Enter...")
 
 if __name__ == '__main__':
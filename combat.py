@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+RPG Game combat formulas - dipakai server.py (hunt, pvp, auto_hunt) dan balance_sim.py
+
+Every hit does max(1, atk - def + randint(-2, 2)). In a hunt the player
+strikes first and the monster only strikes back while it is still alive.
+
+Damage rolls don't depend on HP, so the HP a player loses winning one
+battle can be worked out without knowing how much HP it had going in. With
+numpy installed, hunt_segment() rolls a whole run of battles as arrays and
+finds where the player stops or dies from the cumulative HP loss. Without
+numpy it plays the battles one by one.
+
+Every function takes the random source as rng. The server passes a Dice,
+which is the random module until seeded() swaps in a seeded Random for
+the current thread, so a replay (sync_offline) rolls the same numbers.
+"""
+
+import contextlib
+import random
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SPREAD = 2
+PVP_ROUNDS = 50
+# Below this many battles the plain loop is faster than setting up arrays
+VECTOR_MIN = 32
+# Cells per array chunk (battles x rounds), keeps memory flat for long runs
+CHUNK_CELLS = 1 << 20
+
+class Dice:
+    """random, or per thread the Random given to seeded()."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, 'rng', random), name)
+
+    @contextlib.contextmanager
+    def seeded(self, seed):
+        previous = getattr(self.local, 'rng', None)
+        self.local.rng = random.Random(seed)
+        try:
+            yield self.local.rng
+        finally:
+            if previous is None:
+                del self.local.rng
+            else:
+                self.local.rng = previous
+
+def damage(atk, defense, rng=random):
+    return max(1, atk - defense + rng.randint(-SPREAD, SPREAD))
+
+def battle_cost(p_atk, p_def, m_atk, m_def, m_hp, rng=random):
+    """HP the player loses killing one monster, however much HP it has."""
+    taken = 0
+    while True:
+        m_hp -= damage(p_atk, m_def, rng)
+        if m_hp <= 0:
+            return taken
+        taken += damage(m_atk, p_def, rng)
+
+def battle_costs(p_atk, p_def, m_atk, m_def, m_hp, count, rng=random):
+    """battle_cost() for count battles in a row, as a list or numpy array."""
+    if numpy is None or count < VECTOR_MIN:
+        return [battle_cost(p_atk, p_def, m_atk, m_def, m_hp, rng) for _ in range(count)]
+
+    gen = numpy.random.default_rng(rng.getrandbits(64))
+    p_base = p_atk - m_def
+    m_base = m_atk - p_def
+    # Enough rounds for the monster to be dead even if every roll is the lowest
+    rounds = -(-m_hp // max(1, p_base - SPREAD))
+    chunk = max(1, CHUNK_CELLS // rounds)
+    costs = numpy.empty(count, dtype=numpy.int64)
+
+    for start in range(0, count, chunk):
+        n = min(chunk, count - start)
+        dealt = numpy.maximum(1, p_base + gen.integers(-SPREAD, SPREAD + 1, size=(n, rounds))).cumsum(axis=1)
+        # Index of the killing blow; the monster strikes back that many times
+        kills = (dealt >= m_hp).argmax(axis=1)
+        taken = numpy.maximum(1, m_base + gen.integers(-SPREAD, SPREAD + 1, size=(n, rounds))).cumsum(axis=1)
+        hit_back = taken[numpy.arange(n), numpy.maximum(kills - 1, 0)]
+        costs[start:start + n] = numpy.where(kills > 0, hit_back, 0)
+    return costs
+
+def hunt_segment(p_atk, p_def, hp, stop_hp, m_atk, m_def, m_hp, count, rng=random):
+    """Fight up to count battles with fixed stats.
+
+    A battle only starts while hp > stop_hp, and the run ends at the first
+    defeat. Returns (battles, wins, hp_left); battles > wins means the last
+    one was lost and hp_left is 0.
+    """
+    if numpy is None or count < VECTOR_MIN:
+        battles = wins = 0
+        while battles < count and (battles == 0 or hp > stop_hp):
+            battles += 1
+            cost = battle_cost(p_atk, p_def, m_atk, m_def, m_hp, rng)
+            if cost >= hp:
+                return battles, wins, 0
+            hp -= cost
+            wins += 1
+        return battles, wins, hp
+
+    spent = numpy.cumsum(battle_costs(p_atk, p_def, m_atk, m_def, m_hp, count, rng))
+    # Battle k starts if the HP left after the first k is above stop_hp,
+    # and is won if the total spent after it is still below the HP we had.
+    battles = min(count, 1 + int(numpy.searchsorted(spent, hp - stop_hp)))
+    wins = min(battles, int(numpy.searchsorted(spent, hp)))
+    if wins < battles:
+        return battles, wins, 0
+    return battles, wins, hp - int(spent[battles - 1])
+
+def hunt_trials(p_atk, p_def, p_hp, m_atk, m_def, m_hp, count, rng=random):
+    """count independent hunts from p_hp. Returns (wins, total HP lost)."""
+    costs = battle_costs(p_atk, p_def, m_atk, m_def, m_hp, count, rng)
+    if numpy is not None and isinstance(costs, numpy.ndarray):
+        return int((costs < p_hp).sum()), int(numpy.minimum(costs, p_hp).sum())
+    return sum(1 for cost in costs if cost < p_hp), sum(min(cost, p_hp) for cost in costs)
+
+def pvp_battle(a_atk, a_def, a_hp, b_atk, b_def, b_hp, rng=random):
+    """One pvp fight, a strikes first. Returns (a_won, a_hp_left).
+
+    If nobody falls within PVP_ROUNDS, a wins, same as in GameServer.pvp.
+    """
+    for _ in range(PVP_ROUNDS):
+        b_hp -= damage(a_atk, b_def, rng)
+        if b_hp <= 0:
+            break
+        a_hp -= damage(b_atk, a_def, rng)
+        if a_hp <= 0:
+            return False, 0
+    return True, a_hp
+
+def pvp_trials(a_atk, a_def, a_hp, b_atk, b_def, b_hp, count, rng=random):
+    """count independent pvp fights. Returns (a's wins, a's total HP lost)."""
+    if numpy is None or count < VECTOR_MIN:
+        wins = lost = 0
+        for _ in range(count):
+            won, hp_left = pvp_battle(a_atk, a_def, a_hp, b_atk, b_def, b_hp, rng)
+            wins += won
+            lost += a_hp - hp_left
+        return wins, lost
+
+    gen = numpy.random.default_rng(rng.getrandbits(64))
+    chunk = max(1, CHUNK_CELLS // PVP_ROUNDS)
+    wins = lost = 0
+    for start in range(0, count, chunk):
+        n = min(chunk, count - start)
+        dealt = numpy.maximum(1, a_atk - b_def + gen.integers(-SPREAD, SPREAD + 1, size=(n, PVP_ROUNDS))).cumsum(axis=1)
+        taken = numpy.maximum(1, b_atk - a_def + gen.integers(-SPREAD, SPREAD + 1, size=(n, PVP_ROUNDS))).cumsum(axis=1)
+        # Round in which each side falls, PVP_ROUNDS if it survives
+        b_falls = first_true(dealt >= b_hp)
+        a_falls = first_true(taken >= a_hp)
+        # a strikes first, so b falling in the same round still counts as a win
+        won = b_falls <= a_falls
+        hits = numpy.minimum(b_falls, PVP_ROUNDS)
+        hp_lost = numpy.where(hits > 0, taken[numpy.arange(n), numpy.maximum(hits - 1, 0)], 0)
+        wins += int(won.sum())
+        lost += int(numpy.where(won, hp_lost, a_hp).sum())
+    return wins, lost
+
+def first_true(matrix):
+    """Column of the first True in each row, or the row length if none."""
+    return numpy.where(matrix.any(axis=1), matrix.argmax(axis=1), matrix.shape[1])
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+RPG Game connection - koneksi ke server untuk client.py, loadgen.py dan bot
+Jalankan: (library) conn = Connection('localhost', 5555); conn.request({'cmd': 'stats', ...})
+
+Connection is the blocking one, AsyncConnection the asyncio one; both
+speak protocol v2 and give back decoded responses. Call connect() first.
+
+Frames are read into one receive buffer, as much as the socket has per
+recv_into(), and decoded straight out of it, so a large or pipelined
+reply costs a few syscalls and no copying of partial data. Push frames
+that arrive between responses are kept in events (and handed to on_push,
+if set).
+
+When the connection drops, the next request reconnects (up to retries
+times, backoff seconds apart, doubling), logs in again as the player it
+was last logged in as and subscribes to the same topics; on_login then
+gets the fresh login response. The request that was in flight is sent
+again only if it is a read (RETRY_SAFE): anything else may or may not
+have happened on the server, so ConnectionLost is raised instead.
+"""
+
+import asyncio
+import collections
+import select
+import socket
+import time
+
+import protocol
+
+# Commands that change nothing, so sending them twice is harmless
+RETRY_SAFE = frozenset([
+    'login', 'stats', 'inventory', 'shop_list', 'quest_list', 'skill_list', 'leaderboard',
+    'my_rank', 'rank_around', 'players_online', 'subscribe', 'unsubscribe',
+])
+MAX_EVENTS = 1000
+
+class ConnectionLost(ConnectionError):
+    pass
+
+class FrameBuffer:
+    """Receive buffer: bytes go in at the end, whole frames come out the front."""
+
+    def __init__(self, size=65536):
+        self.buf = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def reserve(self, size):
+        """A view of at least size free bytes at the end, to recv_into."""
+        if self.end + size > len(self.buf):
+            pending = self.end - self.start
+            if pending + size > len(self.buf):
+                grown = bytearray(max(len(self.buf) * 2, pending + size))
+                grown[:pending] = self.buf[self.start:self.end]
+                self.buf = grown
+            else:
+                self.buf[:pending] = self.buf[self.start:self.end]
+            self.start, self.end = 0, pending
+        return memoryview(self.buf)[self.end:]
+
+    def wrote(self, n):
+        self.end += n
+
+    def take(self, proto):
+        """Decode the next whole frame, None if it hasn't all arrived."""
+        available = self.end - self.start
+        if available < 4:
+            return None
+        size = proto.frame_size(self.buf[self.start:self.start + 4])
+        if available < 4 + size:
+            # Make room for the rest in one go
+            self.reserve(4 + size - available)
+            return None
+        begin = self.start + 4
+        with memoryview(self.buf) as view:
+            message = proto.decode(view[begin:begin + size])
+        self.start = begin + size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return message
+
+    def __len__(self):
+        return self.end - self.start
+
+class BaseConnection:
+    """What both connections remember so a reconnect can restore it."""
+
+    def __init__(self, host, port, encoding='json', timeout=10.0, connect_timeout=5.0,
+                 retries=3, backoff=0.5):
+        self.host = host
+        self.port = int(port)
+        self.encoding = encoding
+        self.timeout = timeout or None
+        self.connect_timeout = connect_timeout or None
+        self.retries = retries
+        self.backoff = backoff
+        self.proto = None
+        self.login = None
+        self.topics = []
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self.on_push = None
+        self.on_login = None
+        self.reconnects = 0
+
+    @property
+    def push_supported(self):
+        return self.proto is not None and not self.proto.legacy
+
+    def remember(self, data, resp):
+        """Note logins and subscriptions, to be replayed after a reconnect."""
+        if resp.get('status') != 'ok':
+            return
+        cmd = data.get('cmd')
+        if cmd in ('login', 'register'):
+            self.login = {'cmd': 'login', 'name': data['name']}
+        elif cmd in ('subscribe', 'unsubscribe'):
+            self.topics = resp.get('topics', [])
+
+    def got_push(self, message):
+        self.events.append(message)
+        if self.on_push is not None:
+            self.on_push(message)
+
+    def take_events(self):
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def delays(self):
+        delay = self.backoff
+        for _ in range(self.retries):
+            yield delay
+            delay *= 2
+
+class Connection(BaseConnection):
+    """Blocking connection. Not for use from several threads at once."""
+
+    def __init__(self, host, port, encoding='json', **options):
+        BaseConnection.__init__(self, host, port, encoding, **options)
+        self.sock = None
+        self.buffer = FrameBuffer()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        self.close()
+        sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.proto = protocol.client_handshake(sock, protocol.ENCODINGS[self.encoding])
+            sock.settimeout(self.timeout)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+        self.buffer = FrameBuffer()
+
+    def reconnect(self):
+        """Connect again and restore the login and subscriptions."""
+        error = None
+        for delay in self.delays():
+            try:
+                self.connect()
+                if self.login:
+                    resp = self.exchange(self.login)
+                    if resp.get('status') == 'ok' and self.on_login is not None:
+                        self.on_login(resp)
+                if self.topics:
+                    self.exchange({'cmd': 'subscribe', 'topics': self.topics})
+                self.reconnects += 1
+                return
+            except (OSError, protocol.ProtocolError, ConnectionLost) as e:
+                error = e
+                self.close()
+                time.sleep(delay)
+        raise ConnectionLost(f'Reconnect failed: {error}')
+
+    def request(self, data):
+        """Send one request and return its response."""
+        if self.sock is None:
+            if not self.retries:
+                raise ConnectionLost('Not connected')
+            self.reconnect()
+        try:
+            resp = self.exchange(data)
+        except (OSError, protocol.ProtocolError, ConnectionLost) as e:
+            self.close()
+            if not self.retries:
+                raise ConnectionLost(str(e))
+            self.reconnect()
+            if data.get('cmd') not in RETRY_SAFE:
+                raise ConnectionLost('Connection lost, reconnected; try again')
+            try:
+                resp = self.exchange(data)
+            except (OSError, protocol.ProtocolError, ConnectionLost) as e:
+                # Lost again right after reconnecting: give up on this one
+                self.close()
+                raise ConnectionLost(str(e))
+        self.remember(data, resp)
+        return resp
+
+    def pipeline(self, requests):
+        """Send requests in one write; responses come back in the same order."""
+        if self.sock is None:
+            if not self.retries:
+                raise ConnectionLost('Not connected')
+            self.reconnect()
+        requests = [dict(req, id=i) for i, req in enumerate(requests)]
+        try:
+            self.sock.sendall(b''.join(self.proto.frame(req) for req in requests))
+            responses = [None] * len(requests)
+            for _ in requests:
+                resp = self.read_response()
+                responses[resp.pop('id')] = resp
+        except (OSError, protocol.ProtocolError, ConnectionLost, KeyError, IndexError) as e:
+            self.close()
+            if self.retries:
+                self.reconnect()
+            raise ConnectionLost(f'Connection lost during pipeline: {e}')
+        for req, resp in zip(requests, responses):
+            self.remember(req, resp)
+        return responses
+
+    def exchange(self, data):
+        self.sock.sendall(self.proto.frame(data))
+        return self.read_response()
+
+    def read_response(self):
+        """Next response; pushes read on the way go to events."""
+        while True:
+            message = self.buffer.take(self.proto)
+            if message is None:
+                self.fill()
+            elif protocol.is_push(message):
+                self.got_push(message)
+            else:
+                return message
+
+    def fill(self):
+        n = self.sock.recv_into(self.buffer.reserve(16384))
+        if not n:
+            raise ConnectionLost('Server closed the connection')
+        self.buffer.wrote(n)
+
+    def poll_events(self, timeout=0):
+        """Read pushes already waiting (or arriving within timeout)."""
+        if self.sock is None or not self.push_supported:
+            return self.take_events()
+        try:
+            while select.select([self.sock], [], [], timeout)[0]:
+                self.fill()
+                timeout = 0
+                while True:
+                    message = self.buffer.take(self.proto)
+                    if message is None:
+                        break
+                    if protocol.is_push(message):
+                        self.got_push(message)
+        except (OSError, protocol.ProtocolError, ConnectionLost):
+            # The next request reconnects
+            self.close()
+        return self.take_events()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+class AsyncConnection(BaseConnection):
+    """asyncio connection. A reader task takes every frame off the socket,
+    so requests from several tasks can be in flight at once; responses
+    come back in the order the requests were written.
+    """
+
+    def __init__(self, host, port, encoding='json', **options):
+        BaseConnection.__init__(self, host, port, encoding, **options)
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.waiting = collections.deque()
+
+    @property
+    def connected(self):
+        return self.task is not None and not self.task.done()
+
+    async def connect(self):
+        self.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                self.connect_timeout)
+        try:
+            self.proto = await asyncio.wait_for(
+                protocol.client_handshake_async(reader, writer, protocol.ENCODINGS[self.encoding]),
+                self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        self.reader, self.writer = reader, writer
+        self.task = asyncio.ensure_future(self.read_loop())
+
+    async def read_loop(self):
+        try:
+            while True:
+                message = await protocol.read_frame_async(self.reader, self.proto)
+                if protocol.is_push(message):
+                    self.got_push(message)
+                elif self.waiting:
+                    future = self.waiting.popleft()
+                    if not future.done():
+                        future.set_result(message)
+        except (asyncio.IncompleteReadError, OSError, protocol.ProtocolError):
+            pass
+        finally:
+            while self.waiting:
+                future = self.waiting.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionLost('Server closed the connection'))
+
+    async def reconnect(self):
+        error = None
+        for delay in self.delays():
+            try:
+                await self.connect()
+                if self.login:
+                    resp = await self.exchange(self.login)
+                    if resp.get('status') == 'ok' and self.on_login is not None:
+                        self.on_login(resp)
+                if self.topics:
+                    await self.exchange({'cmd': 'subscribe', 'topics': self.topics})
+                self.reconnects += 1
+                return
+            except (OSError, asyncio.TimeoutError, protocol.ProtocolError, ConnectionLost,
+                    asyncio.IncompleteReadError) as e:
+                error = e
+                self.close()
+                await asyncio.sleep(delay)
+        raise ConnectionLost(f'Reconnect failed: {error}')
+
+    async def request(self, data):
+        if not self.connected:
+            if not self.retries:
+                raise ConnectionLost('Not connected')
+            await self.reconnect()
+        try:
+            resp = await self.exchange(data)
+        except (OSError, asyncio.TimeoutError, protocol.ProtocolError, ConnectionLost) as e:
+            self.close()
+            if not self.retries:
+                raise ConnectionLost(str(e) or 'Request timed out')
+            await self.reconnect()
+            if data.get('cmd') not in RETRY_SAFE:
+                raise ConnectionLost('Connection lost, reconnected; try again')
+            try:
+                resp = await self.exchange(data)
+            except (OSError, asyncio.TimeoutError, protocol.ProtocolError, ConnectionLost) as e:
+                self.close()
+                raise ConnectionLost(str(e) or 'Request timed out')
+        self.remember(data, resp)
+        return resp
+
+    async def pipeline(self, requests):
+        return list(await asyncio.gather(*(self.request(req) for req in requests)))
+
+    async def exchange(self, data):
+        if not self.connected:
+            raise ConnectionLost('Not connected')
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.append(future)
+        self.writer.write(self.proto.frame(data))
+        return await asyncio.wait_for(future, self.timeout)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
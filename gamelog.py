@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+RPG Game server log - structured records written by a background thread
+
+Request handlers only append a tuple to a bounded queue. Formatting and the
+actual write happen on the writer thread, in batches, so a slow terminal or
+disk never blocks a request. When the queue is full new records are dropped
+and counted instead.
+"""
+
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+class AsyncLogger:
+    """Buffered logger for connection and request events.
+
+    path:        JSON lines file, rotated once it grows past max_bytes.
+                 Without a path, readable lines go to stdout.
+    sample:      {cmd: rate}; only that fraction of successful requests
+                 for cmd is logged. Errors are always logged.
+    max_queue:   records waiting to be written before new ones are dropped
+    """
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024, backups=3, sample=None,
+                 default_rate=1.0, max_queue=10000, batch=500, interval=0.2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sample = sample or {}
+        self.default_rate = default_rate
+        self.max_queue = max_queue
+        self.batch = batch
+        self.interval = interval
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+        # Producers and the writer both count drops
+        self.drop_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.closed = False
+
+        # The file is written as bytes so its size is counted in bytes
+        self.out = open(path, 'ab') if path else sys.stdout
+        self.size = self.out.tell() if path else 0
+
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, record):
+        # deque.append is atomic, so producers never take a lock here. The
+        # length check can race a little past max_queue, which is fine.
+        if len(self.queue) >= self.max_queue:
+            self.drop()
+            return
+        self.queue.append(record)
+        if len(self.queue) == self.batch:
+            self.wakeup.set()
+
+    def event(self, event, addr=None, **fields):
+        self.put((time.time(), event, addr, fields))
+
+    def request(self, addr, data, response, latency):
+        cmd = data.get('cmd')
+        status = response.get('status')
+        if status == 'ok':
+            rate = self.sample.get(cmd, self.default_rate)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        self.put((time.time(), 'request', addr, {
+            'player': data.get('player') or data.get('name'),
+            'cmd': cmd,
+            'latency_ms': round(latency * 1000, 3),
+            'status': status,
+        }))
+
+    def write_loop(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.drain()
+            if self.closed and not self.queue:
+                return
+
+    def drain(self):
+        while self.queue:
+            lines = []
+            while self.queue and len(lines) < self.batch:
+                lines.append(self.format(self.queue.popleft()))
+            chunk = ''.join(lines)
+            if self.path:
+                chunk = chunk.encode('utf-8')
+            try:
+                self.out.write(chunk)
+                self.out.flush()
+            except (OSError, ValueError):
+                self.drop(len(lines))
+                continue
+            self.written += len(lines)
+            if self.path:
+                self.size += len(chunk)
+                if self.size >= self.max_bytes:
+                    self.rotate()
+
+    def drop(self, count=1):
+        with self.drop_lock:
+            self.dropped += count
+
+    def format(self, record):
+        ts, event, addr, fields = record
+        if self.path:
+            entry = {'ts': round(ts, 3), 'event': event, 'addr': addr}
+            entry.update(fields)
+            return json.dumps(entry, default=str) + '\n'
+
+        stamp = time.strftime('%H:%M:%S', time.localtime(ts))
+        if event == 'request':
+            return (f"{stamp} [<] {addr} {fields['player']} -> {fields['cmd']} "
+                    f"{fields['status']} {fields['latency_ms']}ms\n")
+        if event == 'connect':
+            return f"{stamp} [+] {addr} connected\n"
+        if event == 'disconnect':
+            return f"{stamp} [-] {addr} disconnected\n"
+        details = ' '.join(f'{k}={v}' for k, v in fields.items())
+        return f"{stamp} [!] {event} {addr or ''} {details}\n"
+
+    def rotate(self):
+        self.out.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.out = open(self.path, 'ab')
+        self.size = 0
+
+    def stats(self):
+        return {'queued': len(self.queue), 'written': self.written, 'dropped': self.dropped}
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        if self.path:
+            self.out.close()
+
+def parse_sample(spec):
+    """'hunt=0.1,shop_list=0' -> {'hunt': 0.1, 'shop_list': 0.0}"""
+    sample = {}
+    for part in filter(None, (spec or '').split(',')):
+        cmd, _, rate = part.partition('=')
+        sample[cmd.strip()] = float(rate)
+    return sample
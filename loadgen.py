@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+RPG Game load generator - ribuan bot tanpa menu input()
+Jalankan: python loadgen.py --bots 1000 --duration 60 [--pid SERVER_PID]
+
+Every bot is one connection.AsyncConnection, the same protocol as
+client.py (handshake, frames, version + deltas). Bots don't reconnect: a
+dropped connection counts as failed. It registers or logs in, then picks
+commands from a weighted mix until the run ends. The report shows
+throughput and p50/p95/p99 latency per command, how many requests were
+rejected (status error) or failed (connection problems), and the server's
+RSS over time, read from /proc/PID/status.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from array import array
+
+import protocol
+from client import RPGClient
+from connection import AsyncConnection
+
+DEFAULT_MIX = 'hunt=35,pvp=8,shop_list=5,buy_item=8,sell_item=6,accept_quest=4,complete_quest=3,rest=15,stats=10,leaderboard=4,login=2'
+CLASSES = ['Warrior', 'Mage', 'Rogue', 'Paladin', 'Archer', 'Berserker']
+MONSTERS = ['goblin', 'goblin', 'skeleton', 'orc', 'troll']
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        cmd, _, weight = part.partition('=')
+        mix[cmd.strip()] = float(weight or 1)
+    return mix
+
+class Stats:
+    def __init__(self):
+        self.latency = {}
+        self.rejected = {}
+        self.failed = 0
+        self.sessions = 0
+        self.total = 0
+
+    def record(self, cmd, seconds, ok):
+        samples = self.latency.get(cmd)
+        if samples is None:
+            samples = self.latency[cmd] = array('d')
+            self.rejected[cmd] = 0
+        samples.append(seconds)
+        self.total += 1
+        if not ok:
+            self.rejected[cmd] += 1
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Bot:
+    """One player session. Deltas are handled the same way as RPGClient."""
+
+    with_version = RPGClient.with_version
+    apply_delta = RPGClient.apply_delta
+
+    def __init__(self, name, args, mix, stats, names):
+        self.name = name
+        self.args = args
+        self.mix = mix
+        self.stats = stats
+        self.names = names
+        self.player = None
+        self.rng = random.Random(name)
+
+    async def run(self, deadline):
+        self.conn = AsyncConnection(self.args.host, self.args.port, self.args.encoding,
+                                    timeout=self.args.timeout, retries=0)
+        await self.conn.connect()
+        try:
+            resp = await self.call({'cmd': 'register', 'name': self.name, 'class': self.rng.choice(CLASSES)})
+            if resp.get('status') != 'ok':
+                resp = await self.call({'cmd': 'login', 'name': self.name})
+            if resp.get('status') != 'ok':
+                raise ConnectionError(resp.get('msg'))
+            self.player = resp['player']
+            self.names.append(self.name)
+            self.stats.sessions += 1
+
+            commands, weights = list(self.mix), list(self.mix.values())
+            while time.time() < deadline:
+                cmd = self.rng.choices(commands, weights)[0]
+                await self.call(self.request(cmd))
+                if self.args.think:
+                    await asyncio.sleep(self.rng.expovariate(1000.0 / self.args.think))
+        finally:
+            self.conn.close()
+
+    def request(self, cmd):
+        name = self.name
+        hp = self.player.get('hp', 1) if self.player else 1
+        # A real player rests when dead instead of hitting the same error
+        if hp <= 0 and cmd in ('hunt', 'pvp', 'pvp_queue'):
+            cmd = 'rest'
+        if cmd == 'hunt':
+            return {'cmd': 'hunt', 'player': name, 'difficulty': self.rng.choice(MONSTERS)}
+        if cmd == 'auto_hunt':
+            return {'cmd': 'auto_hunt', 'player': name, 'count': 20}
+        if cmd == 'pvp':
+            return {'cmd': 'pvp', 'player': name, 'opponent': self.rng.choice(self.names)}
+        if cmd in ('buy_item', 'sell_item'):
+            return {'cmd': cmd, 'player': name, 'item': 'Health Potion'}
+        if cmd in ('accept_quest', 'complete_quest'):
+            return {'cmd': cmd, 'player': name, 'quest_id': self.rng.randint(1, 5)}
+        if cmd == 'login':
+            return {'cmd': 'login', 'name': name}
+        if cmd in ('shop_list', 'quest_list', 'skill_list', 'leaderboard', 'players_online'):
+            return {'cmd': cmd}
+        return {'cmd': cmd, 'player': name}
+
+    async def call(self, data):
+        data = self.with_version(data)
+        started = time.perf_counter()
+        resp = await self.conn.request(data)
+        self.stats.record(data['cmd'], time.perf_counter() - started, resp.get('status') == 'ok')
+
+        if 'delta' in resp:
+            self.apply_delta(resp.pop('delta'))
+        elif isinstance(resp.get('player'), dict) and resp['player'].get('name') == self.name:
+            self.player = resp['player']
+        return resp
+
+def read_rss(pids):
+    """Resident memory of the server processes in MB, None if unknown."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            return None
+    return total / 1024
+
+async def monitor(args, stats, deadline, rss):
+    last_total, last_time = 0, time.time()
+    while time.time() < deadline:
+        await asyncio.sleep(args.interval)
+        now = time.time()
+        rate = (stats.total - last_total) / (now - last_time)
+        last_total, last_time = stats.total, now
+        mem = read_rss(args.pid) if args.pid else None
+        if mem is not None:
+            rss.append((round(now - args.started, 1), round(mem, 1)))
+        print(f"[*] {now - args.started:6.1f}s  sessions {stats.sessions:5}  {rate:8.0f} req/s  "
+              f"failed {stats.failed}" + (f"  rss {mem:.0f} MB" if mem is not None else ''))
+
+async def bot_session(bot, args, stats, deadline, delay):
+    await asyncio.sleep(delay)
+    try:
+        await bot.run(deadline)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, protocol.ProtocolError, ConnectionError):
+        stats.failed += 1
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    names = []
+    rss = []
+    args.started = time.time()
+    deadline = args.started + args.ramp + args.duration
+    prefix = args.prefix or f'bot{os.getpid()}_'
+
+    bots = [Bot(f'{prefix}{i}', args, mix, stats, names) for i in range(args.bots)]
+    tasks = [bot_session(bot, args, stats, deadline, args.ramp * i / args.bots) for i, bot in enumerate(bots)]
+    await asyncio.gather(monitor(args, stats, deadline, rss), *tasks)
+    return stats, rss, time.time() - args.started
+
+def report(args, stats, rss, elapsed):
+    rows = {}
+    print(f"\n{'command':16}{'count':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rejected':>10}")
+    for cmd in sorted(stats.latency):
+        ordered = sorted(stats.latency[cmd])
+        row = {
+            'count': len(ordered),
+            'rps': len(ordered) / elapsed,
+            'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000,
+            'rejected': stats.rejected[cmd],
+        }
+        rows[cmd] = row
+        print(f"{cmd:16}{row['count']:>9}{row['rps']:>9.0f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+              f"{row['p99_ms']:>9.2f}{row['rejected'] / row['count']:>10.1%}")
+
+    print(f"\n{stats.total} requests in {elapsed:.1f}s ({stats.total / elapsed:.0f} req/s), "
+          f"{stats.sessions}/{args.bots} sessions, {stats.failed} failed")
+    if rss:
+        print(f"Server RSS: start {rss[0][1]} MB, peak {max(m for _, m in rss)} MB, end {rss[-1][1]} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'bots': args.bots, 'duration_s': elapsed, 'requests': stats.total,
+                'sessions': stats.sessions, 'failed': stats.failed,
+                'commands': rows, 'rss_mb': rss,
+            }, f, indent=2)
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless bots for load testing the RPG server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of full load after the ramp')
+    parser.add_argument('--ramp', type=float, default=5, help='seconds over which bots connect')
+    parser.add_argument('--think', type=float, default=100, help='mean pause between requests per bot, ms')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='command weights, e.g. hunt=50,rest=20,stats=30')
+    parser.add_argument('--encoding', choices=list(protocol.ENCODINGS), default='json')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a response')
+    parser.add_argument('--pid', type=int, nargs='+', help='server process id(s) to sample RSS from')
+    parser.add_argument('--interval', type=float, default=2, help='seconds between progress lines')
+    parser.add_argument('--prefix', help='bot name prefix (default: per run)')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    loop = asyncio.new_event_loop()
+    stats, rss, elapsed = loop.run_until_complete(run(args))
+    loop.close()
+    report(args, stats, rss, elapsed)
+
+if __name__ == '__main__':
+    main()
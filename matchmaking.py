@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+RPG Game matchmaking - antrian PVP berdasarkan rating (Elo)
+Dipakai server.py untuk command pvp_queue / pvp_leave
+
+Every pvp moves the winner's rating up and the loser's down by the same
+amount, more for an upset than for the expected result (Elo, K = 32).
+
+Waiting players sit in buckets of BUCKET rating points. The bucket numbers
+that have anyone in them are kept in a sorted list, so finding the buckets
+around a rating is one bisect, and only the buckets inside the widest
+possible window are looked at, nearest first, until no closer opponent
+can be left. How far apart two players may be grows
+with how long either has waited, from BASE_WINDOW to MAX_WINDOW.
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+START_RATING = 1000
+K_FACTOR = 32
+BUCKET = 50
+BASE_WINDOW = 100
+WIDEN_PER_SECOND = 20
+MAX_WINDOW = 800
+# Nobody polled for this long: treat the entry as gone
+QUEUE_TTL = 120
+
+def expected(rating, other):
+    """Chance rating beats other, by the Elo formula."""
+    return 1.0 / (1.0 + 10 ** ((other - rating) / 400.0))
+
+def rating_change(winner, loser):
+    """Points the winner gains and the loser gives up."""
+    return max(1, round(K_FACTOR * (1.0 - expected(winner, loser))))
+
+def window(waited):
+    return min(MAX_WINDOW, BASE_WINDOW + WIDEN_PER_SECOND * waited)
+
+def bucket_gap(key, rating):
+    """Smallest rating gap between rating and anyone in bucket key."""
+    low = key * BUCKET
+    high = low + BUCKET - 1
+    return max(low - rating, rating - high, 0)
+
+class MatchQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # bucket -> {name: (rating, joined, seen)}, oldest first
+        self.buckets = {}
+        self.keys = []
+        self.where = {}
+
+    def join(self, name, rating, now=None):
+        """Queue name, or refresh it if already queued. Returns (waited, window)."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.remove(name)
+            joined = entry[1] if entry else now
+            self.add(name, rating, joined, now)
+            return now - joined, window(now - joined)
+
+    def leave(self, name):
+        with self.lock:
+            return self.remove(name) is not None
+
+    def match(self, name, rating, now=None):
+        """Take the closest acceptable opponent for name out of the queue.
+
+        Two players fit if their ratings are within the window of whichever
+        has waited longer. name leaves the queue too if it finds someone.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            mine = self.entry(name)
+            my_window = window(now - mine[1]) if mine else BASE_WINDOW
+            low = bisect.bisect_left(self.keys, (rating - MAX_WINDOW) // BUCKET)
+            high = bisect.bisect_right(self.keys, (rating + MAX_WINDOW) // BUCKET)
+
+            best = None
+            stale = []
+            # Nearest buckets first; once a bucket can't hold anyone closer
+            # than the best so far, neither can the ones after it
+            for key in sorted(self.keys[low:high], key=lambda key: bucket_gap(key, rating)):
+                if best is not None and bucket_gap(key, rating) >= best[0]:
+                    break
+                for other, (other_rating, joined, seen) in self.buckets[key].items():
+                    if other == name:
+                        continue
+                    if now - seen > QUEUE_TTL:
+                        stale.append(other)
+                        continue
+                    gap = abs(other_rating - rating)
+                    if gap <= max(my_window, window(now - joined)) and (best is None or gap < best[0]):
+                        best = (gap, other)
+
+            for other in stale:
+                self.remove(other)
+            if best is None:
+                return None
+            self.remove(best[1])
+            self.remove(name)
+            return best[1]
+
+    def entry(self, name):
+        key = self.where.get(name)
+        return None if key is None else self.buckets[key][name]
+
+    def add(self, name, rating, joined, seen):
+        key = rating // BUCKET
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = collections.OrderedDict()
+            bisect.insort(self.keys, key)
+        bucket[name] = (rating, joined, seen)
+        self.where[name] = key
+
+    def remove(self, name):
+        key = self.where.pop(name, None)
+        if key is None:
+            return None
+        bucket = self.buckets[key]
+        entry = bucket.pop(name)
+        if not bucket:
+            del self.buckets[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+        return entry
+
+    def __len__(self):
+        return len(self.where)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+RPG Game server metrics - counter, gauge dan histogram in-process
+
+Everything here is cheap enough to leave on at full load: an update is a
+lock plus an add (and a bisect for histograms). Reading the metrics
+happens through the admin `metrics` command or, optionally, a Prometheus
+text endpoint on a local port.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Seconds. Wide enough for a cached catalog read up to a slow disk write.
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+class Counter:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    __slots__ = ('value', 'lock', 'fn')
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.lock = threading.Lock()
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def snapshot(self):
+        return self.fn() if self.fn else self.value
+
+class Histogram:
+    """Fixed-bucket histogram. counts[i] is the number of observations in
+    (buckets[i-1], buckets[i]]; the last slot is everything above."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'lock')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+class MetricsRegistry:
+    def __init__(self, prefix='rpg'):
+        self.prefix = prefix
+        self.started = time.time()
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind, cls, name, help_text, labels, **kwargs):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = {'kind': kind, 'help': help_text, 'series': {}}
+            metric = family['series'].get(key)
+            if metric is None:
+                metric = family['series'][key] = cls(**kwargs)
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        return self.get('counter', Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', fn=None, **labels):
+        return self.get('gauge', Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+        return self.get('histogram', Histogram, name, help_text, labels, buckets=buckets)
+
+    def snapshot(self):
+        result = {'uptime_seconds': time.time() - self.started}
+        with self.lock:
+            families = list(self.families.items())
+        for name, family in families:
+            series = {}
+            for key, metric in list(family['series'].items()):
+                label = ','.join(f'{k}={v}' for k, v in key) or 'value'
+                series[label] = metric.snapshot()
+            result[name] = series
+        return result
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            families = list(self.families.items())
+        for name, family in families:
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {family["help"]}')
+            lines.append(f'# TYPE {full} {family["kind"]}')
+            for key, metric in list(family['series'].items()):
+                if family['kind'] == 'histogram':
+                    cumulative = 0
+                    for index, count in enumerate(metric.counts):
+                        cumulative += count
+                        le = repr(metric.buckets[index]) if index < len(metric.buckets) else '+Inf'
+                        lines.append(f'{full}_bucket{format_labels(key + (("le", le),))} {cumulative}')
+                    lines.append(f'{full}_sum{format_labels(key)} {metric.sum}')
+                    lines.append(f'{full}_count{format_labels(key)} {metric.count}')
+                else:
+                    lines.append(f'{full}{format_labels(key)} {metric.snapshot()}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(key):
+    if not key:
+        return ''
+    pairs = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in key)
+    return '{' + pairs + '}'
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve_prometheus(registry, port, host='127.0.0.1'):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print(f"[✓] Metrics on http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+RPG Game wire protocol - dipakai server.py dan client.py
+
+Legacy (v1): 4 ASCII digits of payload length + JSON. Payloads max 9999 bytes.
+
+v2: the client opens with MAGIC + version byte + encoding byte and the
+server answers the same way with what it picked. After that every frame
+is a 4-byte big-endian length + payload, encoded either as JSON or as a
+compact msgpack-compatible binary form.
+
+v2 connections that subscribe to topics also get push frames the server
+sends on its own, between responses: {'push': topic, 'event': ..., 'data':
+...}. Responses never have a 'push' key.
+
+Responses that never change (the shop, quest and skill catalogs) can be
+built once as Cached: both encodings are made up front, and keys added to
+a copy later, like a pipelined request's id, are spliced into the stored
+bytes.
+"""
+
+import json
+import struct
+
+MAGIC = b'\xffRPG'
+PROTOCOL_VERSION = 2
+LEGACY_MAX = 9999
+MAX_FRAME = 16 * 1024 * 1024
+
+ENCODING_JSON = 0
+ENCODING_BINARY = 1
+ENCODINGS = {'json': ENCODING_JSON, 'binary': ENCODING_BINARY}
+
+# How every push payload starts, so a relay can spot one without decoding
+# it. push_message() always builds the same three keys, 'push' first.
+PUSH_PREFIX = {
+    ENCODING_JSON: b'{"push": ',
+    ENCODING_BINARY: b'\x83\xa4push',
+}
+
+class ProtocolError(Exception):
+    pass
+
+def push_message(topic, event, data=None):
+    return {'push': topic, 'event': event, 'data': data}
+
+def is_push(message):
+    return isinstance(message, dict) and 'push' in message
+
+def is_push_payload(payload, encoding):
+    return payload[:len(PUSH_PREFIX[encoding])] == PUSH_PREFIX[encoding]
+
+class Cached(dict):
+    """A response dict encoded once, ahead of time, in every encoding.
+
+    Hand out copy() per request; copies share the stored payloads. Keys
+    set on a copy that the original didn't have are spliced in front of
+    the stored bytes. Changing an original key means a full encode.
+    """
+
+    def __init__(self, obj, payloads=None):
+        dict.__init__(self, obj)
+        self.base = obj
+        if payloads is None:
+            payloads = {encoding: Protocol(encoding=encoding).encode(obj) for encoding in ENCODINGS.values()}
+        self.payloads = payloads
+
+    def copy(self):
+        return Cached(self.base, self.payloads)
+
+    def payload(self, encoding, default=None):
+        base = self.base
+        extra = {}
+        for key, value in self.items():
+            if key not in base:
+                extra[key] = value
+            elif base[key] is not value:
+                return Protocol(encoding=encoding, default=default).encode(dict(self))
+        if len(self) - len(extra) != len(base):
+            return Protocol(encoding=encoding, default=default).encode(dict(self))
+        return splice(self.payloads[encoding], encoding, extra, default)
+
+def splice(payload, encoding, extra, default=None):
+    """Add the keys of extra to an encoded, non-empty map."""
+    if not extra:
+        return payload
+    if encoding == ENCODING_JSON:
+        head = json.dumps(extra, default=default).encode()
+        return head[:-1] + b', ' + payload[1:]
+
+    first = payload[0]
+    if first & 0xf0 == 0x80:
+        size, offset = first & 0x0f, 1
+    elif first == 0xde:
+        size, offset = struct.unpack_from('>H', payload, 1)[0], 3
+    else:
+        size, offset = struct.unpack_from('>I', payload, 1)[0], 5
+    parts = [_map_header(size + len(extra))]
+    for key, value in extra.items():
+        _pack(key, parts, default)
+        _pack(value, parts, default)
+    parts.append(payload[offset:])
+    return b''.join(parts)
+
+def pack(obj, default=None):
+    parts = []
+    _pack(obj, parts, default)
+    return b''.join(parts)
+
+def _pack(obj, parts, default):
+    if obj is None:
+        parts.append(b'\xc0')
+    elif obj is True:
+        parts.append(b'\xc3')
+    elif obj is False:
+        parts.append(b'\xc2')
+    elif type(obj) is int:
+        if 0 <= obj < 0x80:
+            parts.append(bytes((obj,)))
+        elif -32 <= obj < 0:
+            parts.append(bytes((obj & 0xff,)))
+        elif -0x80 <= obj < 0x80:
+            parts.append(struct.pack('>Bb', 0xd0, obj))
+        elif -0x8000 <= obj < 0x8000:
+            parts.append(struct.pack('>Bh', 0xd1, obj))
+        elif -0x80000000 <= obj < 0x80000000:
+            parts.append(struct.pack('>Bi', 0xd2, obj))
+        else:
+            parts.append(struct.pack('>Bq', 0xd3, obj))
+    elif type(obj) is float:
+        parts.append(struct.pack('>Bd', 0xcb, obj))
+    elif type(obj) is str:
+        data = obj.encode()
+        size = len(data)
+        if size < 32:
+            parts.append(bytes((0xa0 | size,)))
+        elif size < 0x100:
+            parts.append(struct.pack('>BB', 0xd9, size))
+        elif size < 0x10000:
+            parts.append(struct.pack('>BH', 0xda, size))
+        else:
+            parts.append(struct.pack('>BI', 0xdb, size))
+        parts.append(data)
+    elif type(obj) is dict:
+        parts.append(_map_header(len(obj)))
+        for key, value in obj.items():
+            _pack(key, parts, default)
+            _pack(value, parts, default)
+    elif type(obj) in (list, tuple):
+        size = len(obj)
+        if size < 16:
+            parts.append(bytes((0x90 | size,)))
+        elif size < 0x10000:
+            parts.append(struct.pack('>BH', 0xdc, size))
+        else:
+            parts.append(struct.pack('>BI', 0xdd, size))
+        for value in obj:
+            _pack(value, parts, default)
+    elif isinstance(obj, (bytes, bytearray)):
+        size = len(obj)
+        if size < 0x100:
+            parts.append(struct.pack('>BB', 0xc4, size))
+        elif size < 0x10000:
+            parts.append(struct.pack('>BH', 0xc5, size))
+        else:
+            parts.append(struct.pack('>BI', 0xc6, size))
+        parts.append(bytes(obj))
+    elif isinstance(obj, int):
+        _pack(int(obj), parts, default)
+    elif isinstance(obj, float):
+        _pack(float(obj), parts, default)
+    elif isinstance(obj, str):
+        _pack(str(obj), parts, default)
+    elif isinstance(obj, dict):
+        _pack(dict(obj), parts, default)
+    elif isinstance(obj, (list, tuple)):
+        _pack(list(obj), parts, default)
+    elif default is not None:
+        _pack(default(obj), parts, default)
+    else:
+        raise TypeError(f'{type(obj).__name__} is not serializable')
+
+def _map_header(size):
+    if size < 16:
+        return bytes((0x80 | size,))
+    if size < 0x10000:
+        return struct.pack('>BH', 0xde, size)
+    return struct.pack('>BI', 0xdf, size)
+
+def unpack(data):
+    obj, offset = _unpack(memoryview(data), 0)
+    if offset != len(data):
+        raise ProtocolError('Trailing bytes after message')
+    return obj
+
+_FIXED = {
+    0xd0: struct.Struct('>b'), 0xd1: struct.Struct('>h'),
+    0xd2: struct.Struct('>i'), 0xd3: struct.Struct('>q'),
+    0xcc: struct.Struct('>B'), 0xcd: struct.Struct('>H'),
+    0xce: struct.Struct('>I'), 0xcf: struct.Struct('>Q'),
+    0xca: struct.Struct('>f'), 0xcb: struct.Struct('>d'),
+}
+_SIZES = {
+    0xd9: struct.Struct('>B'), 0xda: struct.Struct('>H'), 0xdb: struct.Struct('>I'),
+    0xc4: struct.Struct('>B'), 0xc5: struct.Struct('>H'), 0xc6: struct.Struct('>I'),
+    0xdc: struct.Struct('>H'), 0xdd: struct.Struct('>I'),
+    0xde: struct.Struct('>H'), 0xdf: struct.Struct('>I'),
+}
+
+def _unpack(view, offset):
+    tag = view[offset]
+    offset += 1
+
+    if tag < 0x80:
+        return tag, offset
+    if tag >= 0xe0:
+        return tag - 0x100, offset
+    if 0xa0 <= tag <= 0xbf:
+        size = tag & 0x1f
+        return str(view[offset:offset + size], 'utf-8'), offset + size
+    if 0x80 <= tag <= 0x8f:
+        return _unpack_map(view, offset, tag & 0x0f)
+    if 0x90 <= tag <= 0x9f:
+        return _unpack_list(view, offset, tag & 0x0f)
+    if tag == 0xc0:
+        return None, offset
+    if tag == 0xc2:
+        return False, offset
+    if tag == 0xc3:
+        return True, offset
+
+    fixed = _FIXED.get(tag)
+    if fixed is not None:
+        return fixed.unpack_from(view, offset)[0], offset + fixed.size
+
+    sizer = _SIZES.get(tag)
+    if sizer is None:
+        raise ProtocolError(f'Unknown type tag 0x{tag:02x}')
+    size = sizer.unpack_from(view, offset)[0]
+    offset += sizer.size
+    if tag in (0xd9, 0xda, 0xdb):
+        return str(view[offset:offset + size], 'utf-8'), offset + size
+    if tag in (0xc4, 0xc5, 0xc6):
+        return bytes(view[offset:offset + size]), offset + size
+    if tag in (0xdc, 0xdd):
+        return _unpack_list(view, offset, size)
+    return _unpack_map(view, offset, size)
+
+def _unpack_list(view, offset, size):
+    items = []
+    for _ in range(size):
+        value, offset = _unpack(view, offset)
+        items.append(value)
+    return items, offset
+
+def _unpack_map(view, offset, size):
+    result = {}
+    for _ in range(size):
+        key, offset = _unpack(view, offset)
+        value, offset = _unpack(view, offset)
+        result[key] = value
+    return result, offset
+
+# --- framing -------------------------------------------------------------
+
+class Protocol:
+    """Framing and encoding agreed for one connection."""
+
+    def __init__(self, version=PROTOCOL_VERSION, encoding=ENCODING_JSON, default=None):
+        self.version = version
+        self.encoding = encoding
+        self.default = default
+
+    @property
+    def legacy(self):
+        return self.version < 2
+
+    def encode(self, obj):
+        if type(obj) is Cached:
+            return obj.payload(self.encoding, self.default)
+        if self.encoding == ENCODING_BINARY:
+            return pack(obj, self.default)
+        return json.dumps(obj, default=self.default).encode()
+
+    def decode(self, payload):
+        if self.encoding == ENCODING_BINARY:
+            return unpack(payload)
+        return json.loads(bytes(payload).decode())
+
+    def header(self, size):
+        if self.legacy:
+            if size > LEGACY_MAX:
+                raise ProtocolError(f'{size} byte message does not fit the legacy header')
+            return str(size).zfill(4).encode()
+        return struct.pack('>I', size)
+
+    def frame(self, obj):
+        payload = self.encode(obj)
+        return self.header(len(payload)) + payload
+
+    def frame_size(self, header):
+        if self.legacy:
+            try:
+                return int(bytes(header).decode())
+            except ValueError:
+                raise ProtocolError('Bad legacy header')
+        size = struct.unpack('>I', header)[0]
+        if size > MAX_FRAME:
+            raise ProtocolError(f'Frame of {size} bytes is too large')
+        return size
+
+    def hello(self):
+        return MAGIC + bytes((self.version, self.encoding))
+
+LEGACY = Protocol(version=1, encoding=ENCODING_JSON)
+
+def negotiate(hello, default=None):
+    """Server side: turn the 2 bytes after MAGIC into the agreed Protocol."""
+    version, encoding = hello[0], hello[1]
+    if encoding not in ENCODINGS.values():
+        encoding = ENCODING_JSON
+    return Protocol(min(version, PROTOCOL_VERSION), encoding, default)
+
+def recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if not n:
+            return None
+        got += n
+    return buf
+
+def server_handshake(sock, default=None):
+    """Read the first 4 bytes of a connection and work out its protocol.
+
+    Returns (protocol, pending_header). A legacy client has already sent
+    its first length header, which is handed back as pending_header.
+    """
+    head = recv_exact(sock, 4)
+    if head is None:
+        return None, None
+    if bytes(head) != MAGIC:
+        return Protocol(1, ENCODING_JSON, default), head
+
+    hello = recv_exact(sock, 2)
+    if hello is None:
+        return None, None
+    proto = negotiate(hello, default)
+    sock.sendall(proto.hello())
+    return proto, None
+
+def client_handshake(sock, encoding=ENCODING_JSON):
+    sock.sendall(MAGIC + bytes((PROTOCOL_VERSION, encoding)))
+    reply = recv_exact(sock, 6)
+    if reply is None or bytes(reply[:4]) != MAGIC:
+        raise ProtocolError('Server does not speak protocol v2')
+    return Protocol(reply[4], reply[5])
+
+def read_frame(sock, proto, header=None):
+    if header is None:
+        header = recv_exact(sock, 4)
+        if header is None:
+            return None
+    payload = recv_exact(sock, proto.frame_size(header))
+    if payload is None:
+        return None
+    return proto.decode(payload)
+
+async def server_handshake_async(reader, writer, default=None):
+    head = await reader.readexactly(4)
+    if head != MAGIC:
+        return Protocol(1, ENCODING_JSON, default), head
+
+    proto = negotiate(await reader.readexactly(2), default)
+    writer.write(proto.hello())
+    return proto, None
+
+async def client_handshake_async(reader, writer, encoding=ENCODING_JSON):
+    writer.write(MAGIC + bytes((PROTOCOL_VERSION, encoding)))
+    reply = await reader.readexactly(6)
+    if reply[:4] != MAGIC:
+        raise ProtocolError('Server does not speak protocol v2')
+    return Protocol(reply[4], reply[5])
+
+async def read_payload_async(reader, proto, header=None):
+    """Next frame's payload, still encoded."""
+    if header is None:
+        header = await reader.readexactly(4)
+    return await reader.readexactly(proto.frame_size(header))
+
+async def read_frame_async(reader, proto, header=None):
+    return proto.decode(await read_payload_async(reader, proto, header))
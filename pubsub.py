@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+RPG Game pub/sub - event push ke client yang subscribe
+Dipakai server.py (command subscribe / unsubscribe / say)
+
+Topics are plain strings: 'player:<name>' for one player's own events,
+'global' for everyone, 'channel:<name>' for chat-style channels.
+
+publish() only queues the event; one delivery thread sends it. Each event
+is encoded once per wire encoding, and that same frame is written to every
+subscriber using the encoding, so a thousand subscribers cost one encode.
+Delivery never writes to a socket: each connection has an Outbox, a
+bounded queue its own writer drains. A subscriber that isn't reading loses
+its oldest events instead of holding up everyone else, and is cut off only
+once a whole outbox worth of events has been lost without it catching up.
+
+Events published with a key replace an undelivered event with the same
+key, so a burst (say, leaderboard changes) goes out once. publish_at()
+delivers later; a newer publish_at() with the same key cancels the older
+(the same one again is a no-op). Cancelled timers stay in the heap until
+they make up half of it, then the heap is rebuilt without them.
+
+A subscriber is anything with .proto, .topics (a set), .push(frame) that
+returns False when an event was lost, and .accepts(topic).
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import protocol
+
+OUTBOX_SIZE = 256
+
+class Outbox:
+    """Push frames waiting for one connection's writer.
+
+    put() never blocks. on_ready is called when a frame lands in an empty
+    outbox (a writer waiting in take() is woken anyway); on_overflow once,
+    when the connection should be given up on.
+    """
+
+    def __init__(self, size=OUTBOX_SIZE, on_ready=None, on_overflow=None):
+        self.size = size
+        self.frames = collections.deque()
+        self.ready = threading.Condition()
+        self.on_ready = on_ready
+        self.on_overflow = on_overflow
+        # Frames lost since the writer last emptied the outbox
+        self.lost = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self.ready:
+            if self.closed:
+                return False
+            was_empty = not self.frames
+            kept = len(self.frames) < self.size
+            if not kept:
+                self.frames.popleft()
+                self.lost += 1
+            self.frames.append(frame)
+            self.ready.notify()
+            give_up = self.lost >= self.size
+            if give_up:
+                self.closed = True
+        if give_up:
+            if self.on_overflow is not None:
+                self.on_overflow()
+        elif was_empty and self.on_ready is not None:
+            self.on_ready()
+        return kept
+
+    def take(self, wait=True):
+        """Everything queued, as one chunk of bytes. b'' if nothing is
+        queued and wait is False; None once closed."""
+        with self.ready:
+            while wait and not self.frames and not self.closed:
+                self.ready.wait()
+            if self.closed:
+                return None
+            chunk = b''.join(self.frames)
+            self.frames.clear()
+            self.lost = 0
+            return chunk
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.frames.clear()
+            self.ready.notify()
+
+class Hub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.topics = {}
+        self.queue = collections.deque()
+        self.pending = {}
+        self.timers = []
+        self.scheduled = {}
+        self.cancelled = 0
+        self.seq = itertools.count()
+        self.subscriptions = 0
+        self.events = 0
+        self.frames = 0
+        self.dropped = 0
+
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def subscribe(self, subscriber, topic):
+        with self.lock:
+            if topic in subscriber.topics:
+                return
+            self.topics.setdefault(topic, set()).add(subscriber)
+            subscriber.topics.add(topic)
+            self.subscriptions += 1
+
+    def unsubscribe(self, subscriber, topics=None):
+        with self.lock:
+            for topic in list(subscriber.topics if topics is None else topics):
+                if topic not in subscriber.topics:
+                    continue
+                subscriber.topics.discard(topic)
+                self.subscriptions -= 1
+                members = self.topics[topic]
+                members.discard(subscriber)
+                if not members:
+                    del self.topics[topic]
+
+    def has_subscribers(self, topic):
+        return topic in self.topics
+
+    def publish(self, topic, event, data=None, key=None):
+        # Nobody listening: nothing to encode or queue
+        if topic not in self.topics:
+            return False
+        with self.wake:
+            self.enqueue(topic, event, data, key)
+        return True
+
+    def publish_at(self, when, topic, event, data=None, key=None):
+        with self.wake:
+            timer = (when, next(self.seq), topic, event, data, key)
+            if key is not None:
+                old = self.scheduled.get(key)
+                if old is not None:
+                    if old[0] == when and old[2:5] == (topic, event, data):
+                        return
+                    self.cancelled += 1
+                self.scheduled[key] = timer
+            heapq.heappush(self.timers, timer)
+            if self.cancelled > len(self.timers) // 2:
+                self.compact()
+            self.wake.notify()
+
+    def compact(self):
+        # Caller holds the lock
+        self.timers = [timer for timer in self.timers
+                       if timer[5] is None or self.scheduled.get(timer[5]) is timer]
+        heapq.heapify(self.timers)
+        self.cancelled = 0
+
+    def enqueue(self, topic, event, data, key):
+        # Caller holds the lock
+        if key is not None:
+            item = self.pending.get(key)
+            if item is not None:
+                item[1], item[2] = event, data
+                return
+        item = [topic, event, data, key]
+        if key is not None:
+            self.pending[key] = item
+        self.queue.append(item)
+        self.wake.notify()
+
+    def run(self):
+        while True:
+            with self.wake:
+                while not self.queue:
+                    now = time.time()
+                    while self.timers and self.timers[0][0] <= now:
+                        timer = heapq.heappop(self.timers)
+                        _, _, topic, event, data, key = timer
+                        if key is not None:
+                            if self.scheduled.get(key) is not timer:
+                                self.cancelled -= 1
+                                continue
+                            del self.scheduled[key]
+                        if topic in self.topics:
+                            self.enqueue(topic, event, data, None)
+                    if self.queue:
+                        break
+                    self.wake.wait(self.timers[0][0] - now if self.timers else None)
+                topic, event, data, key = self.queue.popleft()
+                if key is not None:
+                    self.pending.pop(key, None)
+                subscribers = list(self.topics.get(topic, ()))
+            try:
+                self.deliver(topic, event, data, subscribers)
+            except Exception as e:
+                print(f"[!] Push error: {e}")
+
+    def deliver(self, topic, event, data, subscribers):
+        message = protocol.push_message(topic, event, data)
+        frames = {}
+        for subscriber in subscribers:
+            if not subscriber.accepts(topic):
+                continue
+            proto = subscriber.proto
+            frame = frames.get(proto.encoding)
+            if frame is None:
+                frame = frames[proto.encoding] = proto.frame(message)
+            if subscriber.push(frame):
+                self.frames += 1
+            else:
+                self.dropped += 1
+        self.events += 1
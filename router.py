@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+RPG Game router - sharded mode, satu proses per shard
+Jalankan: python server.py --shards 4
+
+Players are split over N shard processes by crc32 of their name. Each
+shard is an ordinary GameServer with its own players file, listening on
+127.0.0.1. The router accepts the client connections, speaks the normal
+protocol to them and forwards every request to the shard that owns its
+player, over one local connection per client and shard.
+
+Most commands touch a single player and are relayed as-is. The rest need
+the router's help:
+
+  pvp across shards  the opponent is checked out from its shard, sent
+                     along to the attacker's shard, then committed back
+                     (or released if the fight didn't happen)
+  leaderboard, my_rank, rank_around, players_online, metrics
+                     asked of every shard and merged here
+  batch              must stay on one shard
+  subscribe, unsubscribe, say
+                     a player topic lives on the player's shard and a
+                     channel on the shard its name hashes to; global is
+                     on every shard, each publishes its own leaderboards
+
+Push frames coming up a shard link are written to the client unchanged:
+the link speaks the client's encoding, so nothing is decoded or encoded
+on the way.
+"""
+
+import asyncio
+import collections
+import heapq
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import zlib
+
+import protocol
+from server import GameServer, GameDatabase, SQLiteGameDatabase, Leaderboards
+import gamelog
+
+def shard_of(name, shards):
+    return zlib.crc32(str(name).encode()) % shards
+
+def shard_file(path, index):
+    root, ext = os.path.splitext(path)
+    return f'{root}.shard{index}{ext}'
+
+def run_shard(index, port, args):
+    """Entry point of one shard process."""
+    if args.db == 'sqlite':
+        db = SQLiteGameDatabase(shard_file(args.db_file or 'players_data.db', index),
+                                write_behind_ms=args.write_behind,
+                                write_behind_max=args.write_behind_max, fsync=args.fsync)
+    else:
+        db = GameDatabase(shard_file(args.db_file or 'players_data.pkl', index), fsync=args.fsync,
+                          write_behind_ms=args.write_behind,
+                          write_behind_max=args.write_behind_max)
+    log = gamelog.AsyncLogger(shard_file(args.log_file, index) if args.log_file else None,
+                              max_bytes=args.log_max_mb * 1024 * 1024,
+                              sample=gamelog.parse_sample(args.log_sample))
+    server = GameServer('127.0.0.1', port, db, workers=args.workers, admin_token=args.admin_token,
+                        log=log, internal=True)
+    try:
+        if args.engine == 'asyncio':
+            server.start_async()
+        else:
+            server.start()
+    except KeyboardInterrupt:
+        pass
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+class Link:
+    """One client's connection to one shard.
+
+    A reader task takes every frame off the link: responses answer the
+    calls in the order they were sent, pushes go to relay().
+    """
+
+    def __init__(self, reader, writer, proto, relay):
+        self.reader = reader
+        self.writer = writer
+        self.proto = proto
+        self.waiting = collections.deque()
+        self.task = asyncio.ensure_future(self.read_loop(relay))
+
+    async def read_loop(self, relay):
+        try:
+            while True:
+                payload = await protocol.read_payload_async(self.reader, self.proto)
+                if protocol.is_push_payload(payload, self.proto.encoding):
+                    relay(payload)
+                elif self.waiting:
+                    self.waiting.popleft().set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError):
+            pass
+        finally:
+            while self.waiting:
+                future = self.waiting.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError('Shard link closed'))
+
+    async def call_raw(self, payload):
+        if self.task.done():
+            raise ConnectionError('Shard link closed')
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.append(future)
+        self.writer.write(self.proto.header(len(payload)) + payload)
+        return await future
+
+    async def call(self, data):
+        return self.proto.decode(await self.call_raw(self.proto.encode(data)))
+
+    def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+class Client:
+    """One client connection on the router: its shard links and who it is."""
+
+    def __init__(self, router, writer, proto, home):
+        self.router = router
+        self.writer = writer
+        self.proto = proto
+        self.home = home
+        self.player = None
+        self.links = {}
+
+    async def link(self, shard):
+        link = self.links.get(shard)
+        if link is None:
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.router.shard_ports[shard])
+            # Links use the client's encoding so replies can be relayed as-is
+            proto = await protocol.client_handshake_async(reader, writer, self.proto.encoding)
+            link = self.links[shard] = Link(reader, writer, proto, self.relay)
+        return link
+
+    def relay(self, payload):
+        # Same rule as the shards: a client that isn't reading misses pushes
+        transport = self.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > GameServer.PUSH_BUFFER:
+            return
+        self.writer.write(self.proto.header(len(payload)) + payload)
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+
+class Router:
+    def __init__(self, host, port, shard_ports, backlog=128, idle_timeout=None):
+        self.host = host
+        self.port = port
+        self.shard_ports = shard_ports
+        self.shards = len(shard_ports)
+        self.backlog = backlog
+        # Shards never time out the router's links; idle clients are
+        # dropped here, which closes their links and logs them out.
+        self.idle_timeout = idle_timeout or None
+        self.connections = 0
+        self.special = {
+            'pvp': self.pvp,
+            'batch': self.batch,
+            'leaderboard': self.leaderboard,
+            'my_rank': self.my_rank,
+            'rank_around': self.rank_around,
+            'players_online': self.players_online,
+            'metrics': self.metrics,
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'say': self.say,
+        }
+
+    def start(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(
+            self.handle_stream, self.host, self.port, backlog=self.backlog, reuse_address=True
+        ))
+        print(f"[✓] Router started on {self.host}:{self.port} ({self.shards} shards)")
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+    async def handle_stream(self, reader, writer):
+        self.connections += 1
+        # Requests without a player are spread over the shards by connection
+        home = self.connections % self.shards
+        client = None
+        try:
+            proto, header = await protocol.server_handshake_async(reader, writer)
+            client = Client(self, writer, proto, home)
+            while True:
+                payload = await asyncio.wait_for(protocol.read_payload_async(reader, proto, header),
+                                                 self.idle_timeout)
+                header = None
+                data = proto.decode(payload)
+                if not isinstance(data, dict):
+                    break
+
+                cmd = data.get('cmd')
+                # Internal commands and fields are for shards only
+                if any(isinstance(k, str) and k.startswith('_') for k in data) or \
+                        isinstance(cmd, str) and cmd.startswith('_'):
+                    reply = proto.encode(self.reply(data, {'status': 'error', 'msg': 'Unknown command'}))
+                elif cmd in self.special:
+                    response = await self.special[cmd](data, client)
+                    reply = proto.encode(self.reply(data, response))
+                else:
+                    name = data.get('player') or data.get('name')
+                    shard = home if name is None else shard_of(name, self.shards)
+                    link = await client.link(shard)
+                    reply = await link.call_raw(payload)
+                    # The shard bound its side of the link; say needs the name here
+                    if cmd in ('login', 'register') and proto.decode(reply).get('status') == 'ok':
+                        client.player = name
+
+                try:
+                    writer.write(proto.header(len(reply)) + reply)
+                except protocol.ProtocolError as e:
+                    writer.write(proto.frame({'status': 'error', 'msg': str(e)}))
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"[!] Router error: {e}")
+        finally:
+            if client is not None:
+                client.close()
+            writer.close()
+
+    def reply(self, data, response):
+        if 'id' in data:
+            response['id'] = data['id']
+        return response
+
+    async def each_shard(self, client, data):
+        links = [await client.link(shard) for shard in range(self.shards)]
+        return await asyncio.gather(*(l.call(data) for l in links))
+
+    # --- commands that span shards ---
+
+    async def pvp(self, data, client):
+        name, opponent = data.get('player'), data.get('opponent')
+        home = shard_of(name, self.shards)
+        away = shard_of(opponent, self.shards) if opponent else home
+        if away == home:
+            return await (await client.link(home)).call(data)
+
+        token = os.urandom(8).hex()
+        away_link = await client.link(away)
+        checkout = await away_link.call({'cmd': '_shard_checkout', 'player': opponent, 'token': token})
+        if checkout.get('status') != 'ok':
+            if checkout.get('msg') == 'Player not found':
+                checkout['msg'] = f'Opponent {opponent} not found'
+            return checkout
+
+        response = {'status': 'error', 'msg': 'Shard unavailable'}
+        try:
+            response = await (await client.link(home)).call(dict(data, _opponent=checkout['player']))
+        finally:
+            opponent_data = response.pop('_opponent', None)
+            if response.get('status') == 'ok' and opponent_data:
+                # The opponent's shard tells it about the fight
+                await away_link.call({'cmd': '_shard_commit', 'player': opponent, 'token': token,
+                                      'data': opponent_data, 'event': response.pop('_event', None)})
+            else:
+                await away_link.call({'cmd': '_shard_release', 'player': opponent, 'token': token})
+        return response
+
+    async def batch(self, data, client):
+        shards = set()
+        for sub in data.get('commands') or ():
+            if isinstance(sub, dict):
+                for name in (sub.get('player'), sub.get('name'), sub.get('opponent')):
+                    if name is not None:
+                        shards.add(shard_of(name, self.shards))
+        if data.get('player') is not None:
+            shards.add(shard_of(data['player'], self.shards))
+        if len(shards) > 1:
+            return {'status': 'error', 'msg': 'Batch touches players on different shards'}
+        return await (await client.link(shards.pop() if shards else 0)).call(data)
+
+    async def leaderboard(self, data, client):
+        board = data.get('board', 'level')
+        fields = Leaderboards.BOARDS.get(board)
+        if not fields:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        results = await self.each_shard(client, {'cmd': 'leaderboard', 'board': board})
+        # Every shard's list is already best first, so a merge is enough
+        def key(player):
+            return tuple(-(player.get(field) or 0) for field in fields) + (player['name'],)
+        players = heapq.merge(*(r.get('leaderboard', []) for r in results), key=key)
+        return {'status': 'ok', 'board': board, 'leaderboard': list(players)[:20]}
+
+    async def rank_window(self, data, client, radius):
+        board = data.get('board', 'level')
+        home = await client.link(shard_of(data.get('player'), self.shards))
+        found = await home.call({'cmd': '_shard_rank_key', 'board': board, 'player': data.get('player')})
+        if found.get('status') != 'ok':
+            return found, None, None
+        windows = await self.each_shard(client, {'cmd': '_shard_rank_window', 'board': board,
+                                               'key': found['key'], 'radius': radius})
+        # A shard that can't answer would make the rank wrong, not just short
+        for window in windows:
+            if window.get('status') != 'ok':
+                return window, None, None
+        return found, windows, found['key']
+
+    async def my_rank(self, data, client):
+        found, windows, key = await self.rank_window(data, client, 0)
+        if windows is None:
+            return found
+        rank = sum(w['ahead'] for w in windows) + 1
+        return {'status': 'ok', 'board': data.get('board', 'level'), 'rank': rank,
+                'total': sum(w['total'] for w in windows)}
+
+    async def rank_around(self, data, client):
+        try:
+            radius = min(max(int(data.get('radius', 5)), 0), 25)
+        except (TypeError, ValueError) as e:
+            return {'status': 'error', 'msg': f'RANK_AROUND error: {e}'}
+        found, windows, key = await self.rank_window(data, client, radius)
+        if windows is None:
+            return found
+
+        # The radius players just ahead of us overall are among each
+        # shard's radius players just ahead, and the same for behind.
+        ahead = sum(w['ahead'] for w in windows)
+        entries = sorted((tuple(k), entry) for w in windows for k, entry in w['entries'])
+        keys = [k for k, _ in entries]
+        mine = keys.index(tuple(key))
+        start = max(0, mine - radius)
+        players = []
+        for offset, (_, entry) in enumerate(entries[start:mine + radius + 1]):
+            entry['rank'] = ahead - (mine - start) + offset + 1
+            players.append(entry)
+        return {'status': 'ok', 'board': data.get('board', 'level'), 'rank': ahead + 1, 'players': players}
+
+    async def players_online(self, data, client):
+        try:
+            offset = max(int(data.get('offset', 0)), 0)
+            limit = min(max(int(data.get('limit', 50)), 0), GameServer.MAX_ONLINE_PAGE)
+        except (TypeError, ValueError) as e:
+            return {'status': 'error', 'msg': f'PLAYERS_ONLINE error: {e}'}
+        # Counts first, then pages only from the shards the page falls on,
+        # taking the shards in order as if their lists were one.
+        counts = [r.get('count', 0) for r in await self.each_shard(client, {'cmd': 'players_online', 'limit': 0})]
+        players = []
+        skip = offset
+        for shard, count in enumerate(counts):
+            if len(players) >= limit:
+                break
+            if skip >= count:
+                skip -= count
+                continue
+            page = await (await client.link(shard)).call({'cmd': 'players_online', 'offset': skip,
+                                                    'limit': limit - len(players)})
+            players.extend(page.get('players', []))
+            skip = 0
+        return {'status': 'ok', 'count': sum(counts), 'offset': offset, 'players': players}
+
+    async def subscribe(self, data, client, cmd='subscribe'):
+        if client.proto.legacy:
+            return {'status': 'error', 'msg': 'Push needs a protocol v2 connection'}
+        topics = data.get('topics')
+        if isinstance(topics, str):
+            topics = [topics]
+        if not isinstance(topics, list) and not (cmd == 'unsubscribe' and topics is None):
+            return {'status': 'error', 'msg': 'Invalid data'}
+
+        by_shard = collections.defaultdict(list)
+        for topic in topics or ():
+            if topic == 'player' or isinstance(topic, str) and topic.startswith('player:'):
+                name = client.player if topic == 'player' else topic[7:]
+                by_shard[shard_of(name, self.shards) if name else client.home].append(topic)
+            elif topic == 'global':
+                for shard in range(self.shards):
+                    by_shard[shard].append(topic)
+            else:
+                by_shard[shard_of(topic, self.shards)].append(topic)
+        if topics is None:
+            by_shard = {shard: None for shard in client.links}
+
+        results = await asyncio.gather(*[
+            (await client.link(shard)).call({'cmd': cmd, 'topics': shard_topics})
+            for shard, shard_topics in by_shard.items()
+        ])
+        subscribed = set()
+        for result in results:
+            if result.get('status') != 'ok':
+                return result
+            subscribed.update(result['topics'])
+        return {'status': 'ok', 'topics': sorted(subscribed)}
+
+    async def unsubscribe(self, data, client):
+        return await self.subscribe(data, client, 'unsubscribe')
+
+    async def say(self, data, client):
+        if client.player is None:
+            return {'status': 'error', 'msg': 'Log in first'}
+        if 'channel' not in data or 'text' not in data:
+            return {'status': 'error', 'msg': 'Invalid data'}
+        channel = str(data['channel'])
+        if not 0 < len(channel) <= 32:
+            return {'status': 'error', 'msg': 'Invalid channel'}
+        topic = f'channel:{channel}'
+        link = await client.link(shard_of(topic, self.shards))
+        return await link.call({'cmd': '_shard_publish', 'topic': topic, 'event': 'message',
+                                'data': {'from': client.player, 'text': str(data['text'])[:200]}})
+
+    async def metrics(self, data, client):
+        results = await self.each_shard(client, dict(data, cmd='metrics'))
+        if any(r.get('status') != 'ok' for r in results):
+            return results[0]
+        return {'status': 'ok', 'shards': [r['metrics'] for r in results]}
+
+def run(args):
+    """Start args.shards shard processes and route to them from here."""
+    base = args.shard_port or args.port + 1
+    ports = [base + i for i in range(args.shards)]
+    processes = []
+    for index, port in enumerate(ports):
+        process = multiprocessing.Process(target=run_shard, args=(index, port, args))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    try:
+        for port in ports:
+            wait_for_port(port)
+        Router(args.host, args.port, ports, idle_timeout=args.idle_timeout).start()
+    except KeyboardInterrupt:
+        print("\n[!] Router shutting down...")
+    finally:
+        # Shards close their databases on Ctrl+C. From a terminal they get
+        # it too, otherwise pass it on.
+        for process in processes:
+            if process.is_alive():
+                try:
+                    os.kill(process.pid, signal.SIGINT)
+                except OSError:
+                    pass
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
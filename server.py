@@ -10,73 +10,1278 @@ import socket
 import threading
 import json
 import time
-import random
 import os
 import pickle
+import shutil
+import struct
+import sqlite3
+import bisect
+import collections
+import contextlib
+import argparse
+import asyncio
+import concurrent.futures
+import sys
+import hmac
+import zlib
+import protocol
+import metrics
+import gamelog
+import combat
+import matchmaking
+import pubsub
+from array import array
 from datetime import datetime
 
+# Item names are stored once and referred to by small integer IDs. The IDs
+# only live in memory; anything written to disk or the wire uses the names.
+ITEM_NAMES = []
+ITEM_IDS = {}
+ITEM_LOCK = threading.Lock()
+
+def item_id(name):
+    iid = ITEM_IDS.get(name)
+    if iid is None:
+        with ITEM_LOCK:
+            iid = ITEM_IDS.get(name)
+            if iid is None:
+                iid = len(ITEM_NAMES)
+                ITEM_NAMES.append(sys.intern(name))
+                ITEM_IDS[ITEM_NAMES[iid]] = iid
+    return iid
+
+def intern_name(name):
+    return sys.intern(name) if isinstance(name, str) else name
+
+class Inventory:
+    """List of item names stored as a compact array of item IDs.
+
+    Appends and removes are reported to the owning PlayerRecord so they
+    can be sent to clients as inventory deltas.
+    """
+    
+    __slots__ = ('ids', 'owner')
+    
+    def __init__(self, names=(), owner=None):
+        self.ids = array('H', (item_id(name) for name in names))
+        self.owner = owner
+    
+    def append(self, name):
+        self.ids.append(item_id(name))
+        if self.owner is not None:
+            self.owner.touch('inventory', '+', name)
+    
+    def remove(self, name):
+        iid = ITEM_IDS.get(name)
+        if iid is None:
+            raise ValueError(f'{name} not in inventory')
+        self.ids.remove(iid)
+        if self.owner is not None:
+            self.owner.touch('inventory', '-', name)
+    
+    def count(self, name):
+        iid = ITEM_IDS.get(name)
+        return 0 if iid is None else self.ids.count(iid)
+    
+    def __contains__(self, name):
+        iid = ITEM_IDS.get(name)
+        return iid is not None and iid in self.ids
+    
+    def __iter__(self):
+        return (ITEM_NAMES[iid] for iid in self.ids)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __eq__(self, other):
+        return list(self) == list(other)
+    
+    def to_list(self):
+        return [ITEM_NAMES[iid] for iid in self.ids]
+
+class TrackedList(list):
+    """A list field of a PlayerRecord that bumps its version when changed."""
+    
+    __slots__ = ('owner', 'key')
+    
+    def __init__(self, values=(), owner=None, key=None):
+        list.__init__(self, values)
+        self.owner = owner
+        self.key = key
+    
+    def changed(self):
+        if self.owner is not None:
+            self.owner.touch(self.key)
+    
+    def append(self, value):
+        list.append(self, value)
+        self.changed()
+    
+    def extend(self, values):
+        list.extend(self, values)
+        self.changed()
+    
+    def insert(self, index, value):
+        list.insert(self, index, value)
+        self.changed()
+    
+    def remove(self, value):
+        list.remove(self, value)
+        self.changed()
+    
+    def pop(self, index=-1):
+        value = list.pop(self, index)
+        self.changed()
+        return value
+    
+    def clear(self):
+        list.clear(self)
+        self.changed()
+
+class PlayerRecord:
+    """One player, with a slot per field instead of a per-player dict.
+
+    Handlers keep using player['gold'] style access. Class, equipment and
+    skill names are interned, and the inventory is an Inventory. Fields
+    this class doesn't know about go into `extra`.
+
+    Every change bumps `version` and is remembered in a short change log,
+    so delta_since() can tell a client what changed since the version it
+    holds. Inside batched() the changes share one version, with one log
+    entry per field and one for all the inventory moves.
+    """
+    
+    FIELDS = (
+        'name', 'class', 'level', 'exp', 'exp_max', 'hp', 'max_hp', 'mana', 'max_mana',
+        'atk', 'def', 'speed', 'gold', 'inventory', 'weapon', 'armor', 'ring',
+        'kills', 'deaths', 'battles', 'pvp_wins', 'pvp_loses', 'rating', 'active_quests',
+        'completed_quests', 'daily_reward_time', 'dungeon_level', 'skills', 'created',
+        'offline_seed', 'offline_journal', 'version',
+    )
+    FIELD_SET = frozenset(FIELDS)
+    # Kept on disk but never sent to the client
+    PRIVATE = ('offline_seed',)
+    INTERNED = ('class', 'weapon', 'armor', 'ring')
+    LISTS = ('active_quests', 'completed_quests', 'skills')
+    DEFAULTS = {
+        'level': 1, 'exp': 0, 'exp_max': 100, 'mana': 100, 'max_mana': 100, 'speed': 10,
+        'gold': 0, 'kills': 0, 'deaths': 0, 'battles': 0, 'pvp_wins': 0, 'pvp_loses': 0,
+        'rating': matchmaking.START_RATING,
+        'daily_reward_time': 0, 'dungeon_level': 0, 'offline_seed': 0, 'offline_journal': 0,
+        'version': 0,
+    }
+    CHANGE_LOG = 64
+    
+    __slots__ = FIELDS + ('extra', 'changes', 'pending')
+    
+    def __init__(self, **fields):
+        for key in self.FIELDS:
+            setattr(self, key, self.DEFAULTS.get(key))
+        self.extra = None
+        self.changes = None
+        self.pending = None
+        self.inventory = Inventory(owner=self)
+        for key in self.LISTS:
+            setattr(self, key, TrackedList(owner=self, key=key))
+        for key, value in fields.items():
+            self.assign(key, value)
+    
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(**data)
+    
+    def __getitem__(self, key):
+        if key in self.FIELD_SET:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        self.assign(key, value)
+        self.touch(key)
+    
+    def assign(self, key, value):
+        if key == 'inventory':
+            value = Inventory(value, owner=self)
+        elif key in self.LISTS:
+            value = TrackedList((intern_name(v) for v in value), owner=self, key=key)
+        elif key in self.INTERNED:
+            value = intern_name(value)
+        elif key not in self.FIELD_SET:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+            return
+        setattr(self, key, value)
+    
+    def touch(self, key, op=None, item=None):
+        if self.pending is not None:
+            self.pending.append((key, op, item))
+            return
+        self.version += 1
+        if self.changes is None:
+            self.changes = collections.deque(maxlen=self.CHANGE_LOG)
+        self.changes.append((self.version, key, op, item))
+    
+    @contextlib.contextmanager
+    def batched(self):
+        """Log everything changed in the block as one version, so a long
+        command can't push a client's version out of the change log."""
+        self.pending = []
+        try:
+            yield self
+        finally:
+            pending, self.pending = self.pending, None
+            if pending:
+                self.version += 1
+                if self.changes is None:
+                    self.changes = collections.deque(maxlen=self.CHANGE_LOG)
+                for key in dict.fromkeys(key for key, op, _ in pending if not op):
+                    self.changes.append((self.version, key, None, None))
+                moves = [[op, item] for _, op, item in pending if op]
+                if moves:
+                    self.changes.append((self.version, 'inventory', '*', moves))
+    
+    def delta_since(self, version):
+        """Changes after `version`, or None if the client must resync."""
+        if version == self.version:
+            return {'version': self.version, 'fields': {}, 'inventory': []}
+        
+        changes = self.changes
+        if not isinstance(version, int) or version > self.version or not changes or changes[0][0] > version + 1:
+            return None
+        
+        fields = set()
+        ops = []
+        for changed, key, op, item in changes:
+            if changed <= version:
+                continue
+            if op == '*':
+                ops.extend(item)
+            elif op:
+                ops.append([op, item])
+            else:
+                fields.add(key)
+        
+        # A wholesale inventory replacement is sent in full
+        if 'inventory' in fields:
+            ops = []
+        fields.discard('version')
+        fields.difference_update(self.PRIVATE)
+        return {
+            'version': self.version,
+            'fields': {key: self[key] for key in fields},
+            'inventory': ops,
+        }
+    
+    def restore(self, data):
+        """Roll fields back to an earlier to_dict() snapshot.
+
+        The version keeps going up so clients see the rollback as changes.
+        """
+        for key, value in data.items():
+            if key != 'version' and self.get(key) != value:
+                self[key] = value
+    
+    def __contains__(self, key):
+        return key in self.FIELD_SET or bool(self.extra and key in self.extra)
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        return list(self.FIELDS) + list(self.extra or ())
+    
+    def to_dict(self):
+        """Plain dict view, used for JSON responses and on disk."""
+        data = {key: getattr(self, key) for key in self.FIELDS}
+        data['inventory'] = self.inventory.to_list()
+        for key in self.LISTS:
+            data[key] = list(data[key])
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    def public(self):
+        """to_dict() without the PRIVATE fields, for responses."""
+        data = self.to_dict()
+        for key in self.PRIVATE:
+            del data[key]
+        return data
+
+def pack_player(player):
+    # Pickle the dict view so files never reference this module's classes
+    return pickle.dumps(player.to_dict(), pickle.HIGHEST_PROTOCOL)
+
+def unpack_player(blob):
+    return PlayerRecord.from_dict(pickle.loads(blob))
+
+def json_default(obj):
+    if isinstance(obj, PlayerRecord):
+        return obj.public()
+    if isinstance(obj, Inventory):
+        return obj.to_list()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+class WriteBehind:
+    """Collects dirty players and commits them in batches.
+
+    A batch is committed once max_pending players are dirty or interval_ms
+    after the first one was marked, whichever comes first. That interval is
+    the most a crash can lose. flush() blocks until everything marked
+    before the call is on disk.
+
+    mark() takes the player already packed for commit: it is called under
+    the player's lock, while the flusher runs without it and would
+    otherwise see a handler's changes half made.
+    """
+    
+    def __init__(self, commit, interval_ms=50, max_pending=100):
+        self.commit = commit
+        self.interval = interval_ms / 1000.0
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.dirty = {}
+        self.marked = 0
+        self.committed = 0
+        self.flush_requested = False
+        
+        thread = threading.Thread(target=self.flush_loop)
+        thread.daemon = True
+        thread.start()
+    
+    def mark(self, name, record):
+        with self.cond:
+            self.dirty[name] = record
+            self.marked += 1
+            if len(self.dirty) == 1 or len(self.dirty) >= self.max_pending:
+                self.cond.notify_all()
+    
+    def flush(self):
+        with self.cond:
+            target = self.marked
+            if self.committed >= target:
+                return
+            self.flush_requested = True
+            self.cond.notify_all()
+            while self.committed < target:
+                self.cond.wait()
+    
+    def flush_loop(self):
+        while True:
+            with self.cond:
+                while not self.dirty:
+                    self.cond.wait()
+                
+                deadline = time.time() + self.interval
+                while len(self.dirty) < self.max_pending and not self.flush_requested:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                
+                batch = list(self.dirty.values())
+                self.dirty = {}
+                marked = self.marked
+                self.flush_requested = False
+            
+            self.commit(batch)
+            
+            with self.cond:
+                self.committed = marked
+                self.cond.notify_all()
+    
+    def stats(self):
+        return {'write_behind_pending': len(self.dirty), 'write_behind_lag': self.marked - self.committed}
+
+class SaveMetrics:
+    """save_player timings, attached to a database by GameServer."""
+    
+    def __init__(self, registry):
+        self.duration = registry.histogram('save_player_seconds', 'Time spent in save_player')
+        self.lock_wait = registry.histogram('db_lock_wait_seconds', 'Time spent waiting for the database lock')
+
 class GameDatabase:
-    def __init__(self):
-        self.players_file = 'players_data.pkl'
+    # Snapshot layout: SNAPSHOT_MAGIC, then one record per player:
+    # >I record length, >H name length, name, pickled player.
+    # Files without the magic are the old single-pickle format.
+    SNAPSHOT_MAGIC = b'RPGSNAP1'
+    
+    def __init__(self, players_file='players_data.pkl', compact_every=500, fsync=False,
+                 write_behind_ms=0, write_behind_max=100, readonly=False):
+        # readonly only loads the players (for --migrate): the files are
+        # left exactly as they are, and nothing can be saved
+        self.readonly = readonly
+        self.players_file = players_file
+        self.journal_file = players_file + '.journal'
+        self.compact_every = compact_every
+        self.fsync = fsync
         self.lock = threading.Lock()
-        self.load_data()
+        self.checkpoint_lock = threading.Lock()
+        self.journal = None
+        self.journal_records = 0
+        # Serialized records saved since the last checkpoint. Blobs are
+        # immutable, so swapping this dict out is a consistent snapshot.
+        self.changed = {}
+        self.checkpoint_stats = {
+            'checkpoints': 0,
+            'last_duration_ms': 0.0,
+            'last_lock_ms': 0.0,
+            'last_bytes': 0,
+            'last_records': 0,
+            'total_bytes': 0,
+            'failures': 0,
+        }
+        self.compact_event = threading.Event()
+        self.on_save = []
+        self.metrics = None
+        self.write_behind = None
+        replayed = self.load_data()
+        if readonly:
+            return
+        self.open_journal()
+        if replayed:
+            self.checkpoint()
+        
+        thread = threading.Thread(target=self.checkpoint_loop)
+        thread.daemon = True
+        thread.start()
+        
+        if write_behind_ms > 0:
+            self.write_behind = WriteBehind(self.write_blobs, write_behind_ms, write_behind_max)
     
     def load_data(self):
+        self.players = {}
+        replayed = 0
         if os.path.exists(self.players_file):
             try:
-                with open(self.players_file, 'rb') as f:
-                    self.players = pickle.load(f)
-                print(f"[DB] Loaded {len(self.players)} players")
-            except:
+                if self.is_snapshot(self.players_file):
+                    for name, blob in self.iter_snapshot():
+                        self.players[name] = unpack_player(blob)
+                else:
+                    with open(self.players_file, 'rb') as f:
+                        legacy = pickle.load(f)
+                    # Old format: everything goes into the first checkpoint
+                    for name, player in legacy.items():
+                        self.players[name] = PlayerRecord.from_dict(player)
+                        self.changed[name] = pack_player(self.players[name])
+                    replayed = len(self.players)
+            except Exception as e:
+                print(f"[DB ERROR] Snapshot unreadable: {e}")
                 self.players = {}
+                self.changed = {}
+        
+        # Snapshot first, then any journal left over from an unfinished
+        # checkpoint, then the live journal. Later records win.
+        for path in (self.journal_file + '.old', self.journal_file):
+            replayed += self.replay_journal(path)
+        
+        print(f"[DB] Loaded {len(self.players)} players ({replayed} records to checkpoint)")
+        return replayed
+    
+    def is_snapshot(self, path):
+        with open(path, 'rb') as f:
+            return f.read(len(self.SNAPSHOT_MAGIC)) == self.SNAPSHOT_MAGIC
+    
+    def iter_snapshot(self):
+        if not os.path.exists(self.players_file) or not self.is_snapshot(self.players_file):
+            return
+        with open(self.players_file, 'rb') as f:
+            f.seek(len(self.SNAPSHOT_MAGIC))
+            while True:
+                header = f.read(6)
+                if len(header) < 6:
+                    return
+                size, name_size = struct.unpack('>IH', header)
+                record = f.read(size)
+                yield record[:name_size].decode(), record[name_size:]
+    
+    def replay_journal(self, path):
+        if not os.path.exists(path):
+            return 0
+        
+        count = 0
+        good = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                size = struct.unpack('>I', header)[0]
+                blob = f.read(size)
+                if len(blob) < size:
+                    break
+                try:
+                    player = unpack_player(blob)
+                except Exception:
+                    break
+                self.players[player['name']] = player
+                self.changed[player['name']] = blob
+                good = f.tell()
+                count += 1
+        
+        # A crash in the middle of an append leaves a torn record at the tail
+        if good < os.path.getsize(path) and not self.readonly:
+            print(f"[DB] Dropping torn tail of {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+        return count
+    
+    def open_journal(self):
+        self.journal = open(self.journal_file, 'ab')
+        self.journal_records = 0
+    
+    def save_player(self, player_data, durable=False):
+        started = time.perf_counter()
+        for hook in self.on_save:
+            hook(player_data)
+        if self.write_behind and not durable:
+            waited = time.perf_counter()
+            with self.lock:
+                locked = time.perf_counter()
+                self.players[player_data['name']] = player_data
+            self.write_behind.mark(player_data['name'], (player_data['name'], pack_player(player_data)))
+            if self.metrics:
+                self.metrics.lock_wait.observe(locked - waited)
         else:
-            self.players = {}
+            self.save_players([player_data])
+        if self.metrics:
+            self.metrics.duration.observe(time.perf_counter() - started)
     
-    def save_player(self, player_data):
+    def save_players(self, players):
+        return self.write_blobs([(p['name'], pack_player(p)) for p in players], players)
+    
+    def write_blobs(self, blobs, players=()):
+        # (name, packed player) pairs into the journal; write-behind batches
+        # come here already packed
+        records = b''.join(struct.pack('>I', len(blob)) + blob for _, blob in blobs)
+        
+        waited = time.perf_counter()
         with self.lock:
-            self.players[player_data['name']] = player_data
+            locked = time.perf_counter()
+            for player_data in players:
+                self.players[player_data['name']] = player_data
+            for name, blob in blobs:
+                self.changed[name] = blob
             try:
-                with open(self.players_file, 'wb') as f:
-                    pickle.dump(self.players, f)
+                self.journal.write(records)
+                self.journal.flush()
+                if self.fsync:
+                    os.fsync(self.journal.fileno())
+                self.journal_records += len(blobs)
             except Exception as e:
                 print(f"[DB ERROR] {e}")
+            
+            if self.journal_records >= self.compact_every:
+                self.compact_event.set()
+        if self.metrics:
+            self.metrics.lock_wait.observe(locked - waited)
+        return len(blobs)
+    
+    def flush(self, sync=False):
+        """Write out pending saves; with sync, also make the OS put them on disk."""
+        if self.write_behind:
+            self.write_behind.flush()
+        if sync and not self.fsync:
+            # The fsync runs outside the lock so other saves don't wait on
+            # the disk. The dup'd fd stays valid through a rotation.
+            with self.lock:
+                fd = os.dup(self.journal.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            # Saves from before a rotation sit in the old journal until the
+            # checkpoint has them in the (synced) snapshot
+            try:
+                fd = os.open(self.journal_file + '.old', os.O_RDONLY)
+            except FileNotFoundError:
+                return
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    def checkpoint_loop(self):
+        while True:
+            self.compact_event.wait()
+            self.compact_event.clear()
+            self.checkpoint()
+    
+    def checkpoint(self):
+        # Only one checkpoint at a time; handlers never take this lock.
+        with self.checkpoint_lock:
+            started = time.time()
+            old_journal = self.journal_file + '.old'
+            with self.lock:
+                changed, self.changed = self.changed, {}
+                
+                # Rotate the journal so saves continue into a fresh file.
+                # A leftover .old from a failed checkpoint is kept and
+                # extended, never overwritten.
+                if self.journal:
+                    self.journal.close()
+                if os.path.exists(self.journal_file):
+                    if os.path.exists(old_journal):
+                        with open(self.journal_file, 'rb') as src, open(old_journal, 'ab') as dst:
+                            shutil.copyfileobj(src, dst)
+                        os.remove(self.journal_file)
+                    else:
+                        os.replace(self.journal_file, old_journal)
+                self.open_journal()
+            locked = time.time()
+            
+            # Merge the previous snapshot with the changed records into a
+            # temp file, then swap it in atomically.
+            tmp_file = self.players_file + '.tmp'
+            written = 0
+            count = 0
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(self.SNAPSHOT_MAGIC)
+                    written += len(self.SNAPSHOT_MAGIC)
+                    for name, blob in self.iter_snapshot():
+                        if name not in changed:
+                            written += self.write_record(f, name, blob)
+                            count += 1
+                    for name, blob in changed.items():
+                        written += self.write_record(f, name, blob)
+                        count += 1
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.players_file)
+                if os.path.exists(old_journal):
+                    os.remove(old_journal)
+            except Exception as e:
+                print(f"[DB ERROR] Checkpoint failed: {e}")
+                self.checkpoint_stats['failures'] += 1
+                # Hand the records back so the next checkpoint retries them,
+                # without clobbering anything saved in the meantime.
+                with self.lock:
+                    for name, blob in changed.items():
+                        self.changed.setdefault(name, blob)
+                return
+            
+            stats = self.checkpoint_stats
+            stats['checkpoints'] += 1
+            stats['last_duration_ms'] = (time.time() - started) * 1000
+            stats['last_lock_ms'] = (locked - started) * 1000
+            stats['last_bytes'] = written
+            stats['last_records'] = count
+            stats['total_bytes'] += written
+    
+    def write_record(self, f, name, blob):
+        name = name.encode()
+        f.write(struct.pack('>IH', len(name) + len(blob), len(name)))
+        f.write(name)
+        f.write(blob)
+        return 6 + len(name) + len(blob)
+    
+    def stats(self):
+        stats = dict(self.checkpoint_stats, players=len(self.players), journal_records=self.journal_records)
+        if self.write_behind:
+            stats.update(self.write_behind.stats())
+        return stats
+    
+    def close(self):
+        if self.readonly:
+            return
+        self.flush()
+        self.checkpoint()
+        with self.lock:
+            self.journal.close()
     
     def get_player(self, name):
         return self.players.get(name)
     
     def player_exists(self, name):
         return name in self.players
+    
+    def rank_rows(self):
+        return list(self.players.values())
+
+class SQLiteGameDatabase:
+    # Numeric fields kept in their own indexed columns so rankings never
+    # have to unpickle a player: the rank indexes are built from them at
+    # startup, and they can be ranked in SQL directly. Everything else
+    # lives in the data blob.
+    HOT_COLUMNS = ('level', 'exp', 'gold', 'pvp_wins', 'dungeon_level')
+    
+    def __init__(self, db_file='players_data.db', write_behind_ms=0, write_behind_max=100, fsync=False):
+        self.db_file = db_file
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # NORMAL only syncs the WAL at checkpoints; FULL on every commit
+        self.conn.execute('PRAGMA synchronous=FULL' if fsync else 'PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS players ('
+            'name TEXT PRIMARY KEY, level INTEGER, exp INTEGER, gold INTEGER, '
+            'pvp_wins INTEGER, dungeon_level INTEGER, data BLOB)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_level_exp ON players (level, exp)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_gold ON players (gold)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_pvp_wins ON players (pvp_wins)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_dungeon_level ON players (dungeon_level)')
+        self.conn.commit()
+        
+        count = self.conn.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+        print(f"[DB] SQLite {db_file}: {count} players")
+        
+        self.on_save = []
+        self.metrics = None
+        self.write_behind = None
+        if write_behind_ms > 0:
+            self.write_behind = WriteBehind(self.write_rows, write_behind_ms, write_behind_max)
+    
+    def row(self, player_data):
+        return (
+            player_data['name'],
+            *(player_data.get(field, 0) for field in self.HOT_COLUMNS),
+            pack_player(player_data)
+        )
+    
+    def save_player(self, player_data, durable=False):
+        started = time.perf_counter()
+        for hook in self.on_save:
+            hook(player_data)
+        if self.write_behind and not durable:
+            waited = time.perf_counter()
+            with self.lock:
+                locked = time.perf_counter()
+                self.cache[player_data['name']] = player_data
+            self.write_behind.mark(player_data['name'], self.row(player_data))
+            if self.metrics:
+                self.metrics.lock_wait.observe(locked - waited)
+        else:
+            self.save_players([player_data])
+        if self.metrics:
+            self.metrics.duration.observe(time.perf_counter() - started)
+    
+    def save_players(self, players):
+        return self.write_rows([self.row(p) for p in players], players)
+    
+    def write_rows(self, rows, players=()):
+        waited = time.perf_counter()
+        with self.lock:
+            locked = time.perf_counter()
+            for player_data in players:
+                self.cache[player_data['name']] = player_data
+            try:
+                self.conn.executemany('INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self.conn.commit()
+            except Exception as e:
+                print(f"[DB ERROR] {e}")
+        if self.metrics:
+            self.metrics.lock_wait.observe(locked - waited)
+        return len(rows)
+    
+    def stats(self):
+        stats = {'cached_players': len(self.cache)}
+        if self.write_behind:
+            stats.update(self.write_behind.stats())
+        return stats
+    
+    def flush(self, sync=False):
+        if self.write_behind:
+            self.write_behind.flush()
+        if sync and not self.fsync:
+            # A checkpoint syncs the WAL before copying it back
+            with self.lock:
+                self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+    
+    def get_player(self, name):
+        # Handlers mutate the dict they get back and then save it, and
+        # dungeon re-reads the player that hunt just changed, so every
+        # caller has to share one object per player.
+        player = self.cache.get(name)
+        if player is not None:
+            return player
+        
+        with self.lock:
+            player = self.cache.get(name)
+            if player is None:
+                row = self.conn.execute('SELECT data FROM players WHERE name = ?', (name,)).fetchone()
+                if row is None:
+                    return None
+                player = unpack_player(row[0])
+                self.cache[name] = player
+        return player
+    
+    def player_exists(self, name):
+        if name in self.cache:
+            return True
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM players WHERE name = ?', (name,)).fetchone() is not None
+    
+    def rank_rows(self):
+        with self.lock:
+            rows = self.conn.execute(f'SELECT name, {", ".join(self.HOT_COLUMNS)} FROM players').fetchall()
+        columns = ('name',) + self.HOT_COLUMNS
+        return [dict(zip(columns, row)) for row in rows]
+    
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+def migrate_pickle_to_sqlite(players_file, db_file):
+    # The source is only read: no checkpoint, no journal, no repairs
+    source = GameDatabase(players_file, readonly=True)
+    target = SQLiteGameDatabase(db_file)
+    count = target.save_players(list(source.players.values()))
+    target.close()
+    source.close()
+    print(f"[DB] Migrated {count} players from {players_file} to {db_file}")
+
+class RankIndex:
+    """Players kept sorted by some fields, best first.
+
+    Keys are (-field, ..., name) tuples in a plain sorted list, so top-k is
+    a slice and a player's rank is one bisect.
+    """
+    
+    def __init__(self, fields):
+        self.fields = fields
+        self.keys = []
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    def key(self, player):
+        return tuple(-(player.get(field) or 0) for field in self.fields) + (player['name'],)
+    
+    def update(self, player):
+        """Re-rank player. Returns the best position it moved from or to
+        (0 = first), None if nothing changed."""
+        key = self.key(player)
+        name = player['name']
+        with self.lock:
+            old = self.entries.get(name)
+            if old == key:
+                return None
+            moved = len(self.keys)
+            if old is not None:
+                moved = bisect.bisect_left(self.keys, old)
+                del self.keys[moved]
+            index = bisect.bisect_left(self.keys, key)
+            self.keys.insert(index, key)
+            self.entries[name] = key
+            return min(moved, index)
+    
+    def load(self, players):
+        # One sort instead of an insort per player, which is quadratic
+        with self.lock:
+            self.entries = {player['name']: self.key(player) for player in players}
+            self.keys = sorted(self.entries.values())
+    
+    def top(self, count):
+        with self.lock:
+            return [key[-1] for key in self.keys[:count]]
+    
+    def rank(self, name):
+        with self.lock:
+            key = self.entries.get(name)
+            if key is None:
+                return None
+            return bisect.bisect_left(self.keys, key) + 1
+    
+    def around(self, name, radius):
+        with self.lock:
+            key = self.entries.get(name)
+            if key is None:
+                return None, []
+            index = bisect.bisect_left(self.keys, key)
+            start = max(0, index - radius)
+            return start + 1, [key[-1] for key in self.keys[start:index + radius + 1]]
+    
+    def window(self, key, radius):
+        """How many keys sort before key, and up to radius keys either side."""
+        with self.lock:
+            index = bisect.bisect_left(self.keys, key)
+            return index, self.keys[max(0, index - radius):index + radius + 1]
+    
+    def __len__(self):
+        return len(self.keys)
+
+class Leaderboards:
+    BOARDS = {
+        'level': ('level', 'exp'),
+        'pvp': ('pvp_wins',),
+        'dungeon': ('dungeon_level',),
+    }
+    # on_change hooks hear about moves within this many top places
+    TOP = 20
+    
+    def __init__(self, db):
+        self.boards = {board: RankIndex(fields) for board, fields in self.BOARDS.items()}
+        self.on_change = []
+        players = db.rank_rows()
+        for index in self.boards.values():
+            index.load(players)
+        db.on_save.append(self.update)
+    
+    def update(self, player):
+        for board, index in self.boards.items():
+            moved = index.update(player)
+            if moved is not None and moved < self.TOP:
+                for hook in self.on_change:
+                    hook(board)
+    
+    def get(self, board):
+        return self.boards.get(board or 'level')
+
+class PlayerLocks:
+    """Striped per-player locks.
+    
+    A player always maps to the same stripe, so requests for one player run
+    one at a time while requests for different players (nearly always on
+    different stripes) run in parallel. Several players are locked by taking
+    their stripes in index order, so two-player commands can't deadlock.
+    """
+    
+    def __init__(self, stripes=1024):
+        self.locks = [threading.RLock() for _ in range(stripes)]
+    
+    def stripes(self, names):
+        return sorted({zlib.crc32(str(name).encode()) % len(self.locks) for name in names if name is not None})
+    
+    def acquire(self, names):
+        held = self.stripes(names)
+        for index in held:
+            self.locks[index].acquire()
+        return held
+    
+    def release(self, held):
+        for index in reversed(held):
+            self.locks[index].release()
+
+class Session:
+    """One client connection and the player it is logged in as, if any.
+    
+    Also a pub/sub subscriber: push writes a frame to the connection, and is
+    None where pushes can't be sent (legacy clients).
+    """
+    
+    __slots__ = ('addr', 'player', 'proto', 'push', 'topics')
+    
+    def __init__(self, addr=None):
+        self.addr = addr
+        self.player = None
+        self.proto = None
+        self.push = None
+        self.topics = set()
+    
+    def accepts(self, topic):
+        # Player topics follow the login; a connection that was logged out
+        # (or moved to another player) stops getting them.
+        return not topic.startswith('player:') or topic[7:] == self.player
+
+class Sessions:
+    """Which connection each online player is logged in on.
+    
+    Logging in binds the connection's session to the player, replacing any
+    other session of that player; disconnecting unbinds it. Online names
+    are also kept in a list (in no particular order, a removal moves the
+    last one into the gap) so a page of them is a slice and the count is
+    len().
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_player = {}
+        self.names = []
+        self.slots = {}
+    
+    def bind(self, session, name):
+        with self.lock:
+            if self.by_player.get(name) is session:
+                return
+            self.unbind(session)
+            old = self.by_player.get(name)
+            if old is not None:
+                # Logged in from somewhere else: that connection is logged out
+                old.player = None
+            else:
+                self.slots[name] = len(self.names)
+                self.names.append(name)
+            self.by_player[name] = session
+            session.player = name
+    
+    def close(self, session):
+        with self.lock:
+            self.unbind(session)
+    
+    def unbind(self, session):
+        name = session.player
+        session.player = None
+        if name is None or self.by_player.get(name) is not session:
+            return
+        del self.by_player[name]
+        index = self.slots.pop(name)
+        last = self.names.pop()
+        if last != name:
+            self.names[index] = last
+            self.slots[last] = index
+    
+    def page(self, offset, limit):
+        with self.lock:
+            return self.names[offset:offset + limit]
+    
+    def __len__(self):
+        return len(self.by_player)
+
+# Game tables. Module level so tools like balance_sim.py can use them
+# without starting a server.
+CLASSES = {
+    'Warrior': {'hp': 100, 'atk': 15, 'def': 8},
+    'Mage': {'hp': 70, 'atk': 20, 'def': 5},
+    'Rogue': {'hp': 85, 'atk': 18, 'def': 6},
+    'Paladin': {'hp': 110, 'atk': 12, 'def': 10},
+    'Archer': {'hp': 80, 'atk': 17, 'def': 6},
+    'Berserker': {'hp': 120, 'atk': 22, 'def': 6},
+}
+
+MONSTERS = {
+    'goblin': {'hp': 30, 'atk': 5, 'def': 2, 'exp': 15, 'gold': 10, 'loot': ['Health Potion', 'Goblin Dagger']},
+    'orc': {'hp': 50, 'atk': 8, 'def': 4, 'exp': 25, 'gold': 20, 'loot': ['Iron Sword', 'Health Potion']},
+    'troll': {'hp': 80, 'atk': 12, 'def': 6, 'exp': 40, 'gold': 35, 'loot': ['Steel Sword', 'Troll Ring']},
+    'dragon': {'hp': 150, 'atk': 20, 'def': 10, 'exp': 100, 'gold': 100, 'loot': ['Dragon Sword', 'Dragon Stone']},
+    'skeleton': {'hp': 35, 'atk': 7, 'def': 3, 'exp': 20, 'gold': 15, 'loot': ['Bone Sword', 'Health Potion']},
+    'demon': {'hp': 120, 'atk': 18, 'def': 8, 'exp': 80, 'gold': 80, 'loot': ['Demon Blade', 'Dark Amulet']},
+}
+
+SHOP_ITEMS = {
+    'Health Potion': {'cost': 50, 'effect': 'heal', 'amount': 30},
+    'Mana Potion': {'cost': 70, 'effect': 'mana', 'amount': 50},
+    'Iron Sword': {'cost': 200, 'effect': 'weapon', 'atk': 5},
+    'Steel Sword': {'cost': 400, 'effect': 'weapon', 'atk': 8},
+    'Dragon Sword': {'cost': 1000, 'effect': 'weapon', 'atk': 15},
+    'Iron Armor': {'cost': 250, 'effect': 'armor', 'def': 5},
+    'Steel Armor': {'cost': 500, 'effect': 'armor', 'def': 8},
+    'Dragon Armor': {'cost': 1200, 'effect': 'armor', 'def': 15},
+    'Speed Boots': {'cost': 300, 'effect': 'speed', 'bonus': 10},
+    'Ancient Ring': {'cost': 600, 'effect': 'ring', 'exp_boost': 1.2},
+}
+
+def field_getter(fields):
+    # A tuple of field names becomes a function returning their values
+    if isinstance(fields, tuple):
+        if not fields:
+            return None
+        return lambda data: [data.get(field) for field in fields]
+    return fields
+
+class Command:
+    """A registered command and what the middleware needs to know about it.
+
+    mutating: changes player state (durable flushes only apply to these)
+    player:   the handler gets the requesting player, looked up from 'player'
+    fields:   request fields that must be present
+    offload:  CPU-heavy or reads the database, the asyncio engine runs it on
+              its executor (as it does every command that locks or changes
+              players, since those can wait on locks and disk)
+    locks:    request fields naming the players to lock, or a function of
+              the request returning their names ('player' for player commands)
+    acts:     same, for the players the request acts as; a connection must
+              be logged in as them ('player' for player commands)
+    binds:    request field naming the player a connection is logged in as
+              once the command succeeds
+    session:  the handler gets the connection's Session (None in-process)
+    """
+    
+    __slots__ = ('name', 'handler', 'mutating', 'player', 'fields', 'offload', 'locks', 'acts', 'binds',
+                 'session', 'pipeline', 'latency', 'errors')
+    
+    def __init__(self, name, handler, mutating=False, player=False, fields=(), offload=False, locks=None,
+                 acts=None, binds=None, session=False):
+        self.name = name
+        self.handler = handler
+        self.mutating = mutating
+        self.player = player
+        self.fields = fields
+        self.locks = field_getter(('player',) if locks is None and player else locks)
+        self.offload = offload or mutating or self.locks is not None
+        self.acts = field_getter(('player',) if acts is None and player else acts)
+        self.binds = binds
+        self.session = session
+        self.pipeline = None
+        self.latency = None
+        self.errors = None
+
+class Request:
+    __slots__ = ('data', 'command', 'player', 'nested', 'session')
+    
+    def __init__(self, data, command, nested=False, session=None):
+        self.data = data
+        self.command = command
+        self.player = None
+        self.nested = nested
+        self.session = session
 
 class GameServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    MAX_BATCH = 50
+    MAX_AUTO_HUNT = 1000
+    MAX_ONLINE_PAGE = 200
+    MATCH_ATTEMPTS = 3
+    DAILY_REWARD_COOLDOWN = 86400
+    MAX_TOPICS = 32
+    # Bytes queued for a slow asyncio client before its pushes wait in its
+    # outbox (the router drops them instead)
+    PUSH_BUFFER = 256 * 1024
+    # pvp_queue may start a pvp, which takes its own locks
+    NOT_IN_BATCH = ('batch', 'pvp_queue', 'sync_offline')
+    MAX_OFFLINE_ACTIONS = 500
+    # What can be played offline, and the one argument each takes (and its type)
+    OFFLINE_COMMANDS = {
+        'hunt': ('difficulty', str), 'rest': (None, None), 'buy_item': ('item', str),
+        'sell_item': ('item', str), 'equip': ('item', str), 'use_skill': ('skill', str),
+        'accept_quest': ('quest_id', int), 'complete_quest': ('quest_id', int),
+    }
+    
+    def __init__(self, host='0.0.0.0', port=5555, db=None, backlog=128, workers=8, admin_token=None,
+                 log=None, internal=False, idle_timeout=None):
         self.host = host
         self.port = port
-        self.db = GameDatabase()
-        self.clients = {}
+        self.backlog = backlog
+        self.workers = workers
+        self.admin_token = admin_token
+        self.db = db or GameDatabase()
+        self.log = log or gamelog.AsyncLogger()
+        self.sessions = Sessions()
+        # Connections silent for this many seconds are closed (None = never)
+        self.idle_timeout = idle_timeout or None
+        self.leaderboards = Leaderboards(self.db)
+        self.locks = PlayerLocks()
+        self.match_queue = matchmaking.MatchQueue()
+        # Fights that happened while the loser or winner sat in the queue
+        self.match_results = {}
+        self.hub = pubsub.Hub()
+        self.leaderboards.on_change.append(self.leaderboard_changed)
+        # Shards behind a router (see router.py) also take internal commands
+        self.internal = internal
+        self.checkouts = {}
+        # Every roll goes through this, so sync_offline can seed it
+        self.rng = combat.Dice()
+        self.init_metrics()
         self.init_game_data()
-        
+        self.register_commands()
+    
+    def init_metrics(self):
+        self.metrics = metrics.MetricsRegistry()
+        self.connections = self.metrics.gauge('connections', 'Open client connections')
+        self.connections_total = self.metrics.counter('connections_total', 'Client connections accepted')
+        self.idle_closed = self.metrics.counter('idle_disconnects_total', 'Connections closed for being idle')
+        self.metrics.gauge('players_online', 'Players logged in on a connection', fn=lambda: len(self.sessions))
+        self.metrics.gauge('pvp_queue', 'Players waiting for a pvp match', fn=lambda: len(self.match_queue))
+        self.metrics.gauge('push_subscriptions', 'Topic subscriptions', fn=lambda: self.hub.subscriptions)
+        self.metrics.gauge('push_events', 'Events published to subscribers', fn=lambda: self.hub.events)
+        self.metrics.gauge('push_frames', 'Push frames written', fn=lambda: self.hub.frames)
+        self.metrics.gauge('push_dropped', 'Push frames dropped on a full connection', fn=lambda: self.hub.dropped)
+        self.lock_wait = self.metrics.histogram('player_lock_wait_seconds', 'Time spent waiting for player locks')
+        self.db.metrics = SaveMetrics(self.metrics)
+        for key in self.db.stats():
+            self.metrics.gauge('db_' + key, 'Database stats()', fn=lambda key=key: self.db.stats().get(key, 0))
+        self.metrics.gauge('log_queued', 'Log records waiting to be written', fn=lambda: len(self.log.queue))
+        self.metrics.gauge('log_dropped', 'Log records dropped on a full queue', fn=lambda: self.log.dropped)
+    
+    def register_commands(self):
+        self.commands = {}
+        self.unknown = self.new_command('unknown', self.unknown_command)
+        
+        add = self.add_command
+        add('register', self.register, mutating=True, fields=('name', 'class'), locks=('name',), binds='name')
+        add('login', self.login, fields=('name',), locks=('name',), binds='name')
+        add('hunt', self.hunt, mutating=True, player=True, offload=True)
+        add('auto_hunt', self.auto_hunt, mutating=True, player=True, offload=True)
+        add('pvp', self.pvp, mutating=True, player=True, fields=('opponent',), offload=True,
+            locks=('player', 'opponent'))
+        add('pvp_queue', self.pvp_queue, mutating=True, player=True, offload=True, locks=())
+        add('pvp_leave', self.pvp_leave, player=True)
+        add('shop_list', self.shop_list)
+        add('buy_item', self.buy_item, mutating=True, player=True, fields=('item',))
+        add('sell_item', self.sell_item, mutating=True, player=True, fields=('item',))
+        add('quest_list', self.quest_list)
+        add('accept_quest', self.accept_quest, mutating=True, player=True, fields=('quest_id',))
+        add('complete_quest', self.complete_quest, mutating=True, player=True, fields=('quest_id',))
+        add('skill_list', self.skill_list)
+        add('use_skill', self.use_skill, mutating=True, player=True, fields=('skill',))
+        add('dungeon', self.dungeon, mutating=True, player=True, offload=True)
+        add('daily_reward', self.daily_reward, mutating=True, player=True)
+        add('stats', self.get_stats, player=True)
+        add('inventory', self.get_inventory, player=True)
+        add('equip', self.equip_item, mutating=True, player=True, fields=('item',))
+        add('rest', self.rest, mutating=True, player=True)
+        add('leaderboard', self.leaderboard, offload=True)
+        add('my_rank', self.my_rank, fields=('player',))
+        add('rank_around', self.rank_around, fields=('player',), offload=True)
+        add('players_online', self.players_online)
+        add('batch', self.batch, mutating=True, fields=('commands',), offload=True,
+            locks=self.batch_players, acts=self.batch_actors)
+        add('metrics', self.get_metrics)
+        add('offline_seed', self.offline_seed, mutating=True, player=True)
+        add('sync_offline', self.sync_offline, mutating=True, player=True, fields=('journal', 'actions'), offload=True)
+        add('subscribe', self.subscribe, fields=('topics',), session=True, offload=True)
+        add('unsubscribe', self.unsubscribe, session=True)
+        add('say', self.say, fields=('channel', 'text'), session=True)
+        if self.internal:
+            # The router logs clients in; these act on behalf of the shard
+            add('_shard_checkout', self.shard_checkout, player=True, acts=())
+            add('_shard_commit', self.shard_commit, player=True, fields=('token', 'data'), acts=())
+            add('_shard_release', self.shard_release, fields=('player', 'token'), locks=('player',))
+            add('_shard_rank_key', self.shard_rank_key, fields=('player',))
+            add('_shard_rank_window', self.shard_rank_window, fields=('key',), offload=True)
+            add('_shard_publish', self.shard_publish, fields=('topic', 'event'))
+        
+        # Outermost first. Each one gets the request and the next step, and
+        # says which commands it applies to, so every command gets a chain
+        # with only the steps it needs.
+        self.middleware = [
+            (self.lock_players, lambda command: command.locks),
+            (self.finish_response, None),
+            (self.time_command, None),
+            (self.check_session, lambda command: command.acts or command.binds),
+            (self.catch_errors, None),
+            (self.check_fields, lambda command: command.fields),
+            (self.load_player, lambda command: command.player),
+        ]
+        for command in list(self.commands.values()) + [self.unknown]:
+            self.build_pipeline(command)
+    
+    def add_command(self, name, handler, **meta):
+        self.commands[name] = self.new_command(name, handler, **meta)
+    
+    def new_command(self, name, handler, **meta):
+        command = Command(name, handler, **meta)
+        command.latency = self.metrics.histogram('command_seconds', 'Command latency', cmd=name)
+        command.errors = self.metrics.counter('command_errors_total', 'Commands answered with an error', cmd=name)
+        return command
+    
+    def build_pipeline(self, command):
+        if command.session:
+            call = self.invoke_with_session
+        elif command.player:
+            call = self.invoke_with_player
+        else:
+            call = self.invoke
+        for middleware, applies in reversed(self.middleware):
+            if applies is None or applies(command):
+                call = self.chain(middleware, call)
+        command.pipeline = call
+    
+    def chain(self, middleware, call_next):
+        return lambda request: middleware(request, call_next)
+    
     def init_game_data(self):
-        self.monsters = {
-            'goblin': {'hp': 30, 'atk': 5, 'def': 2, 'exp': 15, 'gold': 10, 'loot': ['Health Potion', 'Goblin Dagger']},
-            'orc': {'hp': 50, 'atk': 8, 'def': 4, 'exp': 25, 'gold': 20, 'loot': ['Iron Sword', 'Health Potion']},
-            'troll': {'hp': 80, 'atk': 12, 'def': 6, 'exp': 40, 'gold': 35, 'loot': ['Steel Sword', 'Troll Ring']},
-            'dragon': {'hp': 150, 'atk': 20, 'def': 10, 'exp': 100, 'gold': 100, 'loot': ['Dragon Sword', 'Dragon Stone']},
-            'skeleton': {'hp': 35, 'atk': 7, 'def': 3, 'exp': 20, 'gold': 15, 'loot': ['Bone Sword', 'Health Potion']},
-            'demon': {'hp': 120, 'atk': 18, 'def': 8, 'exp': 80, 'gold': 80, 'loot': ['Demon Blade', 'Dark Amulet']},
-        }
-        
-        self.shop_items = {
-            'Health Potion': {'cost': 50, 'effect': 'heal', 'amount': 30},
-            'Mana Potion': {'cost': 70, 'effect': 'mana', 'amount': 50},
-            'Iron Sword': {'cost': 200, 'effect': 'weapon', 'atk': 5},
-            'Steel Sword': {'cost': 400, 'effect': 'weapon', 'atk': 8},
-            'Dragon Sword': {'cost': 1000, 'effect': 'weapon', 'atk': 15},
-            'Iron Armor': {'cost': 250, 'effect': 'armor', 'def': 5},
-            'Steel Armor': {'cost': 500, 'effect': 'armor', 'def': 8},
-            'Dragon Armor': {'cost': 1200, 'effect': 'armor', 'def': 15},
-            'Speed Boots': {'cost': 300, 'effect': 'speed', 'bonus': 10},
-            'Ancient Ring': {'cost': 600, 'effect': 'ring', 'exp_boost': 1.2},
-        }
+        self.monsters = MONSTERS
+        self.shop_items = SHOP_ITEMS
         
         self.quests = {
             1: {'name': 'Goblin Slayer', 'desc': 'Kill 5 Goblins', 'reward': 100, 'kills': 5, 'type': 'goblin'},
@@ -92,139 +1297,448 @@ class GameServer:
             'Quick Strike': {'cost': 10, 'damage_mult': 1.5, 'description': '1.5x damage'},
             'Heal': {'cost': 25, 'heal_amount': 100, 'description': 'Restore 100 HP'},
         }
+        self.build_catalogs()
+    
+    def build_catalogs(self):
+        # The catalogs never change while running, so their replies are
+        # encoded once. The etag is a hash of the content: clients that
+        # send the one they hold get not_modified, and login tells them
+        # the current ones so a cached copy needs no request at all.
+        self.catalogs = {}
+        self.catalog_versions = {}
+        for name, items in (('shop', self.shop_items), ('quests', self.quests), ('skills', self.skills)):
+            etag = f"{zlib.crc32(json.dumps(items, sort_keys=True).encode()):08x}"
+            full = protocol.Cached({'status': 'ok', name: items, 'etag': etag})
+            same = protocol.Cached({'status': 'ok', 'not_modified': True, 'etag': etag})
+            self.catalogs[name] = (etag, full, same)
+            self.catalog_versions[name] = etag
+    
+    def catalog(self, name, data):
+        etag, full, same = self.catalogs[name]
+        return (same if data.get('etag') == etag else full).copy()
     
     def start(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind((self.host, self.port))
-        server.listen(5)
+        server.listen(self.backlog)
         print(f"[✓] Server started on {self.host}:{self.port}")
         print("[*] Waiting for connections...\n")
         
         try:
             while True:
                 client, addr = server.accept()
-                print(f"[+] {addr} connected")
                 thread = threading.Thread(target=self.handle_client, args=(client, addr))
                 thread.daemon = True
                 thread.start()
         except KeyboardInterrupt:
             print("\n[!] Server shutting down...")
             server.close()
+            self.db.close()
+            self.log.close()
     
     def handle_client(self, client, addr):
+        self.log.event('connect', addr)
+        self.connections.inc()
+        self.connections_total.inc()
+        session = Session(addr)
+        send_lock = threading.Lock()
+        outbox = None
+        client.settimeout(self.idle_timeout)
         try:
-            while True:
-                data = self.recv_json(client)
+            proto, header = protocol.server_handshake(client, json_default)
+            session.proto = proto
+            if proto and not proto.legacy:
+                outbox = pubsub.Outbox(on_overflow=lambda: self.cut_off(client))
+                outbox.on_ready = lambda: self.start_push_writer(outbox, client, send_lock)
+                session.push = outbox.put
+            while proto:
+                data = protocol.read_frame(client, proto, header)
+                header = None
                 if not data:
                     break
                 
-                print(f"[<] {addr} -> {data.get('cmd')}")
-                response = self.process(data)
+                started = time.perf_counter()
+                response = self.process(data, session=session)
+                self.log.request(addr, data, response, time.perf_counter() - started)
                 
-                if not self.send_json(client, response):
+                if not self.send_frame(client, proto, response, send_lock):
                     break
                     
+        except socket.timeout:
+            self.idle_closed.inc()
+            self.log.event('idle_timeout', addr, player=session.player)
         except Exception as e:
-            print(f"[!] Error {addr}: {e}")
+            self.log.event('error', addr, msg=str(e))
         finally:
+            if outbox is not None:
+                outbox.close()
             client.close()
-            print(f"[-] {addr} disconnected\n")
+            self.end_session(session)
+            self.connections.dec()
+            self.log.event('disconnect', addr)
     
-    def recv_json(self, client):
+    def start_async(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        server = loop.run_until_complete(asyncio.start_server(
+            self.handle_stream, self.host, self.port, backlog=self.backlog, reuse_address=True
+        ))
+        print(f"[✓] Server started on {self.host}:{self.port} (asyncio)")
+        print("[*] Waiting for connections...\n")
+        
         try:
-            size_data = client.recv(4)
-            if not size_data:
-                return None
-            size = int(size_data.decode())
-            data = b''
-            while len(data) < size:
-                chunk = client.recv(size - len(data))
-                if not chunk:
-                    return None
-                data += chunk
-            return json.loads(data.decode())
-        except:
-            return None
+            loop.run_forever()
+        except KeyboardInterrupt:
+            print("\n[!] Server shutting down...")
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown(wait=True)
+            loop.close()
+            self.db.close()
+            self.log.close()
+    
+    async def handle_stream(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        self.log.event('connect', addr)
+        self.connections.inc()
+        self.connections_total.inc()
+        session = Session(addr)
+        loop = asyncio.get_event_loop()
+        outbox = pusher = None
+        try:
+            proto, header = await protocol.server_handshake_async(reader, writer, json_default)
+            session.proto = proto
+            if not proto.legacy:
+                wake = asyncio.Event()
+                outbox = pubsub.Outbox(on_ready=lambda: self.call_on_loop(loop, wake.set),
+                                       on_overflow=lambda: self.call_on_loop(loop, writer.transport.abort))
+                pusher = asyncio.ensure_future(self.push_stream(outbox, writer, wake))
+                session.push = outbox.put
+            while True:
+                data = await asyncio.wait_for(protocol.read_frame_async(reader, proto, header), self.idle_timeout)
+                header = None
+                if not data:
+                    break
+                
+                started = time.perf_counter()
+                if self.offloaded(data):
+                    response = await loop.run_in_executor(self.executor, self.process, data, False, session)
+                else:
+                    response = self.process(data, session=session)
+                self.log.request(addr, data, response, time.perf_counter() - started)
+                
+                writer.write(self.frame(proto, response))
+                await writer.drain()
+        
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.TimeoutError:
+            self.idle_closed.inc()
+            self.log.event('idle_timeout', addr, player=session.player)
+        except Exception as e:
+            self.log.event('error', addr, msg=str(e))
+        finally:
+            if outbox is not None:
+                outbox.close()
+                pusher.cancel()
+            writer.close()
+            self.end_session(session)
+            self.connections.dec()
+            self.log.event('disconnect', addr)
+    
+    def end_session(self, session):
+        if session.player:
+            self.match_queue.leave(session.player)
+            self.match_results.pop(session.player, None)
+        self.hub.unsubscribe(session)
+        self.sessions.close(session)
+    
+    def frame(self, proto, response):
+        try:
+            return proto.frame(response)
+        except protocol.ProtocolError as e:
+            # Legacy clients can't receive more than 9999 bytes
+            return proto.frame({'status': 'error', 'msg': str(e)})
     
-    def send_json(self, client, data):
+    def send_frame(self, client, proto, response, send_lock):
+        frame = self.frame(proto, response)
         try:
-            msg = json.dumps(data).encode()
-            size = str(len(msg)).zfill(4).encode()
-            client.send(size + msg)
+            with send_lock:
+                client.sendall(frame)
             return True
-        except:
+        except OSError:
             return False
     
-    def process(self, data):
-        cmd = data.get('cmd')
-        
-        if cmd == 'register':
-            return self.register(data)
-        elif cmd == 'login':
-            return self.login(data)
-        elif cmd == 'hunt':
-            return self.hunt(data)
-        elif cmd == 'pvp':
-            return self.pvp(data)
-        elif cmd == 'shop_list':
-            return self.shop_list()
-        elif cmd == 'buy_item':
-            return self.buy_item(data)
-        elif cmd == 'sell_item':
-            return self.sell_item(data)
-        elif cmd == 'quest_list':
-            return self.quest_list()
-        elif cmd == 'accept_quest':
-            return self.accept_quest(data)
-        elif cmd == 'complete_quest':
-            return self.complete_quest(data)
-        elif cmd == 'skill_list':
-            return self.skill_list()
-        elif cmd == 'use_skill':
-            return self.use_skill(data)
-        elif cmd == 'dungeon':
-            return self.dungeon(data)
-        elif cmd == 'daily_reward':
-            return self.daily_reward(data)
-        elif cmd == 'stats':
-            return self.get_stats(data)
-        elif cmd == 'inventory':
-            return self.get_inventory(data)
-        elif cmd == 'equip':
-            return self.equip_item(data)
-        elif cmd == 'rest':
-            return self.rest(data)
-        elif cmd == 'leaderboard':
-            return self.leaderboard()
-        elif cmd == 'players_online':
-            return {'status': 'ok', 'count': len(self.clients), 'players': list(self.clients.keys())}
-        else:
-            return {'status': 'error', 'msg': 'Unknown command'}
+    def start_push_writer(self, outbox, client, send_lock):
+        # First push on a threads connection: from now on its writer waits
+        # in take() and needs no waking
+        outbox.on_ready = None
+        thread = threading.Thread(target=self.push_writer, args=(outbox, client, send_lock))
+        thread.daemon = True
+        thread.start()
     
-    def register(self, data):
-        name = data.get('name')
-        char_class = data.get('class')
-        
-        if not name or not char_class:
+    def push_writer(self, outbox, client, send_lock):
+        # Writes a connection's pushes between its responses; only this
+        # thread ever waits on a slow client, never the hub
+        while True:
+            chunk = outbox.take()
+            if chunk is None:
+                return
+            try:
+                with send_lock:
+                    client.sendall(chunk)
+            except OSError:
+                outbox.close()
+                return
+    
+    def cut_off(self, client):
+        # Its outbox overflowed over and over: the handler sees the
+        # connection end (connection.py reconnects)
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def call_on_loop(self, loop, callback):
+        # From the hub thread; the loop may already be gone
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass
+    
+    async def push_stream(self, outbox, writer, wake):
+        # Writes an asyncio connection's pushes. Responses are written on
+        # the loop too, so frames never interleave.
+        transport = writer.transport
+        while True:
+            await wake.wait()
+            wake.clear()
+            chunk = outbox.take(wait=False)
+            if chunk is None:
+                return
+            if chunk:
+                writer.write(chunk)
+            # Let a slow client's buffer empty; meanwhile its outbox fills
+            while transport.get_write_buffer_size() > self.PUSH_BUFFER and not transport.is_closing():
+                await asyncio.sleep(0.05)
+    
+    def process(self, data, nested=False, session=None):
+        command = self.commands.get(data.get('cmd'), self.unknown)
+        return command.pipeline(Request(data, command, nested, session))
+    
+    def offloaded(self, data):
+        return self.commands.get(data.get('cmd'), self.unknown).offload
+    
+    def invoke(self, request):
+        return request.command.handler(request.data)
+    
+    def invoke_with_player(self, request):
+        return request.command.handler(request.data, request.player)
+    
+    def invoke_with_session(self, request):
+        return request.command.handler(request.data, request.session)
+    
+    def finish_response(self, request, call_next):
+        response = call_next(request)
+        if request.nested:
+            return response
+        
+        data = request.data
+        # Clients can ask for any command to be on disk before the reply
+        # goes out, even when saves are being batched.
+        if data.get('durable') and request.command.mutating:
+            self.db.flush(sync=True)
+        if 'version' in data:
+            self.apply_delta(data, response)
+        # Pipelined clients match responses to requests by id
+        if 'id' in data:
+            response['id'] = data['id']
+        # The reply is encoded after the player lock is released, so it
+        # gets a copy rather than the live record.
+        player = response.get('player')
+        if isinstance(player, PlayerRecord):
+            response['player'] = player.public()
+        return response
+    
+    def lock_players(self, request, call_next):
+        # Nested commands run inside a batch that already holds their locks
+        if request.nested:
+            return call_next(request)
+        started = time.perf_counter()
+        names = request.command.locks(request.data)
+        held = self.locks.acquire(names)
+        self.lock_wait.observe(time.perf_counter() - started)
+        try:
+            if self.checkouts and request.command.mutating and any(map(self.checked_out, names)):
+                return {'status': 'error', 'msg': 'Player is busy, try again'}
+            return call_next(request)
+        finally:
+            self.locks.release(held)
+    
+    def catch_errors(self, request, call_next):
+        try:
+            return call_next(request)
+        except Exception as e:
+            name = request.command.name.upper()
+            self.log.event('command_error', cmd=request.command.name, player=request.data.get('player'), msg=str(e))
+            return {'status': 'error', 'msg': f'{name} error: {e}'}
+    
+    def time_command(self, request, call_next):
+        started = time.perf_counter()
+        response = call_next(request)
+        request.command.latency.observe(time.perf_counter() - started)
+        if response.get('status') == 'error':
+            request.command.errors.inc()
+        return response
+    
+    def check_session(self, request, call_next):
+        # Without a session (called in-process, e.g. benchmarks) anything
+        # goes; a connection can only act as the player it logged in as.
+        session = request.session
+        if session is None or request.nested:
+            return call_next(request)
+        command = request.command
+        if command.acts:
+            for name in command.acts(request.data):
+                if name is not None and name != session.player:
+                    return {'status': 'error', 'msg': f'Log in as {name} first'}
+        response = call_next(request)
+        if command.binds and response.get('status') == 'ok':
+            self.sessions.bind(session, request.data[command.binds])
+        return response
+    
+    def check_fields(self, request, call_next):
+        for field in request.command.fields:
+            if request.data.get(field) in (None, ''):
+                return {'status': 'error', 'msg': 'Invalid data'}
+        return call_next(request)
+    
+    def load_player(self, request, call_next):
+        request.player = self.db.get_player(request.data.get('player'))
+        if not request.player:
+            return {'status': 'error', 'msg': 'Player not found'}
+        return call_next(request)
+    
+    def apply_delta(self, data, response):
+        # A client that says which version of its player it holds gets only
+        # what changed since then, unless it has fallen too far behind.
+        player = response.get('player')
+        if not isinstance(player, PlayerRecord) or player['name'] != data.get('player'):
+            return
+        delta = player.delta_since(data['version'])
+        if delta is not None:
+            del response['player']
+            response['delta'] = delta
+    
+    def unknown_command(self, data):
+        return {'status': 'error', 'msg': 'Unknown command'}
+    
+    def get_metrics(self, data):
+        # Metrics show every player's activity and the storage internals, so
+        # without a token nobody gets them (the Prometheus port is local only)
+        if not self.admin_token:
+            return {'status': 'error', 'msg': 'Metrics need the server started with --admin-token'}
+        if not hmac.compare_digest(str(data.get('token', '')), self.admin_token):
+            return {'status': 'error', 'msg': 'Not allowed'}
+        
+        snapshot = self.metrics.snapshot()
+        requests = sum(c.latency.count for c in self.commands.values())
+        snapshot['requests_per_second'] = requests / max(snapshot['uptime_seconds'], 1e-9)
+        return {'status': 'ok', 'metrics': snapshot}
+    
+    def players_online(self, data):
+        offset = max(int(data.get('offset', 0)), 0)
+        limit = min(max(int(data.get('limit', 50)), 0), self.MAX_ONLINE_PAGE)
+        return {'status': 'ok', 'count': len(self.sessions), 'offset': offset,
+                'players': self.sessions.page(offset, limit)}
+    
+    def batch_actors(self, data):
+        # The batch player and whoever its player commands act as
+        names = [data.get('player')]
+        commands = data.get('commands')
+        for sub in commands if isinstance(commands, list) else ():
+            if isinstance(sub, dict):
+                command = self.commands.get(sub.get('cmd'))
+                if command and command.acts:
+                    names.extend(command.acts(sub))
+        return names
+    
+    def batch_players(self, data):
+        # Everyone any command in the batch would lock, taken up front and
+        # in order, since taking more locks halfway through could deadlock.
+        names = [data.get('player')]
+        commands = data.get('commands')
+        for sub in commands if isinstance(commands, list) else ():
+            if isinstance(sub, dict) and sub.get('cmd') != 'batch':
+                command = self.commands.get(sub.get('cmd'))
+                if command and command.locks:
+                    names.extend(command.locks(sub))
+        return names
+    
+    def batch(self, data):
+        commands = data['commands']
+        if not isinstance(commands, list):
             return {'status': 'error', 'msg': 'Invalid data'}
+        if len(commands) > self.MAX_BATCH:
+            return {'status': 'error', 'msg': f'At most {self.MAX_BATCH} commands per batch'}
+        if any(not isinstance(sub, dict) or sub.get('cmd') in self.NOT_IN_BATCH for sub in commands):
+            return {'status': 'error', 'msg': 'Invalid command in batch'}
+        
+        # All-or-nothing: remember every player the batch touches and roll
+        # them all back if any command fails.
+        atomic = bool(data.get('atomic'))
+        snapshots = {}
+        if atomic:
+            # The same names the batch locked, so a pvp opponent is included
+            for name in self.batch_players(data):
+                if name not in snapshots:
+                    player = self.db.get_player(name)
+                    if player:
+                        snapshots[name] = player.to_dict()
+        
+        name = data.get('player')
+        results = []
+        failed = None
+        for index, sub in enumerate(commands):
+            result = self.process(sub, nested=True)
+            # The final state of the batch player is sent once at the end
+            if name and sub.get('player') == name:
+                result.pop('player', None)
+            results.append(result)
+            if atomic and result.get('status') != 'ok':
+                failed = index
+                break
+        
+        if failed is not None:
+            for player_name, snapshot in snapshots.items():
+                player = self.db.get_player(player_name)
+                player.restore(snapshot)
+                self.db.save_player(player)
+        
+        response = {'status': 'ok' if failed is None else 'error', 'results': results}
+        if failed is not None:
+            response['msg'] = f'Command {failed + 1} failed, batch rolled back'
+            response['failed'] = failed
+        if name:
+            player = self.db.get_player(name)
+            if player:
+                response['player'] = player
+        return response
+    
+    def register(self, data):
+        name = data['name']
+        char_class = data['class']
         
         if self.db.player_exists(name):
             return {'status': 'error', 'msg': 'Name already taken'}
         
-        classes = {
-            'Warrior': {'hp': 100, 'atk': 15, 'def': 8},
-            'Mage': {'hp': 70, 'atk': 20, 'def': 5},
-            'Rogue': {'hp': 85, 'atk': 18, 'def': 6},
-            'Paladin': {'hp': 110, 'atk': 12, 'def': 10},
-            'Archer': {'hp': 80, 'atk': 17, 'def': 6},
-            'Berserker': {'hp': 120, 'atk': 22, 'def': 6},
-        }
-        
-        if char_class not in classes:
+        if char_class not in CLASSES:
             return {'status': 'error', 'msg': 'Invalid class'}
         
-        stats = classes[char_class]
+        stats = CLASSES[char_class]
         player = {
             'name': name,
             'class': char_class,
@@ -255,32 +1769,23 @@ class GameServer:
             'skills': ['Quick Strike'],
             'created': datetime.now().isoformat()
         }
+        player = PlayerRecord.from_dict(player)
         
-        self.db.save_player(player)
-        self.clients[name] = True
+        self.db.save_player(player, durable=True)
         
-        return {'status': 'ok', 'msg': 'Character created', 'player': player}
+        return {'status': 'ok', 'msg': 'Character created', 'player': player, 'catalogs': self.catalog_versions}
     
     def login(self, data):
-        name = data.get('name')
-        if not name:
-            return {'status': 'error', 'msg': 'Invalid name'}
-        
+        name = data['name']
         player = self.db.get_player(name)
         if not player:
             return {'status': 'error', 'msg': 'Player not found'}
         
-        self.clients[name] = True
-        return {'status': 'ok', 'msg': 'Login success', 'player': player}
+        return {'status': 'ok', 'msg': 'Login success', 'player': player, 'catalogs': self.catalog_versions}
     
-    def hunt(self, data):
-        name = data.get('player')
+    def hunt(self, data, player):
         difficulty = data.get('difficulty', 'goblin')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if player['hp'] <= 0:
             return {'status': 'error', 'msg': 'Dead! Rest first'}
         
@@ -295,19 +1800,19 @@ class GameServer:
         m_hp = monster['hp']
         
         while p_hp > 0 and m_hp > 0:
-            dmg = max(1, player['atk'] - monster['def'] + random.randint(-2, 2))
+            dmg = combat.damage(player['atk'], monster['def'], self.rng)
             m_hp -= dmg
             log.append(f"You deal {dmg} dmg")
             
             if m_hp > 0:
-                dmg = max(1, monster['atk'] - player['def'] + random.randint(-2, 2))
+                dmg = combat.damage(monster['atk'], player['def'], self.rng)
                 p_hp -= dmg
                 log.append(f"Monster deals {dmg} dmg")
         
         if p_hp > 0:
             exp = monster['exp']
             gold = monster['gold']
-            loot = random.choice(monster.get('loot', ['Gold']))
+            loot = self.rng.choice(monster.get('loot', ['Gold']))
             
             player['exp'] += exp
             player['gold'] += gold
@@ -351,100 +1856,302 @@ class GameServer:
                 'player': player
             }
     
-    def pvp(self, data):
-        try:
-            p1_name = data.get('player')
-            p2_name = data.get('opponent')
-            
-            if not p1_name or not p2_name:
-                return {'status': 'error', 'msg': 'Invalid player names'}
-            
-            p1 = self.db.get_player(p1_name)
-            p2 = self.db.get_player(p2_name)
-            
-            if not p1:
-                return {'status': 'error', 'msg': f'Player {p1_name} not found'}
-            
-            if not p2:
-                return {'status': 'error', 'msg': f'Opponent {p2_name} not found'}
-            
-            if p1['hp'] <= 0:
-                return {'status': 'error', 'msg': 'You are dead! Rest first'}
-            
-            if p2['hp'] <= 0:
-                return {'status': 'error', 'msg': 'Opponent is dead! Find another opponent'}
-            
-            if p1_name == p2_name:
-                return {'status': 'error', 'msg': 'Cannot PVP yourself'}
-            
-            log = []
-            p1_hp = p1['hp']
-            p2_hp = p2['hp']
-            rounds = 0
-            max_rounds = 50
+    def auto_hunt(self, data, player):
+        difficulty = data.get('difficulty', 'goblin')
+        count = min(int(data.get('count', 10)), self.MAX_AUTO_HUNT)
+        # Stop before a battle once HP is at or below this % of max HP
+        stop_pct = float(data.get('stop_hp', 30))
+        
+        if player['hp'] <= 0:
+            return {'status': 'error', 'msg': 'Dead! Rest first'}
+        
+        if difficulty not in self.monsters:
+            return {'status': 'error', 'msg': 'Invalid monster'}
+        
+        if count < 1:
+            return {'status': 'error', 'msg': 'Invalid count'}
+        
+        monster = self.monsters[difficulty]
+        # One change-log entry per field (and one for the loot), however
+        # many battles, so a long run still reaches clients as a delta
+        with player.batched():
+            battles = wins = levelups = 0
+            result = 'done'
             
-            while p1_hp > 0 and p2_hp > 0 and rounds < max_rounds:
-                rounds += 1
+            # Stats only change on a level up, so fight in segments that end
+            # exactly where the next level up would happen.
+            while battles < count:
+                stop_hp = player['max_hp'] * stop_pct / 100
+                if player['hp'] <= stop_hp:
+                    result = 'low_hp'
+                    break
                 
-                # P1 attack
-                dmg = max(1, p1['atk'] - p2['def'] + random.randint(-2, 2))
-                p2_hp -= dmg
-                log.append(f"{p1_name} deals {dmg} dmg")
+                to_level = -(-(player['exp_max'] - player['exp']) // monster['exp'])
+                fought, won, hp = combat.hunt_segment(
+                    player['atk'], player['def'], player['hp'], stop_hp,
+                    monster['atk'], monster['def'], monster['hp'],
+                    min(count - battles, max(1, to_level)), self.rng
+                )
+                battles += fought
+                wins += won
+                player['exp'] += won * monster['exp']
+                player['kills'] += won
+                player['hp'] = hp
                 
-                if p2_hp <= 0:
+                if fought > won:
+                    result = 'defeat'
                     break
                 
-                # P2 attack
-                dmg = max(1, p2['atk'] - p1['def'] + random.randint(-2, 2))
-                p1_hp -= dmg
-                log.append(f"{p2_name} deals {dmg} dmg")
+                if player['exp'] >= player['exp_max']:
+                    player['level'] += 1
+                    player['exp'] = 0
+                    player['exp_max'] = player['level'] * 100
+                    player['max_hp'] += 10
+                    player['atk'] += 2
+                    player['def'] += 1
+                    player['hp'] = player['max_hp']
+                    levelups += 1
             
-            # Determine winner
-            if p1_hp > 0:
-                reward = 50 + (p2['level'] * 10)
-                p1['pvp_wins'] += 1
-                p1['gold'] += reward
-                p1['hp'] = max(1, p1_hp)
-                p2['pvp_loses'] += 1
-                p2['hp'] = 0
-                result = f"{p1_name} WIN!"
-                winner = True
-            else:
-                reward = 50 + (p1['level'] * 10)
-                p2['pvp_wins'] += 1
-                p2['gold'] += reward
-                p2['hp'] = max(1, p2_hp)
-                p1['pvp_loses'] += 1
-                p1['hp'] = 0
-                result = f"{p2_name} WIN!"
-                winner = False
+            loot = collections.Counter(self.rng.choices(monster.get('loot', ['Gold']), k=wins))
+            for item, amount in loot.items():
+                for _ in range(amount):
+                    player['inventory'].append(item)
             
-            # Save both players
-            self.db.save_player(p1)
-            self.db.save_player(p2)
+            gold = wins * monster['gold']
+            player['gold'] += gold
+            player['battles'] += battles
+            if result == 'defeat':
+                player['deaths'] += 1
+                player['gold'] = max(0, player['gold'] - 20)
+        
+        self.db.save_player(player)
+        
+        return {
+            'status': 'ok',
+            'result': result,
+            'battles': battles,
+            'wins': wins,
+            'exp': wins * monster['exp'],
+            'gold': gold,
+            'loot': dict(loot),
+            'levelups': levelups,
+            'player': player
+        }
+    
+    def pvp(self, data, p1):
+        p1_name = p1['name']
+        p2_name = data.get('opponent')
+        # Behind a router the opponent may live on another shard. It is then
+        # checked out there and sent along, and its new state goes back in
+        # the response instead of being saved here.
+        remote = self.internal and '_opponent' in data
+        if remote:
+            p2 = PlayerRecord.from_dict(data['_opponent'])
+        else:
+            p2 = self.db.get_player(p2_name)
+        
+        if not p2:
+            return {'status': 'error', 'msg': f'Opponent {p2_name} not found'}
+        
+        if p1['hp'] <= 0:
+            return {'status': 'error', 'msg': 'You are dead! Rest first'}
+        
+        if p2['hp'] <= 0:
+            return {'status': 'error', 'msg': 'Opponent is dead! Find another opponent'}
+        
+        if p1_name == p2_name:
+            return {'status': 'error', 'msg': 'Cannot PVP yourself'}
+        
+        log = []
+        p1_hp = p1['hp']
+        p2_hp = p2['hp']
+        rounds = 0
+        max_rounds = combat.PVP_ROUNDS
+        
+        while p1_hp > 0 and p2_hp > 0 and rounds < max_rounds:
+            rounds += 1
             
-            return {
-                'status': 'ok',
-                'log': log,
-                'result': result,
-                'reward': reward,
-                'winner': winner,
-                'player': p1
-            }
-        except Exception as e:
-            print(f"[PVP ERROR] {e}")
-            return {'status': 'error', 'msg': f'PVP error: {str(e)}'}
+            # P1 attack
+            dmg = combat.damage(p1['atk'], p2['def'], self.rng)
+            p2_hp -= dmg
+            log.append(f"{p1_name} deals {dmg} dmg")
+            
+            if p2_hp <= 0:
+                break
+            
+            # P2 attack
+            dmg = combat.damage(p2['atk'], p1['def'], self.rng)
+            p1_hp -= dmg
+            log.append(f"{p2_name} deals {dmg} dmg")
+        
+        # Determine winner
+        if p1_hp > 0:
+            reward = 50 + (p2['level'] * 10)
+            change = matchmaking.rating_change(p1['rating'], p2['rating'])
+            p1['pvp_wins'] += 1
+            p1['gold'] += reward
+            p1['hp'] = max(1, p1_hp)
+            p1['rating'] += change
+            p2['pvp_loses'] += 1
+            p2['hp'] = 0
+            p2['rating'] -= change
+            result = f"{p1_name} WIN!"
+            winner = True
+        else:
+            reward = 50 + (p1['level'] * 10)
+            change = matchmaking.rating_change(p2['rating'], p1['rating'])
+            p2['pvp_wins'] += 1
+            p2['gold'] += reward
+            p2['hp'] = max(1, p2_hp)
+            p2['rating'] += change
+            p1['pvp_loses'] += 1
+            p1['hp'] = 0
+            p1['rating'] -= change
+            result = f"{p2_name} WIN!"
+            winner = False
+            change = -change
+        
+        # Save both players
+        self.db.save_player(p1)
+        if not remote:
+            self.db.save_player(p2)
+        
+        # Tell the opponent it was attacked. Behind a router its shard does
+        # that when the opponent is committed back.
+        attacked = {'by': p1_name, 'won': not winner, 'reward': reward, 'rating_change': -change, 'hp': p2['hp']}
+        if not remote:
+            self.hub.publish(f'player:{p2_name}', 'attacked', attacked)
+        
+        response = {
+            'status': 'ok',
+            'log': log,
+            'result': result,
+            'reward': reward,
+            'winner': winner,
+            'rating_change': change,
+            'player': p1
+        }
+        if remote:
+            response['_opponent'] = p2.to_dict()
+            response['_event'] = attacked
+        return response
+    
+    def pvp_queue(self, data, player):
+        # Runs without the player lock: a match is fought through process(),
+        # which locks both players in order.
+        name = player['name']
+        result = self.match_results.pop(name, None)
+        if result:
+            held = self.locks.acquire([name])
+            try:
+                return dict(result, status='ok', matched=True, player=player.public())
+            finally:
+                self.locks.release(held)
+        
+        if player['hp'] <= 0:
+            return {'status': 'error', 'msg': 'You are dead! Rest first'}
+        
+        for _ in range(self.MATCH_ATTEMPTS):
+            opponent = self.match_queue.match(name, player['rating'])
+            if opponent is None:
+                break
+            response = self.process({'cmd': 'pvp', 'player': name, 'opponent': opponent})
+            if response.get('status') == 'ok':
+                # The opponent finds out on its next pvp_queue
+                self.match_results[opponent] = {
+                    'opponent': name,
+                    'result': response['result'],
+                    'reward': response['reward'],
+                    'winner': not response['winner'],
+                    'rating_change': -response['rating_change'],
+                }
+                return dict(response, matched=True, opponent=opponent)
+            if player['hp'] <= 0:
+                return response
+            # Opponent died or is busy: it has left the queue, try another
+        
+        waited, width = self.match_queue.join(name, player['rating'])
+        return {'status': 'ok', 'matched': False, 'msg': 'Waiting for an opponent', 'rating': player['rating'],
+                'waited': round(waited, 1), 'window': width, 'queued': len(self.match_queue)}
     
-    def shop_list(self):
-        return {'status': 'ok', 'shop': self.shop_items}
+    def pvp_leave(self, data, player):
+        # A fight that already happened is handed over rather than forgotten
+        result = self.match_results.pop(player['name'], None)
+        if result:
+            return dict(result, status='ok', matched=True, player=player)
+        if not self.match_queue.leave(player['name']):
+            return {'status': 'error', 'msg': 'Not in the queue'}
+        return {'status': 'ok', 'msg': 'Left the queue'}
     
-    def buy_item(self, data):
-        name = data.get('player')
-        item = data.get('item')
+    def subscribe(self, data, session):
+        if session is None or session.push is None:
+            return {'status': 'error', 'msg': 'Push needs a protocol v2 connection'}
+        topics = data['topics']
+        if isinstance(topics, str):
+            topics = [topics]
+        if not isinstance(topics, list):
+            return {'status': 'error', 'msg': 'Invalid data'}
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
+        wanted = []
+        for topic in topics:
+            if topic == 'player':
+                if session.player is None:
+                    return {'status': 'error', 'msg': 'Log in first'}
+                topic = f'player:{session.player}'
+            if not isinstance(topic, str):
+                return {'status': 'error', 'msg': 'Invalid data'}
+            if topic.startswith('player:'):
+                if topic[7:] != session.player:
+                    return {'status': 'error', 'msg': f'Log in as {topic[7:]} first'}
+            elif topic != 'global' and not (topic.startswith('channel:') and 8 < len(topic) <= 40):
+                return {'status': 'error', 'msg': f'Unknown topic {topic}'}
+            wanted.append(topic)
+        if len(session.topics | set(wanted)) > self.MAX_TOPICS:
+            return {'status': 'error', 'msg': f'At most {self.MAX_TOPICS} topics'}
+        
+        for topic in wanted:
+            self.hub.subscribe(session, topic)
+        if f'player:{session.player}' in wanted:
+            player = self.db.get_player(session.player)
+            if player:
+                self.schedule_daily_reward(player)
+        return {'status': 'ok', 'topics': sorted(session.topics)}
+    
+    def unsubscribe(self, data, session):
+        if session is None:
+            return {'status': 'error', 'msg': 'Push needs a protocol v2 connection'}
+        topics = data.get('topics')
+        if isinstance(topics, str):
+            topics = [topics]
+        if topics is not None:
+            topics = [f'player:{session.player}' if topic == 'player' else topic for topic in topics]
+        self.hub.unsubscribe(session, topics)
+        return {'status': 'ok', 'topics': sorted(session.topics)}
+    
+    def say(self, data, session):
+        if session is None or session.player is None:
+            return {'status': 'error', 'msg': 'Log in first'}
+        channel = str(data['channel'])
+        if not 0 < len(channel) <= 32:
+            return {'status': 'error', 'msg': 'Invalid channel'}
+        self.hub.publish(f'channel:{channel}', 'message', {'from': session.player, 'text': str(data['text'])[:200]})
+        return {'status': 'ok'}
+    
+    def schedule_daily_reward(self, player):
+        # One pending reminder per player; the hub keeps only the newest
+        due = player.get('daily_reward_time', 0) + self.DAILY_REWARD_COOLDOWN
+        self.hub.publish_at(due, f"player:{player['name']}", 'daily_reward', {'available': True},
+                            key=('daily_reward', player['name']))
+    
+    def leaderboard_changed(self, board):
+        # Keyed, so a burst of changes to one board goes out as one event
+        self.hub.publish('global', 'leaderboard', {'board': board}, key=('leaderboard', board))
+    
+    def shop_list(self, data):
+        return self.catalog('shop', data)
+    
+    def buy_item(self, data, player):
+        item = data.get('item')
         
         if item not in self.shop_items:
             return {'status': 'error', 'msg': 'Item not found'}
@@ -460,14 +2167,9 @@ class GameServer:
         
         return {'status': 'ok', 'msg': f'Bought {item}', 'player': player}
     
-    def sell_item(self, data):
-        name = data.get('player')
+    def sell_item(self, data, player):
         item = data.get('item')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if item not in player['inventory']:
             return {'status': 'error', 'msg': 'Item not in inventory'}
         
@@ -481,17 +2183,12 @@ class GameServer:
         
         return {'status': 'ok', 'msg': f'Sold {item} for {sell_price} gold', 'player': player}
     
-    def quest_list(self):
-        return {'status': 'ok', 'quests': self.quests}
+    def quest_list(self, data):
+        return self.catalog('quests', data)
     
-    def accept_quest(self, data):
-        name = data.get('player')
+    def accept_quest(self, data, player):
         quest_id = data.get('quest_id')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if quest_id in player['active_quests']:
             return {'status': 'error', 'msg': 'Quest already active'}
         
@@ -500,14 +2197,9 @@ class GameServer:
         
         return {'status': 'ok', 'msg': f'Quest {quest_id} accepted'}
     
-    def complete_quest(self, data):
-        name = data.get('player')
+    def complete_quest(self, data, player):
         quest_id = data.get('quest_id')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if quest_id not in player['active_quests']:
             return {'status': 'error', 'msg': 'Quest not active'}
         
@@ -522,17 +2214,12 @@ class GameServer:
         
         return {'status': 'ok', 'msg': 'Quest completed!', 'reward': quest['reward']}
     
-    def skill_list(self):
-        return {'status': 'ok', 'skills': self.skills}
+    def skill_list(self, data):
+        return self.catalog('skills', data)
     
-    def use_skill(self, data):
-        name = data.get('player')
+    def use_skill(self, data, player):
         skill = data.get('skill')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if skill not in self.skills:
             return {'status': 'error', 'msg': 'Skill not found'}
         
@@ -544,56 +2231,100 @@ class GameServer:
         
         return {'status': 'ok', 'msg': f'Used {skill}', 'player': player}
     
-    def dungeon(self, data):
-        name = data.get('player')
-        player = self.db.get_player(name)
-        
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
+    def dungeon(self, data, player):
         level = player.get('dungeon_level', 0) + 1
         difficulty = ['goblin', 'orc', 'troll', 'dragon'][min(level-1, 3)]
         
-        result = self.hunt({'player': name, 'difficulty': difficulty})
+        result = self.hunt({'player': player['name'], 'difficulty': difficulty}, player)
         
-        if result['result'] == 'victory':
+        if result.get('result') == 'victory':
             player['dungeon_level'] = level
             self.db.save_player(player)
             result['msg'] = f'Dungeon Level {level} cleared!'
         
         return result
     
-    def daily_reward(self, data):
-        name = data.get('player')
-        player = self.db.get_player(name)
-        
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
+    def new_offline_seed(self, player):
+        player['offline_seed'] = int.from_bytes(os.urandom(8), 'big') >> 1
+        player['offline_journal'] = int.from_bytes(os.urandom(8), 'big') >> 1
+    
+    def offline_seed(self, data, player):
+        # Offline play until the next sync is rolled from a seed that never
+        # leaves the server; the client only gets the journal id to sync
+        # with. Asking again returns the same one, so a journal in progress
+        # stays valid.
+        if not player['offline_seed']:
+            self.new_offline_seed(player)
+            self.db.save_player(player)
+        return {'status': 'ok', 'journal': player['offline_journal']}
+    
+    def offline_action_ok(self, action):
+        # [cmd] or [cmd, arg], with the argument the command takes
+        if not isinstance(action, list) or not action or not isinstance(action[0], str):
+            return False
+        if action[0] not in self.OFFLINE_COMMANDS:
+            return False
+        field, kind = self.OFFLINE_COMMANDS[action[0]]
+        if field is None:
+            return len(action) == 1
+        return len(action) == 2 and type(action[1]) is kind
+    
+    def sync_offline(self, data, player):
+        """Replay a journal of offline actions, [cmd, arg] each, in order.
+        
+        The rolls come from the player's offline seed, so the same journal
+        always plays out the same way. Actions are checked like any other
+        request; the ones that fail are skipped and reported. The seed and
+        journal id are used up: a journal can't be synced twice.
+        """
+        seed = player['offline_seed']
+        actions = data['actions']
+        if not seed or data['journal'] != player['offline_journal']:
+            return {'status': 'error', 'msg': 'Offline journal expired, journal discarded'}
+        if not isinstance(actions, list) or len(actions) > self.MAX_OFFLINE_ACTIONS:
+            return {'status': 'error', 'msg': f'At most {self.MAX_OFFLINE_ACTIONS} offline actions'}
+        # The whole journal is checked before any of it is played
+        for index, action in enumerate(actions):
+            if not self.offline_action_ok(action):
+                return {'status': 'error', 'msg': f'Offline action {index} is malformed'}
+        
+        name = player['name']
+        rejected = []
+        try:
+            with self.rng.seeded(seed):
+                for index, action in enumerate(actions):
+                    sub = {'cmd': action[0], 'player': name}
+                    field = self.OFFLINE_COMMANDS[action[0]][0]
+                    if field:
+                        sub[field] = action[1]
+                    result = self.process(sub, nested=True)
+                    if result.get('status') != 'ok':
+                        rejected.append([index, result.get('msg')])
+        finally:
+            # Used up even if the replay stopped part way
+            self.new_offline_seed(player)
+            self.db.save_player(player)
+        return {'status': 'ok', 'applied': len(actions) - len(rejected), 'rejected': rejected,
+                'journal': player['offline_journal'], 'player': player}
+    
+    def daily_reward(self, data, player):
         now = time.time()
-        if now - player.get('daily_reward_time', 0) < 86400:
+        if now - player.get('daily_reward_time', 0) < self.DAILY_REWARD_COOLDOWN:
             return {'status': 'error', 'msg': 'Daily reward already claimed'}
         
-        reward = random.randint(100, 500)
+        reward = self.rng.randint(100, 500)
         player['gold'] += reward
         player['daily_reward_time'] = now
         self.db.save_player(player)
+        if self.hub.has_subscribers(f"player:{player['name']}"):
+            self.schedule_daily_reward(player)
         
         return {'status': 'ok', 'msg': f'Daily reward: {reward} gold', 'reward': reward}
     
-    def get_stats(self, data):
-        name = data.get('player')
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
+    def get_stats(self, data, player):
         return {'status': 'ok', 'player': player}
     
-    def get_inventory(self, data):
-        name = data.get('player')
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
+    def get_inventory(self, data, player):
         return {
             'status': 'ok',
             'inventory': player['inventory'],
@@ -602,14 +2333,9 @@ class GameServer:
             'ring': player['ring']
         }
     
-    def equip_item(self, data):
-        name = data.get('player')
+    def equip_item(self, data, player):
         item = data.get('item')
         
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
         if item not in player['inventory']:
             return {'status': 'error', 'msg': 'Item not in inventory'}
         
@@ -639,29 +2365,179 @@ class GameServer:
         self.db.save_player(player)
         return {'status': 'ok', 'msg': f'Equipped {item}', 'player': player}
     
-    def rest(self, data):
-        name = data.get('player')
-        player = self.db.get_player(name)
-        if not player:
-            return {'status': 'error', 'msg': 'Player not found'}
-        
+    def rest(self, data, player):
         player['hp'] = player['max_hp']
         player['mana'] = player['max_mana']
         self.db.save_player(player)
         return {'status': 'ok', 'msg': 'Fully restored', 'player': player}
     
-    def leaderboard(self):
-        players = sorted(
-            self.db.players.values(),
-            key=lambda x: (x['level'], x['exp']),
-            reverse=True
-        )[:20]
-        return {'status': 'ok', 'leaderboard': players}
+    def leaderboard(self, data):
+        board = data.get('board', 'level')
+        index = self.leaderboards.get(board)
+        if index is None:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        
+        players = [self.db.get_player(name) for name in index.top(20)]
+        return {'status': 'ok', 'board': board, 'leaderboard': players}
+    
+    def rank_entry(self, rank, name):
+        player = self.db.get_player(name)
+        return {
+            'rank': rank,
+            'name': name,
+            'class': player['class'],
+            'level': player['level'],
+            'exp': player['exp'],
+            'pvp_wins': player['pvp_wins'],
+            'dungeon_level': player.get('dungeon_level', 0),
+        }
+    
+    def my_rank(self, data):
+        name = data.get('player')
+        board = data.get('board', 'level')
+        index = self.leaderboards.get(board)
+        if index is None:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        
+        rank = index.rank(name)
+        if rank is None:
+            return {'status': 'error', 'msg': 'Player not found'}
+        return {'status': 'ok', 'board': board, 'rank': rank, 'total': len(index)}
+    
+    def rank_around(self, data):
+        name = data.get('player')
+        board = data.get('board', 'level')
+        radius = min(max(int(data.get('radius', 5)), 0), 25)
+        index = self.leaderboards.get(board)
+        if index is None:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        
+        start, names = index.around(name, radius)
+        if start is None:
+            return {'status': 'error', 'msg': 'Player not found'}
+        
+        players = [self.rank_entry(start + i, other) for i, other in enumerate(names)]
+        return {'status': 'ok', 'board': board, 'rank': index.rank(name), 'players': players}
+    
+    # --- internal commands, only registered on shards behind a router ---
+    
+    def checked_out(self, name):
+        lease = self.checkouts.get(name)
+        if lease and lease[1] < time.time():
+            del self.checkouts[name]
+            return False
+        return lease is not None
+    
+    def shard_checkout(self, data, player):
+        # Lends a player to another shard for one cross-shard command.
+        # Until it is committed, released or the lease runs out, commands
+        # that would change this player are turned away.
+        if self.checked_out(player['name']):
+            return {'status': 'error', 'msg': 'Player is busy, try again'}
+        self.checkouts[player['name']] = (data.get('token'), time.time() + float(data.get('ttl', 5)))
+        return {'status': 'ok', 'player': player.to_dict()}
+    
+    def shard_commit(self, data, player):
+        lease = self.checkouts.get(player['name'])
+        if not lease or lease[0] != data['token']:
+            return {'status': 'error', 'msg': 'Checkout expired'}
+        del self.checkouts[player['name']]
+        player.restore(data['data'])
+        self.db.save_player(player)
+        if data.get('event'):
+            self.hub.publish(f"player:{player['name']}", 'attacked', data['event'])
+        return {'status': 'ok'}
+    
+    def shard_release(self, data):
+        lease = self.checkouts.get(data['player'])
+        if lease and lease[0] == data['token']:
+            del self.checkouts[data['player']]
+        return {'status': 'ok'}
+    
+    def shard_rank_key(self, data):
+        index = self.leaderboards.get(data.get('board', 'level'))
+        if index is None:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        key = index.entries.get(data['player'])
+        if key is None:
+            return {'status': 'error', 'msg': 'Player not found'}
+        return {'status': 'ok', 'key': list(key)}
+    
+    def shard_publish(self, data):
+        # Channel messages from the router, which answers say itself
+        self.hub.publish(data['topic'], data['event'], data.get('data'))
+        return {'status': 'ok'}
+    
+    def shard_rank_window(self, data):
+        index = self.leaderboards.get(data.get('board', 'level'))
+        if index is None:
+            return {'status': 'error', 'msg': 'Unknown board'}
+        radius = min(max(int(data.get('radius', 0)), 0), 25)
+        ahead, keys = index.window(tuple(data['key']), radius)
+        entries = [[list(key), self.rank_entry(0, key[-1])] for key in keys]
+        return {'status': 'ok', 'ahead': ahead, 'total': len(index), 'entries': entries}
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RPG Game Server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='thread per connection, or a single asyncio event loop')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='executor threads for battle commands (asyncio engine)')
+    parser.add_argument('--db', choices=['pickle', 'sqlite'], default='pickle', help='storage backend')
+    parser.add_argument('--db-file', help='players file (default: players_data.pkl / players_data.db)')
+    parser.add_argument('--migrate', metavar='PKL', help='import a players_data.pkl into the SQLite file and exit')
+    parser.add_argument('--write-behind', type=int, default=0, metavar='MS',
+                        help='batch player saves, committing at most MS milliseconds late (0 = off)')
+    parser.add_argument('--write-behind-max', type=int, default=100, metavar='N',
+                        help='commit a batch early once N players are dirty')
+    parser.add_argument('--fsync', action='store_true',
+                        help='sync every save to disk (durable requests always are)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+    parser.add_argument('--admin-token', help='token required by the metrics command (refused without one)')
+    parser.add_argument('--idle-timeout', type=float, default=900, metavar='SECONDS',
+                        help='close connections that send nothing for this long (0 = never)')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='run N shard processes behind a router (players split by name)')
+    parser.add_argument('--shard-port', type=int, metavar='PORT',
+                        help='first local port for the shards (default: --port + 1)')
+    parser.add_argument('--log-file', help='write JSON lines request logs here instead of stdout')
+    parser.add_argument('--log-max-mb', type=int, default=10, help='rotate the log file at this size')
+    parser.add_argument('--log-sample', default='', metavar='CMD=RATE,...',
+                        help='log only this fraction of successful requests, e.g. hunt=0.1,shop_list=0')
+    args = parser.parse_args()
+    
     try:
-        server = GameServer()
-        server.start()
+        if args.migrate:
+            migrate_pickle_to_sqlite(args.migrate, args.db_file or 'players_data.db')
+            sys.exit(0)
+        
+        if args.shards:
+            import router
+            router.run(args)
+            sys.exit(0)
+        
+        if args.db == 'sqlite':
+            db = SQLiteGameDatabase(args.db_file or 'players_data.db',
+                                    write_behind_ms=args.write_behind,
+                                    write_behind_max=args.write_behind_max, fsync=args.fsync)
+        else:
+            db = GameDatabase(args.db_file or 'players_data.pkl', fsync=args.fsync,
+                              write_behind_ms=args.write_behind,
+                              write_behind_max=args.write_behind_max)
+        
+        log = gamelog.AsyncLogger(args.log_file, max_bytes=args.log_max_mb * 1024 * 1024,
+                                  sample=gamelog.parse_sample(args.log_sample))
+        server = GameServer(args.host, args.port, db, workers=args.workers, admin_token=args.admin_token,
+                            log=log, idle_timeout=args.idle_timeout)
+        if args.metrics_port:
+            metrics.serve_prometheus(server.metrics, args.metrics_port)
+        if args.engine == 'asyncio':
+            server.start_async()
+        else:
+            server.start()
     except KeyboardInterrupt:
         print("\n[!] Shutdown")
     except Exception as e: